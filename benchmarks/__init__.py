@@ -0,0 +1,7 @@
+"""
+Benchmarks for netmri-bootstrap hot paths. They run against synthetic
+repositories (see benchmarks.synthetic), so no NetMRI server is needed:
+
+    python -m benchmarks run --files 2000 --commits 50 -o baseline.json
+    python -m benchmarks compare baseline.json current.json --threshold 0.2
+"""
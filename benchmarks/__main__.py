@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+from benchmarks import suite, synthetic
+
+
+def parse_cmdline_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmarks for netmri-bootstrap")
+    parser.add_argument('--debug', action='store_true', help="Enable debug logging")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Build synthetic repo and time hot paths")
+    run_parser.add_argument('--files', type=int, default=1000, help="Number of object files")
+    run_parser.add_argument('--commits', type=int, default=20, help="Depth of history")
+    run_parser.add_argument('--changes-per-commit', type=int, default=20,
+                            help="Files changed by every commit after the first one")
+    run_parser.add_argument('--note-ratio', type=float, default=1.0,
+                            help="Share of files that have git note")
+    run_parser.add_argument('--sample', type=int, default=50,
+                            help="Number of files used by per-file benchmarks")
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--repo', help="Where to build the repo (default: temporary directory)")
+    run_parser.add_argument('--keep', action='store_true', help="Don't delete the repo after run")
+    run_parser.add_argument('--only', action='append', metavar="SUBSTRING",
+                            help="Run only benchmarks whose name contains SUBSTRING")
+    run_parser.add_argument('-o', '--output', help="Save results to this JSON file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare results with baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="Report slowdowns above this fraction (default: 0.1 = 10%%)")
+    return parser.parse_args()
+
+
+def run(args):
+    params = {
+        "files": args.files,
+        "commits": args.commits,
+        "changes_per_commit": args.changes_per_commit,
+        "note_ratio": args.note_ratio,
+        "sample": args.sample,
+        "seed": args.seed,
+    }
+    tmp_dir = None
+    repo_path = args.repo
+    if repo_path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="netmri-bootstrap-bench-")
+        repo_path = os.path.join(tmp_dir, "repo")
+    try:
+        paths_by_class = synthetic.build_repo(repo_path, files=args.files, commits=args.commits,
+                                              changes_per_commit=args.changes_per_commit,
+                                              note_ratio=args.note_ratio, seed=args.seed)
+        ctx = suite.Context(repo_path, paths_by_class, sample_size=args.sample, seed=args.seed)
+        results = suite.run_suite(ctx, repeat=args.repeat, names=args.only)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp_dir or repo_path, ignore_errors=True)
+
+    print(f"{'benchmark':<50} {'items':>7} {'median, ms':>11} {'min, ms':>9} {'per item, ms':>13}")
+    for name, res in results.items():
+        per_item = res["median"] / res["items"] * 1000 if res["items"] else 0.0
+        print(f"{name:<50} {res['items']:>7} {res['median'] * 1000:>11.2f} "
+              f"{res['min'] * 1000:>9.2f} {per_item:>13.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({"params": params, "environment": suite.get_environment(),
+                       "results": results}, fh, indent=2)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.current) as fh:
+        current = json.load(fh)
+    if baseline["params"] != current["params"]:
+        print(f"WARNING: runs used different parameters: {baseline['params']} vs {current['params']}",
+              file=sys.stderr)
+
+    regressions = 0
+    print(f"{'benchmark':<50} {'baseline, ms':>13} {'current, ms':>12} {'change':>8}")
+    for name, old, new, ratio, is_regression in suite.compare(baseline, current, args.threshold):
+        if ratio is None:
+            status = "missing in baseline" if old is None else "missing in current run"
+            print(f"{name:<50} {status}")
+            continue
+        mark = "  SLOWER" if is_regression else ""
+        print(f"{name:<50} {old * 1000:>13.2f} {new * 1000:>12.2f} {(ratio - 1) * 100:>+7.1f}%{mark}")
+        regressions += is_regression
+    if regressions:
+        print(f"{regressions} benchmark(s) got slower by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main():
+    args = parse_cmdline_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
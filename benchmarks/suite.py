@@ -0,0 +1,235 @@
+"""
+Benchmark definitions and timing. Every benchmark is a function that
+prepares its data and returns a callable to time; the callable returns
+number of items it has processed, so results can be compared per item.
+Benchmarks with "cold" in the name drop repo caches on every run.
+"""
+import os
+import sys
+import time
+import random
+import platform
+import statistics
+import subprocess
+import logging
+from netmri_bootstrap import config
+from netmri_bootstrap.objects import api
+from netmri_bootstrap.objects import git
+from benchmarks import synthetic
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+class Context():
+    """Synthetic repo shared by all benchmarks of one run"""
+
+    def __init__(self, repo_path, paths_by_class, sample_size=50, seed=0):
+        self.repo_path = repo_path
+        self.paths_by_class = paths_by_class
+        self.sample_size = sample_size
+        self.random = random.Random(seed)
+        config._config = config.BootstrapperConfig(
+            host="localhost", username="benchmark", password="benchmark",
+            scripts_root=repo_path, bootstrap_branch="master",
+            skip_readonly_objects=True, class_paths=synthetic.CLASS_PATHS)
+        config._client = None
+
+    def get_repo(self):
+        return git.Repo(self.repo_path, "master")
+
+    def sample_paths(self, class_name=None):
+        if class_name is None:
+            paths = [p for paths in self.paths_by_class.values() for p in paths]
+        else:
+            paths = self.paths_by_class[class_name]
+        return self.random.sample(paths, min(self.sample_size, len(paths)))
+
+    def sample_blobs(self, repo, class_name=None):
+        commit = repo.get_head_commit()
+        return [git.Blob.from_path(repo, path, commit=commit)
+                for path in self.sample_paths(class_name)]
+
+
+@benchmark("Repo.object_index (cold)")
+def bench_object_index(ctx):
+    repo = ctx.get_repo()
+
+    def run():
+        repo.reset_notes()
+        return sum(len(subindex) for subindex in repo.object_index.values())
+    return run
+
+
+@benchmark("Repo.detect_changes (since sync)")
+def bench_detect_changes(ctx):
+    repo = ctx.get_repo()
+
+    def run():
+        added, deleted, changed = repo.detect_changes()
+        return len(added) + len(deleted) + len(changed)
+    return run
+
+
+@benchmark("Repo.detect_changes (whole history)")
+def bench_detect_changes_all(ctx):
+    repo = ctx.get_repo()
+    first_commit = repo.git.rev_list("--max-parents=0", "HEAD").split()[0]
+
+    def run():
+        added, deleted, changed = repo.detect_changes(old_state=first_commit)
+        return len(added) + len(deleted) + len(changed)
+    return run
+
+
+@benchmark("Blob.find_note_on_ancestors (cold)")
+def bench_find_note_cold(ctx):
+    repo = ctx.get_repo()
+    paths = ctx.sample_paths()
+
+    def run():
+        repo.reset_notes()
+        commit = repo.get_head_commit()
+        for path in paths:
+            git.Blob.from_path(repo, path, commit=commit).find_note_on_ancestors()
+        return len(paths)
+    return run
+
+
+@benchmark("Blob.find_note_on_ancestors (cached notes)")
+def bench_find_note_cached(ctx):
+    repo = ctx.get_repo()
+    repo.load_notes()
+    paths = ctx.sample_paths()
+
+    def run():
+        commit = repo.get_head_commit()
+        for path in paths:
+            git.Blob.from_path(repo, path, commit=commit).find_note_on_ancestors()
+        return len(paths)
+    return run
+
+
+@benchmark("Repo.path_exists")
+def bench_path_exists(ctx):
+    repo = ctx.get_repo()
+    paths = ctx.sample_paths()[:10] + ["scripts/does_not_exist.py"]
+
+    def run():
+        for path in paths:
+            repo.path_exists(path)
+        return len(paths)
+    return run
+
+
+@benchmark("Repo.get_blobs")
+def bench_get_blobs(ctx):
+    repo = ctx.get_repo()
+
+    def run():
+        return sum(1 for _ in repo.get_blobs())
+    return run
+
+
+def _bench_from_blob(class_name):
+    def bench(ctx):
+        repo = ctx.get_repo()
+        repo.load_notes()
+        blobs = ctx.sample_blobs(repo, class_name)
+
+        def run():
+            for blob in blobs:
+                # Blobs cache their notes, so every run starts with new ones
+                api.ApiObject.from_blob(git.Blob(repo, blob._blob))
+            return len(blobs)
+        return run
+    return bench
+
+
+def _bench_set_metadata(class_name):
+    def bench(ctx):
+        repo = ctx.get_repo()
+        repo.load_notes()
+        objects = [api.ApiObject.from_blob(blob) for blob in ctx.sample_blobs(repo, class_name)]
+
+        def run():
+            for obj in objects:
+                obj.set_metadata_from_content()
+            return len(objects)
+        return run
+    return bench
+
+
+for _class_name in synthetic.CLASS_PATHS:
+    benchmark(f"ApiObject.from_blob [{_class_name}]")(_bench_from_blob(_class_name))
+    benchmark(f"set_metadata_from_content [{_class_name}]")(_bench_set_metadata(_class_name))
+
+
+def time_benchmark(func, repeat):
+    timings = []
+    items = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = func()
+        timings.append(time.perf_counter() - started)
+    return {
+        "repeat": repeat,
+        "items": items,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def get_environment():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = None
+    git_version = subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip()
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "git": git_version,
+        "revision": revision,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def run_suite(ctx, repeat=5, names=None):
+    """Runs benchmarks (all of them, unless names are given) and returns
+    dict of results by benchmark name"""
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if names and not any(n.lower() in name.lower() for n in names):
+            continue
+        logger.info(f"Running {name}")
+        results[name] = time_benchmark(func(ctx), repeat)
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares median timings of two runs. Returns list of rows
+    (name, baseline median, current median, ratio, is_regression);
+    ratio is None for benchmarks missing in one of the runs
+    """
+    rows = []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if old is None or new is None:
+            rows.append((name, old and old["median"], new and new["median"], None, False))
+            continue
+        ratio = new["median"] / old["median"] if old["median"] else float("inf")
+        rows.append((name, old["median"], new["median"], ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,241 @@
+"""
+Builds synthetic netmri-bootstrap repositories: a tree of object files
+of every class, a history of commits that change some of them, and git
+notes like the ones left by init and push. History is written with
+git fast-import, so even large repos take seconds to build.
+"""
+import os
+import json
+import random
+import hashlib
+import subprocess
+import logging
+from netmri_bootstrap.objects.git import _Note
+logger = logging.getLogger(__name__)
+
+# Same layout as in tests/test_config_full.json
+CLASS_PATHS = {
+    "Script": "scripts",
+    "ScriptModule": "script_modules",
+    "ConfigList": "lists",
+    "ConfigTemplate": "config_templates",
+    "PolicyRule": "policy/rules",
+    "Policy": "policy",
+}
+# Relative share of every class in generated repo
+CLASS_WEIGHTS = {
+    "Script": 40,
+    "ScriptModule": 10,
+    "ConfigList": 15,
+    "ConfigTemplate": 10,
+    "PolicyRule": 20,
+    "Policy": 5,
+}
+UPDATED_AT = "2020-08-10 04:25:48"
+
+
+def _script(i, rnd):
+    lines = ["# BEGIN-INTERNAL-SCRIPT-BLOCK",
+             f"### Script-Level: {rnd.randint(1, 3)}",
+             f"### Script-Category: category{i % 5}",
+             "### Script-Language: Python",
+             f"# Script: script {i}",
+             f"# Script-Description: Synthetic script number {i}",
+             "# END-INTERNAL-SCRIPT-BLOCK",
+             "",
+             "# BEGIN-SCRIPT-BLOCK",
+             "# Script-Filter:",
+             "#   true",
+             "# END-SCRIPT-BLOCK"]
+    lines += [f"x{n} = {rnd.randint(0, 1000)}" for n in range(rnd.randint(20, 200))]
+    return f"scripts/category{i % 5}/script_{i}.py", lines
+
+
+def _script_module(i, rnd):
+    lines = ["#" * 79,
+             f"# Name: module_{i}",
+             "# Category: None",
+             "# Language: Python",
+             f"# Description: Synthetic module number {i}",
+             "#" * 79,
+             ""]
+    lines += [f"def func{n}():\n    return {n}" for n in range(rnd.randint(10, 100))]
+    return f"script_modules/module_{i}.py", lines
+
+
+def _config_list(i, rnd):
+    lines = ["#" * 35,
+             f"# Name:        list {i}",
+             f"# Description: Synthetic list number {i}",
+             "#" * 35,
+             "",
+             '"DeviceID","Text"']
+    lines += [f'"{n}","value {rnd.randint(0, 10 ** 6)}"' for n in range(rnd.randint(10, 500))]
+    return f"lists/list_{i}.csv", lines
+
+
+def _config_template(i, rnd):
+    lines = [f"## Export of Template: template {i}",
+             "## Template-Level: 1",
+             "## Template-Vendor: Cisco",
+             "## Template-Device Type: Router",
+             "## Template-Model: ",
+             "## Template-Version: ",
+             "## Template-Variable: $name",
+             f"## Template-Description: Synthetic template number {i}",
+             "hostname $name"]
+    lines += [f"interface Loopback{n}" for n in range(rnd.randint(5, 50))]
+    return f"config_templates/template_{i}.txt", lines
+
+
+def _policy_rule(i, rnd):
+    lines = ["<?xml version='1.0' encoding='UTF-8'?>",
+             "<policy-rule>",
+             "  <action-after-exec nil=\"true\"></action-after-exec>",
+             "  <author>admin</author>",
+             f"  <description>Synthetic rule number {i}</description>",
+             f"  <name>rule {i}</name>",
+             "  <read-only type=\"boolean\">false</read-only>",
+             "  <remediation>None</remediation>",
+             "  <severity>info</severity>",
+             f"  <short-name>rule_{i}</short-name>",
+             "  <PolicyRuleLogic xmlns=\"http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml\" "
+             "editor=\"basic-file\"><If><Expr op=\"and\">"]
+    lines += [f"<ConfigFileCheck op=\"contains-some\">pattern {n}</ConfigFileCheck>"
+              for n in range(rnd.randint(1, 20))]
+    lines += ["</Expr><Then><PolicyRulePass/></Then><Else><PolicyRuleFail/></Else></If></PolicyRuleLogic>",
+              "</policy-rule>"]
+    return f"policy/rules/rule_{i}.xml", lines
+
+
+def _policy(i, rnd):
+    lines = ["<?xml version='1.0' encoding='UTF-8'?>",
+             "<policy>",
+             "  <author>admin</author>",
+             f"  <description>Synthetic policy number {i}</description>",
+             f"  <name>policy {i}</name>",
+             "  <read-only type=\"boolean\">false</read-only>",
+             "  <schedule-mode>change</schedule-mode>",
+             f"  <short-name>policy_{i}</short-name>",
+             "  <policy-rules type=\"array\">"]
+    lines += [f"    <policy-rule-reference>rule_{n}</policy-rule-reference>"
+              for n in range(rnd.randint(1, 10))]
+    lines += ["  </policy-rules>", "</policy>"]
+    return f"policy/policy_{i}.xml", lines
+
+
+GENERATORS = {
+    "Script": _script,
+    "ScriptModule": _script_module,
+    "ConfigList": _config_list,
+    "ConfigTemplate": _config_template,
+    "PolicyRule": _policy_rule,
+    "Policy": _policy,
+}
+
+
+def _blob_id(data):
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class _FastImport():
+    """Writes fast-import stream to git"""
+
+    def __init__(self, repo_path):
+        self.proc = subprocess.Popen(["git", "fast-import", "--quiet"], cwd=repo_path,
+                                     stdin=subprocess.PIPE)
+        self.timestamp = 1600000000
+
+    def write(self, *lines):
+        for line in lines:
+            if isinstance(line, str):
+                line = line.encode("utf8")
+            self.proc.stdin.write(line + b"\n")
+
+    def data(self, content):
+        if isinstance(content, str):
+            content = content.encode("utf8")
+        self.write(f"data {len(content)}", content)
+
+    def commit(self, ref, message):
+        self.timestamp += 60
+        self.write(f"commit {ref}",
+                   f"committer netmri-bootstrap <bench@example.com> {self.timestamp} +0000")
+        self.data(message)
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError("git fast-import has failed")
+
+
+def build_repo(path, files=1000, commits=10, changes_per_commit=20, note_ratio=1.0,
+               seed=0, branch="master"):
+    """
+    Creates repository in path with given number of object files.
+    First commit adds all files and files get notes with probability
+    note_ratio. Every following commit changes changes_per_commit random
+    files. Half of the changed files get their notes moved to new blob,
+    like push does; the rest keep notes on older revisions, so
+    find_note_on_ancestors has to walk the history.
+    Returns dict with paths of generated files by class name.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", "-b", branch, path], check=True)
+    total_weight = sum(CLASS_WEIGHTS.values())
+    counts = {name: max(1, files * weight // total_weight) for name, weight in CLASS_WEIGHTS.items()}
+
+    contents = {}
+    classes = {}
+    paths_by_class = {name: [] for name in CLASS_PATHS}
+    for class_name, count in counts.items():
+        for i in range(count):
+            file_path, lines = GENERATORS[class_name](i, rnd)
+            contents[file_path] = lines
+            classes[file_path] = class_name
+            paths_by_class[class_name].append(file_path)
+
+    object_ids = {file_path: n for n, file_path in enumerate(sorted(contents), start=1)}
+    notes = {}
+
+    def note_for(file_path, blob_id):
+        return {"id": object_ids[file_path], "path": file_path, "updated_at": UPDATED_AT,
+                "blob": blob_id, "class": classes[file_path], "error": None}
+
+    fast_import = _FastImport(path)
+    ref = f"refs/heads/{branch}"
+    fast_import.commit(ref, "Repository initialised by netmri-bootstrap")
+    for file_path, lines in contents.items():
+        data = "\n".join(lines).encode("utf8")
+        fast_import.write(f"M 100644 inline {file_path}")
+        fast_import.data(data)
+        if rnd.random() < note_ratio:
+            notes[file_path] = _blob_id(data)
+
+    for n in range(1, commits):
+        fast_import.commit(ref, f"Change {n}")
+        for file_path in rnd.sample(sorted(contents), min(changes_per_commit, len(contents))):
+            if file_path.endswith(".xml"):
+                contents[file_path].append(f"<!-- changed in commit {n} -->")
+            else:
+                contents[file_path].append(f"# changed in commit {n}")
+            data = "\n".join(contents[file_path]).encode("utf8")
+            fast_import.write(f"M 100644 inline {file_path}")
+            fast_import.data(data)
+            if file_path in notes and rnd.random() < 0.5:
+                notes[file_path] = _blob_id(data)
+
+    # fast-import can attach notes only to commits, so notes tree is written
+    # as regular files named after annotated blobs (that's what notes ref
+    # contains; git doesn't require fan-out directories when reading it)
+    fast_import.commit(_Note.bootstrap_notes_ref, "Notes added by netmri-bootstrap")
+    for file_path, blob_id in notes.items():
+        fast_import.write(f"M 100644 inline {blob_id}")
+        fast_import.data(json.dumps(note_for(file_path, blob_id)))
+    fast_import.close()
+    subprocess.run(["git", "-C", path, "reset", "-q", "--hard"], check=True)
+    subprocess.run(["git", "-C", path, "tag", "synced_to_netmri", f"{branch}~{commits // 2}"], check=True)
+    logger.debug(f"Built repo in {path} with {len(contents)} files, {commits} commits "
+                 f"and {len(notes)} notes")
+    return paths_by_class
@@ -1,18 +1,27 @@
 import os
+import fnmatch
 import logging
 import time
-from netmri_bootstrap import config
+import contextlib
+from netmri_bootstrap import aio, config, dryrun, profiling
+from netmri_bootstrap.concurrency import run_parallel, process_pool
+from netmri_bootstrap.pipeline import Pipeline
+from netmri_bootstrap.checkpoint import InitCheckpoint, PushJournal
 from netmri_bootstrap.objects import git
 from netmri_bootstrap.objects import api
 logger = logging.getLogger(__name__)
 
 
 class Bootstrapper:
+    """Syncs the repo with a single target: the one set by
+    config.use_target(), or the first one in config. See push_to_targets
+    and check_targets for running on many targets at once"""
     def __init__(self, repo=None):
         self.config = config.get_config()
 
         if repo is None:
-            repo = git.Repo(self.config.scripts_root, self.config.bootstrap_branch)
+            repo = git.Repo(self.config.scripts_root, self.config.bootstrap_branch,
+                            target=config.get_target())
         self.repo = repo
 
     @classmethod
@@ -20,79 +29,449 @@ class Bootstrapper:
         conf = config.get_config()
         logger.debug(f"Creating empty git repository in {conf.scripts_root}")
         os.makedirs(conf.scripts_root)
-        repo = git.Repo.init_empty_repo(conf.scripts_root, conf.bootstrap_branch)
+        repo = git.Repo.init_empty_repo(conf.scripts_root, conf.bootstrap_branch,
+                                        target=config.get_target())
         return cls(repo=repo)
 
-    def export_from_netmri(self):
-        """Download all objects of given class (init subcommand)"""
+    @classmethod
+    def run_on_targets(cls, func, names=None):
+        """
+        Calls func(bootstrapper) for every target (all targets in config if
+        names is None) concurrently. Every call gets its own Bootstrapper,
+        Repo and API client. Returns list of (target, result, exception)
+        """
+        if names:
+            targets = [config.get_target(name) for name in names]
+        else:
+            targets = config.get_config().get_targets()
+
+        def run(target):
+            with config.use_target(target.name):
+                return func(cls())
+        return run_parallel(run, targets, max_workers=len(targets))
+
+    @classmethod
+    def push_to_targets(cls, names=None, retry_errors=False):
+        """
+        Push changes to every target concurrently (push subcommand).
+        Changes are found once for all targets that have been synced to the
+        same commit, and the same change set is pushed to all of them.
+        Raises ValueError if push to any target has failed
+        """
+        conf = config.get_config()
+        head = git.Repo(conf.scripts_root, conf.bootstrap_branch).get_head_commit()
+        # Changes are found in the main thread and adopted by Repo of every
+        # push thread (see Repo.adopt_blob)
+        changes_by_base = {}
+        plan = {}
+        for name in (names or [target.name for target in conf.get_targets()]):
+            with config.use_target(name):
+                bs = cls()
+                base = bs._get_push_base()
+                if str(base) not in changes_by_base:
+                    changes_by_base[str(base)] = bs.repo.detect_changes(old_state=base, new_state=head)
+                plan[name] = changes_by_base[str(base)]
+        logger.debug(f"Found {len(changes_by_base)} change sets for {len(plan)} targets")
+
+        def push(bs):
+            return bs.update_netmri(retry_errors=retry_errors,
+                                    new_state=bs.repo.repo.commit(head.hexsha),
+                                    changes=plan[bs.repo.target_name])
+        failed = []
+        for target, _, error in cls.run_on_targets(push, names):
+            if error is not None:
+                logger.error(f"Push to {target.name or target.host} has failed: {error}")
+                logger.debug("Push failure details", exc_info=error)
+                failed.append(target.name or target.host)
+        if failed:
+            raise ValueError(f"Push has failed for {', '.join(failed)}")
+
+    @classmethod
+    def check_targets(cls, names=None, local_only=False):
+        """Check every target concurrently (check subcommand). Working tree
+        is checked only once. Returns True if all targets are in sync"""
+        err_count = cls()._local_check()
+        if local_only:
+            return err_count
+        all_clear = err_count == 0
+
+        def check(bs):
+            return bs.check_netmri(skip_local=True)
+        for target, res, error in cls.run_on_targets(check, names):
+            name = target.name or target.host
+            if error is not None:
+                logger.error(f"Check of {name} has failed: {error}")
+                all_clear = False
+            elif not res:
+                logger.warning(f"{name} is not in sync with the repository")
+                all_clear = False
+        return all_clear
+
+    @profiling.traced()
+    def export_from_netmri(self, resume=False):
+        """Download all objects of given class (init subcommand)
+        Objects are committed along with their notes in chunks of
+        init_chunk_size, and every chunk is recorded in checkpoint.
+        resume: continue interrupted init, skipping objects that have
+        been committed already
+        """
+        checkpoint = InitCheckpoint(self.repo)
+        if resume:
+            if not checkpoint.exists():
+                raise ValueError(f"There is no interrupted init to resume in {self.repo.path}")
+            checkpoint.load()
+            logger.info(f"Resuming init: {checkpoint.count()} objects are already in the repo")
+            # Drop files of the chunk that hasn't been committed
+            self.repo.repo.head.reset(index=True, working_tree=True)
+        else:
+            checkpoint.save()
+
+        def source():
+            for klass in self.get_object_classes():
+                broker = klass.get_broker()
+                logger.debug(f"getting index of {broker.controller}")
+                for item in klass.iter_index(full=True):
+                    # NetMRI comes with a lot of pre-installed policies and rules.
+                    # These rules cannot be edited by user, so there is little point in keeping them in the repo
+                    if self.config.skip_readonly_objects and getattr(item, "read_only", False):
+                        logger.debug(f"skipping {klass.__name__} \"{item.name}\" because it's read-only")
+                        continue
+                    if checkpoint.is_done(klass.__name__, item.id):
+                        logger.debug(f"skipping {broker.controller} id {item.id}: it's already in the repo")
+                        continue
+                    logger.debug(f"processing {broker.controller} id {item.id}")
+                    obj = klass.from_api(item)
+                    obj.path = obj.generate_path()
+                    yield obj
+
+        chunk = []
+
+        def commit(item):
+            obj, _ = item
+            chunk.append(obj)
+            if len(chunk) >= self.config.init_chunk_size:
+                self._commit_init_chunk(chunk, checkpoint)
+                chunk.clear()
+
         logger.debug("Downloading API items from NetMRI")
-        saved_objs = []
+        self._run_pipeline("init", source(), commit)
+        if chunk or checkpoint.chunks == 0:
+            self._commit_init_chunk(chunk, checkpoint)
+        self.repo.mark_bootstrap_sync(self.repo.get_head_commit())
+        checkpoint.remove()
+
+    def _commit_init_chunk(self, objs, checkpoint):
+        if objs:
+            blobs = self.repo.stage_files([obj.path for obj in objs])
+            for obj, blob in zip(objs, blobs):
+                obj._blob = blob
+                # Content is in the repo now, no need to keep it in memory
+                obj._content = None
+        checkpoint.chunks += 1
+        message = "Repository initialised by netmri-bootstrap"
+        if checkpoint.chunks > 1:
+            message += f" (part {checkpoint.chunks})"
+        logger.debug(f"Committing {len(objs)} downloaded objects to repo")
+        self.repo.commit(message=message)
+        with profiling.span("save notes"):
+            with self.repo.notes_transaction():
+                for obj in objs:
+                    obj.save_note()
+        for obj in objs:
+            checkpoint.add(obj.__class__.__name__, obj.id)
+        checkpoint.save()
+
+    def _run_pipeline(self, name, source, sink):
+        """
+        Passes objects from source (iterable of objects made by from_api)
+        through download, render and write stages running at the same
+        time (see pipeline.Pipeline). sink((obj, written)) is called in
+        this thread for every object written to the working tree, written
+        being the result of ApiObject.write_to_repo. Objects that fail to
+        download or render are logged and dropped. Returns stage stats
+        """
+        # Authenticate and create brokers before threads start using them.
+        # Writers look notes up in a copy of the index: sink changes notes
+        # of the repo while they run
+        config.get_api_client()
         for klass in self.get_object_classes():
-            broker = klass.get_broker()
-            logger.debug(f"getting index of {broker.controller}")
-            for item in klass.index():
-                # NetMRI comes with a lot of pre-installed policies and rules.
-                # These rules cannot be edited by user, so there is little point in keeping them in the repo
-                if self.config.skip_readonly_objects and getattr(item, "read_only", False):
-                    logger.debug(f"skipping {klass.__name__} \"{item.name}\" because it's read-only")
-                    continue
-                logger.debug(f"processing {broker.controller} id {item.id}")
-                obj = klass.from_api(item)
-                obj.path = obj.generate_path()
+            klass.get_broker()
+        notes = {name: dict(subindex) for name, subindex in self.repo.object_index.items()}
+        xml_processes = self.config.xml_processes
+
+        with contextlib.ExitStack() as stack:
+            executor = None
+            if xml_processes:
+                executor = stack.enter_context(process_pool(xml_processes))
+
+            def download(obj):
+                if executor is not None and isinstance(obj, api.XmlObject):
+                    obj.render_in_worker = True
                 try:
-                    obj.load_content_from_api()
+                    with profiling.span(f"{obj.__class__.__name__} download", category="content"):
+                        obj.load_content_from_api()
                 except Exception as e:
                     msg = obj._parse_error(e)
-                    logger.error(f"Cannot sync {broker.controller} id {item.id}: {msg}")
-                    continue
-                self.repo.write_file(obj.path, obj.export_to_repo())
-                saved_objs.append(obj)
-
-                obj._blob = self.repo.stage_file(obj.path)
-                saved_objs.append(obj)
-
-        logger.debug("Committing downloaded objects to repo")
-        commit = self.repo.commit(message="Repository initialised by netmri-bootstrap")
-        self.repo.mark_bootstrap_sync(commit)
-        for obj in saved_objs:
-            obj.save_note()
-
-    def update_netmri(self, retry_errors=False):
+                    logger.error(f"Cannot sync {obj.get_broker().controller} id {obj.id}: {msg}")
+                    return None
+                return obj
+
+            def render(obj):
+                with profiling.span(f"{obj.__class__.__name__} render", category="content"):
+                    if isinstance(obj, api.XmlObject) and obj.render_in_worker:
+                        (_, error), = api.render_xml_objects([obj], xml_processes, executor=executor)
+                        if error is not None:
+                            logger.error(f"Cannot sync {obj.get_broker().controller} id {obj.id}: {error}")
+                            return None
+                    return obj, obj.export_to_repo()
+
+            def write(item):
+                obj, content = item
+                return obj, obj.write_to_repo(self.repo, content,
+                                              notes=notes.get(obj.__class__.__name__, {}))
+
+            pipeline = Pipeline(name, queue_size=self.config.pipeline_queue_size)
+            pipeline.add_stage("download", download, workers=self.config.max_workers)
+            pipeline.add_stage("render", render, workers=max(self.config.render_workers, xml_processes))
+            pipeline.add_stage("write", write, workers=self.config.write_workers)
+            return pipeline.run(source, sink)
+
+    @profiling.traced()
+    def update_netmri(self, retry_errors=False, old_state=None, new_state=None, changes=None):
         """Update all objects changed since last synced commit
         retry_errors: also sync objects that had error on previous sync
+        old_state, new_state: push changes between these commits instead
+        changes: (added, deleted, changed) blobs, if they have been found
+        already (see push_to_targets). new_state must be given with them
         """
-        added, deleted, changed = self.repo.detect_changes()
+        # Branch may be updated while we push. Make sure we don't mark
+        # commits that we haven't seen as synced
+        target = new_state
+        if target is None:
+            target = self.repo.get_head_commit()
+        if changes is None:
+            if old_state is None:
+                old_state = self._get_push_base()
+            added, deleted, changed = self.repo.detect_changes(old_state=old_state,
+                                                               new_state=target)
+        else:
+            added, deleted, changed = ([self.repo.adopt_blob(blob) for blob in blobs]
+                                       for blobs in changes)
+        added, deleted, changed = (self._object_blobs(blobs) for blobs in (added, deleted, changed))
         if not retry_errors and len(added) == 0 and len(deleted) == 0 and len(changed) == 0:
             logger.info("No changes to push to server")
+            # Commits that touch only files other than objects count as synced
+            self.repo.mark_bootstrap_sync(target)
             return
 
-        for blob in deleted:
-            logger.debug(f"deleting {blob.path} on netmri")
-            script = api.ApiObject.from_blob(blob)
-            script.delete_on_server()
-
-        for blob in added:
-            logger.debug(f"adding {blob.path} on netmri")
-            script = api.ApiObject.from_blob(blob)
-            script.push_to_api()
-
-        for blob in changed:
-            logger.debug(f"updating {blob.path} on netmri")
-            script = api.ApiObject.from_blob(blob)
-            script.push_to_api()
-
-        if retry_errors:
-            for class_subindex in self.repo.failed_objects.values():
-                for obj in class_subindex.values():
-                    blob = git.Blob.from_note(self.repo, obj)
-                    # Don't retry freshly failed objects
-                    if blob in added + deleted + changed:
-                        continue
-                    logger.debug(f"retrying sync of {blob.path}")
-                    script = api.ApiObject.from_blob(blob)
-                    script.push_to_api()
-        self.repo.mark_bootstrap_sync()
+        # Objects pushed by previous (failed) push of the same commit
+        # are skipped, so they aren't applied again
+        journal = None
+        if not dryrun.get_dryrun():
+            journal = PushJournal(self.repo)
+            done_count = journal.open(target.hexsha)
+            if done_count:
+                logger.info(f"Resuming push of commit {target.hexsha}: "
+                            f"{done_count} objects have been pushed already")
+
+        prepared = {}
+        if self.config.xml_processes:
+            actions = [("add", blob) for blob in added]
+            actions.extend(("update", blob) for blob in changed)
+            prepared = self._prepare_xml_blobs(actions, journal)
+        try:
+            self._delete_blobs(deleted, journal)
+            for blob in added:
+                self._push_blob(blob, "add", journal, prepared.get(blob.path))
+            for blob in changed:
+                self._push_blob(blob, "update", journal, prepared.get(blob.path))
+
+            if retry_errors:
+                for class_subindex in list(self.repo.failed_objects.values()):
+                    for obj in list(class_subindex.values()):
+                        blob = git.Blob.from_note(self.repo, obj)
+                        # Don't retry freshly failed objects
+                        if blob in added + deleted + changed:
+                            continue
+                        self._push_blob(blob, "retry", journal)
+            self.repo.mark_bootstrap_sync(target)
+        finally:
+            if journal is not None:
+                journal.close()
+        if journal is not None:
+            journal.remove()
 
+    @staticmethod
+    def _object_blobs(blobs):
+        """Leaves out files outside of object directories (README, .gitignore)"""
+        out = []
+        for blob in blobs:
+            try:
+                api.ApiObject._get_subclass_by_path(blob.path)
+            except ValueError:
+                logger.debug(f"{blob.path} is not an object, ignoring")
+                continue
+            out.append(blob)
+        return out
+
+    def _get_push_base(self):
+        """Returns commit that the target has been synced to. Named target
+        that has never been pushed to gets all objects in the repo"""
+        synced = self.repo.get_last_synced_commit()
+        if synced is None and self.repo.target_name is not None:
+            logger.info(f"Nothing has been pushed to {self.repo.target_name} yet, pushing all objects")
+            return git.EMPTY_TREE_SHA
+        return synced
+
+    def _prepare_xml_blobs(self, actions, journal=None):
+        """Parses XML blobs that are going to be pushed in worker processes
+        (see api.prepare_xml_blobs). Returns dict path -> object"""
+        objs = {}
+        for action, blob in actions:
+            if journal is not None and journal.is_done(action, blob):
+                continue
+            if issubclass(api.ApiObject._get_subclass_by_path(blob.path), api.XmlObject):
+                objs[blob.path] = api.ApiObject.from_blob(blob)
+        if objs:
+            api.prepare_xml_blobs(list(objs.values()), self.config.xml_processes)
+        return objs
+
+    def _delete_blobs(self, blobs, journal=None):
+        """
+        Deletes objects of removed blobs on the server. Classes are handled
+        in reverse dependency order (policies before the rules they refer
+        to), and objects of the same class are deleted at the same time
+        (max_workers at once, within the server's request limit). Notes and
+        journal are updated in this thread. If any object can't be deleted,
+        the remaining classes are left alone and the first error is raised
+        """
+        by_class = {}
+        for blob in blobs:
+            if journal is not None and journal.is_done("delete", blob):
+                logger.debug(f"skipping {blob.path}: it has been deleted already")
+                continue
+            klass = api.ApiObject._get_subclass_by_path(blob.path)
+            by_class.setdefault(klass, []).append(blob)
+
+        for klass in reversed(self.get_object_classes()):
+            objs = [api.ApiObject.from_blob(blob) for blob in by_class.get(klass, ())]
+            if not objs:
+                continue
+            klass.get_broker()
+            with profiling.span(f"{klass.__name__} delete", category="object", objects=len(objs)):
+                results = run_parallel(lambda obj: obj.destroy_on_server(), objs,
+                                       max_workers=self.config.max_workers)
+            deleted = []
+            errors = []
+            with self.repo.notes_transaction(message="Deleted objects removed by netmri-bootstrap"):
+                for obj, _, error in results:
+                    if error is not None:
+                        logger.error(f"Cannot delete {obj.path}: {obj._parse_error(error)}")
+                        errors.append(error)
+                        continue
+                    obj._blob.note.clear()
+                    deleted.append(obj)
+            if journal is not None:
+                for obj in deleted:
+                    journal.add("delete", obj._blob, "ok")
+            if errors:
+                raise errors[0]
+
+    def _push_blob(self, blob, action, journal=None, obj=None):
+        """obj: object created from blob in advance"""
+        if journal is not None and journal.is_done(action, blob):
+            logger.debug(f"skipping {blob.path}: it has been pushed already")
+            return
+        logger.debug(f"{action} {blob.path} on netmri")
+        script = obj if obj is not None else api.ApiObject.from_blob(blob)
+        status = "ok" if script.push_to_api() else "error"
+        if journal is not None:
+            journal.add(action, blob, status)
+
+    def watch(self, interval=5, check_server=False, server_interval=60):
+        """Push new commits to the server as soon as they land in the watched
+        branch (watch subcommand). Git notes and API client are kept between
+        cycles, so every cycle costs about as much as the change itself.
+        check_server: also look for objects changed on the server
+        """
+        logger.info(f"Watching branch {self.repo.branch} of {self.repo.path}")
+        self.repo.load_notes()
+        watermarks = None
+        next_server_check = time.monotonic()
+        while True:
+            try:
+                self.repo.refresh()
+                head = self.repo.get_head_commit()
+                synced = self.repo.get_last_synced_commit()
+                if synced is None:
+                    logger.warning("Repository has never been synced to the server, nothing to compare with")
+                elif head != synced:
+                    logger.info(f"Pushing changes up to commit {head.hexsha}")
+                    self.update_netmri()
+
+                if check_server and time.monotonic() >= next_server_check:
+                    new_watermarks = self._get_server_watermarks()
+                    if watermarks is not None and new_watermarks != watermarks:
+                        logger.info("Objects on the server have been changed")
+                        self.check_netmri()
+                    watermarks = new_watermarks
+                    next_server_check = time.monotonic() + server_interval
+            except Exception as e:
+                # Keep watching: the server may come back on the next cycle
+                logger.error(f"Sync has failed: {e}")
+                logger.debug("Sync failure details", exc_info=True)
+            time.sleep(interval)
+
+    def _get_server_watermarks(self):
+        """Returns number of objects and latest modification date for every class"""
+        watermarks = {}
+        for klass in self.get_object_classes():
+            dates = [item.updated_at for item in klass.index()]
+            watermarks[klass.__name__] = (len(dates), max(dates, default=None))
+        return watermarks
+
+    @profiling.traced()
+    def push_received(self, old_sha, new_sha):
+        """Push changes received by git push (post_receive subcommand)
+        old_sha, new_sha: old and new commits of the watched branch, as
+        passed to post-receive hook
+        """
+        if new_sha == git.NULL_SHA:
+            logger.warning(f"Branch {self.repo.branch} has been deleted, nothing to push")
+            return
+        synced = self.repo.get_last_synced_commit()
+        if synced is None:
+            logger.warning("Repository has never been synced to the server, nothing to compare with")
+            return
+        if synced.hexsha != old_sha:
+            # Previous push has failed or commits were made without the hook
+            logger.warning(f"Last synced commit is {synced.hexsha}, not {old_sha}. "
+                           f"Pushing all changes since {synced.hexsha}")
+            old_sha = synced.hexsha
+        logger.info(f"Pushing changes from {old_sha} to {new_sha}")
+        self.update_netmri(old_state=old_sha,
+                           new_state=self.repo.repo.commit(new_sha))
+
+    def install_hook(self, command):
+        """Install post-receive hook that runs command with post_receive
+        subcommand (install_hook subcommand)"""
+        hook_path = os.path.join(self.repo.repo.git_dir, "hooks", "post-receive")
+        if os.path.exists(hook_path):
+            with open(hook_path, 'r') as fh:
+                if git.HOOK_MARKER not in fh.read():
+                    raise ValueError(f"{hook_path} already exists and wasn't installed by netmri-bootstrap")
+        logger.info(f"Installing post-receive hook in {hook_path}")
+        os.makedirs(os.path.dirname(hook_path), exist_ok=True)
+        with open(hook_path, 'w') as fh:
+            fh.write("#!/bin/sh\n")
+            fh.write(f"# {git.HOOK_MARKER}\n")
+            # Git runs post-receive in $GIT_DIR with GIT_DIR=. set, which
+            # confuses git commands run from netmri-bootstrap
+            fh.write("unset GIT_DIR\n")
+            fh.write(f"exec {command} post_receive\n")
+        os.chmod(hook_path, 0o755)
+
+    @profiling.traced()
     def force_push(self, paths):
         """Update specified objects on server regardless of their sync status"""
         for path in paths:
@@ -101,61 +480,39 @@ class Bootstrapper:
             obj = api.ApiObject.from_blob(blob)
             obj.push_to_api()
 
-    def check_netmri(self, local_only=False):
+    @profiling.traced()
+    def check_netmri(self, local_only=False, skip_local=False):
         """List objects that were changed outside of netmri-bootstrap,
         or have sync errors
+        skip_local: don't look for uncommitted files
         """
         err_count = 0
-        err_count += self._local_check()
+        if not skip_local:
+            err_count += self._local_check()
         # Skip long remote checks
         if local_only:
             return err_count
 
         for klass in self.get_object_classes():
-            broker = klass.get_broker()
-            logger.debug(f"getting index of {broker.controller}")
-            api_objects = {}
-            git_objects = {}
-            for api_item in klass.index():
-                if self.config.skip_readonly_objects and getattr(api_item, "read_only", False):
-                    logger.debug(f"skipping {klass.__name__} {api_item.name} because it's read-only")
-                    continue
-                api_objects[api_item.id] = api_item
-
-            for git_item in self.repo.object_index.get(klass.__name__, {}).values():
-                if git_item["id"] is None:
-                    logger.debug(
-                        f"Skipping {klass.__name__} \"{git_item['path']}\" because it doesn't have id assigned (not synced to netmri yet?)")
-                    continue
-                git_objects[git_item["id"]] = git_item
-
-            api_objects_set = set(api_objects.keys())
-            git_objects_set = set(git_objects.keys())
-
-            for obj_id in api_objects_set - git_objects_set:
-                obj = api_objects[obj_id]
+            diff = self._diff_server(klass)
+            for obj in diff["added"]:
                 logger.warning(f"{klass.__name__} \"{obj.name}\" (id: {obj.id}) was added outside of netmri-bootstrap")
                 err_count += 1
 
-            for git_id in git_objects_set - api_objects_set:
-                obj = git_objects[git_id]
+            for obj in diff["deleted"]:
                 logger.warning(f"{klass.__name__} \"{obj['path']}\" was deleted outside of netmri-bootstrap")
                 err_count += 1
 
-            for id in git_objects_set & api_objects_set:
-                api_date = time.strptime(api_objects[id].updated_at, "%Y-%m-%d %H:%M:%S")
-                git_date = time.strptime(git_objects[id]["updated_at"], "%Y-%m-%d %H:%M:%S")
-                if git_date < api_date:
-                    logger.warning(
-                        f"{klass.__name__} \"{api_objects[id].name}\" (id: {id}) ({git_objects[id]['path']}) was changed outside of netmri-bootstrap")
-                    logger.debug(
-                        f"modification date on netmri: {api_objects[id].updated_at}, in git: {git_objects[id]['updated_at']}")
-                    err_count += 1
-
-                # git_date may be newer than api_date after netmri was restored from an archive.
-                if git_date > api_date:
-                    logger.warning(f"{klass.__name__} \"{api_objects[id].name}\" is outdated on netmri")
-                    err_count += 1
+            for api_item, git_item in diff["changed"]:
+                logger.warning(
+                    f"{klass.__name__} \"{api_item.name}\" (id: {api_item.id}) ({git_item['path']}) was changed outside of netmri-bootstrap")
+                logger.debug(
+                    f"modification date on netmri: {api_item.updated_at}, in git: {git_item['updated_at']}")
+                err_count += 1
+
+            for api_item, git_item in diff["outdated"]:
+                logger.warning(f"{klass.__name__} \"{api_item.name}\" is outdated on netmri")
+                err_count += 1
 
         for class_subindex in self.repo.failed_objects.values():
             for obj in class_subindex.values():
@@ -170,6 +527,135 @@ class Bootstrapper:
             logger.info("Repository and the server are in sync")
         return all_clear
 
+    def _diff_server(self, klass, full=False):
+        """
+        Compares index of klass on the server with git notes (see
+        ApiObject.index for full). Returns dict:
+        added: API items that aren't in the repo
+        deleted: notes of objects that aren't on the server anymore
+        changed: (API item, note) pairs modified on the server after sync
+        outdated: (API item, note) pairs that are newer in the repo. This
+        may happen after netmri was restored from an archive
+        """
+        broker = klass.get_broker()
+        logger.debug(f"getting index of {broker.controller}")
+        api_objects = {}
+        git_objects = {}
+        for api_item in klass.index(full=full):
+            if self.config.skip_readonly_objects and getattr(api_item, "read_only", False):
+                logger.debug(f"skipping {klass.__name__} {api_item.name} because it's read-only")
+                continue
+            api_objects[api_item.id] = api_item
+
+        for git_item in self.repo.object_index.get(klass.__name__, {}).values():
+            if git_item["id"] is None:
+                logger.debug(
+                    f"Skipping {klass.__name__} \"{git_item['path']}\" because it doesn't have id assigned (not synced to netmri yet?)")
+                continue
+            git_objects[git_item["id"]] = git_item
+
+        api_objects_set = set(api_objects.keys())
+        git_objects_set = set(git_objects.keys())
+        diff = {
+            "added": [api_objects[id] for id in sorted(api_objects_set - git_objects_set)],
+            "deleted": [git_objects[id] for id in sorted(git_objects_set - api_objects_set)],
+            "changed": [],
+            "outdated": [],
+        }
+        for id in sorted(git_objects_set & api_objects_set):
+            api_date = time.strptime(api_objects[id].updated_at, "%Y-%m-%d %H:%M:%S")
+            git_date = time.strptime(git_objects[id]["updated_at"], "%Y-%m-%d %H:%M:%S")
+            if git_date < api_date:
+                diff["changed"].append((api_objects[id], git_objects[id]))
+            elif git_date > api_date:
+                diff["outdated"].append((api_objects[id], git_objects[id]))
+        return diff
+
+    @profiling.traced()
+    def pull(self):
+        """
+        Bring objects added, changed or deleted on the server since last
+        sync into the repo (pull subcommand). Only these objects are
+        downloaded; they're committed in one commit with one notes update.
+        New objects are written to their generate_path(), changed objects
+        keep their current path. Objects that have also been changed in
+        commits that aren't pushed yet are left alone (and reported).
+        Sync tag is moved to the new commit only if it was at HEAD before.
+        Returns summary with lists of added, changed, deleted and
+        conflicting paths
+        """
+        repo = self.repo.repo
+        if repo.index.diff(None) or repo.index.diff(repo.head.commit):
+            raise ValueError("There are uncommitted changes in the repo. Commit or stash them before pull")
+        head = self.repo.get_head_commit()
+        synced = self.repo.get_last_synced_commit()
+        added, deleted, changed = self.repo.detect_changes()
+        unpushed = set(blob.path for blob in added + deleted + changed)
+        repo_paths = set(blob.path for blob in self.repo.get_blobs())
+
+        summary = {"added": [], "changed": [], "deleted": [], "conflicts": []}
+        to_download = []
+        to_remove = []
+        for klass in self.get_object_classes():
+            diff = self._diff_server(klass, full=True)
+            for api_item in diff["added"]:
+                obj = klass.from_api(api_item)
+                obj.path = obj.generate_path()
+                if obj.path in repo_paths:
+                    logger.warning(f"Cannot pull {klass.__name__} \"{api_item.name}\" (id: {api_item.id}): "
+                                   f"{obj.path} already exists in the repo")
+                    summary["conflicts"].append(obj.path)
+                    continue
+                repo_paths.add(obj.path)
+                to_download.append(obj)
+            for api_item, git_item in diff["changed"]:
+                if git_item["path"] in unpushed:
+                    logger.warning(f"{git_item['path']} has been changed both on the server "
+                                   f"and in commits that aren't pushed yet. Skipping it")
+                    summary["conflicts"].append(git_item["path"])
+                    continue
+                obj = klass.from_api(api_item)
+                obj.path = git_item["path"]
+                to_download.append(obj)
+            for git_item in diff["deleted"]:
+                if git_item["path"] in unpushed:
+                    logger.warning(f"{git_item['path']} has been deleted on the server, but changed "
+                                   f"in commits that aren't pushed yet. Skipping it")
+                    summary["conflicts"].append(git_item["path"])
+                    continue
+                to_remove.append(git.Blob.from_note(self.repo, git_item))
+            for api_item, git_item in diff["outdated"]:
+                logger.warning(f"{git_item['path']} is newer in the repo than on the server. "
+                               f"Use push to update it")
+
+        if self.config.async_transfers and aio.is_available():
+            fetched = self._download_objects(to_download)
+            written = self._write_objects(fetched)
+        else:
+            results = []
+            self._run_pipeline("pull", to_download, results.append)
+            results.sort(key=lambda item: item[0].path)
+            fetched = [obj for obj, _ in results]
+            written = sum(written for _, written in results)
+        for obj in fetched:
+            key = "changed" if self.repo.find_note_by_id(obj.__class__, obj.id) else "added"
+            summary[key].append(obj.path)
+        summary["deleted"] = [blob.path for blob in to_remove]
+        if not fetched and not to_remove:
+            logger.info("Nothing to pull from the server")
+            return summary
+
+        self._commit_written(fetched, written, "Pulled from the server by netmri-bootstrap",
+                             removed=to_remove)
+        if synced is not None and synced == head:
+            self.repo.mark_bootstrap_sync(self.repo.get_head_commit())
+        else:
+            logger.warning("There are commits that haven't been pushed to the server yet, "
+                           "sync tag hasn't been moved")
+        logger.info(f"Pulled {len(summary['added'])} new, {len(summary['changed'])} changed and "
+                    f"{len(summary['deleted'])} deleted objects, {len(summary['conflicts'])} conflicts")
+        return summary
+
     def _local_check(self):
         """Checks that there are no untracked and uncommitted files"""
         err_count = 0
@@ -184,6 +670,7 @@ class Bootstrapper:
             err_count += 1
         return err_count
 
+    @profiling.traced()
     def cat_file(self, path, from_api=False):
         """Print file contents from the repo or from API"""
         repo_path = self.repo.get_path_in_repo(path)
@@ -201,6 +688,7 @@ class Bootstrapper:
                 return
         print(obj._content)
 
+    @profiling.traced()
     def show_metadata(self, path):
         """Displays git note for the object"""
         repo_path = self.repo.get_path_in_repo(path)
@@ -209,6 +697,7 @@ class Bootstrapper:
         for key, value in obj.get_note().items():
             print(f"{key}: {value}")
 
+    @profiling.traced()
     def relink(self, path):
         """Find object on server by its secondary key and store id in git note
         """
@@ -231,11 +720,91 @@ class Bootstrapper:
             else:
                 logger.info(f"Changing id of {obj.path} from {obj.id} to {remote.id}")
                 obj.id = remote.id
+                obj.updated_at = remote.updated_at
                 obj.save_note()
         else:
             duplicates = [remote.id for remote in res]
             raise ValueError(f"Found duplicates of {obj.path}: {','.join(duplicates)}. This should not happen.")
 
+    @profiling.traced()
+    def relink_many(self, paths=None):
+        """
+        Like relink, but for many objects at once (all objects in the repo
+        if paths is None). Index of every class is downloaded once and
+        objects are matched by their secondary keys locally. All changed
+        ids are saved in a single notes commit.
+        Returns summary with lists of changed, missing and duplicate paths
+        """
+        self.repo.load_notes()
+        if paths is None:
+            blobs = []
+            class_names = [klass.__name__ for klass in self.get_object_classes()]
+            for blob in self.repo.get_blobs():
+                try:
+                    klass = api.ApiObject._get_subclass_by_path(blob.path)
+                except ValueError:
+                    continue
+                if klass.__name__ in class_names:
+                    blobs.append(blob)
+        else:
+            blobs = [git.Blob.from_path(self.repo, self.repo.get_path_in_repo(path))
+                     for path in paths]
+
+        objs_by_class = {}
+        for blob in blobs:
+            obj = api.ApiObject.from_blob(blob)
+            objs_by_class.setdefault(obj.__class__, []).append(obj)
+
+        summary = {"changed": [], "unchanged": [], "missing": [], "duplicates": []}
+        to_save = []
+        for klass, objs in objs_by_class.items():
+            logger.debug(f"getting index of {klass.__name__} to match {len(objs)} objects")
+            remotes = {}
+            for remote in klass.index():
+                remotes.setdefault(klass.get_secondary_key(remote), []).append(remote)
+            local = {}
+            for obj in objs:
+                local.setdefault(klass.get_secondary_key(obj), []).append(obj.path)
+
+            for obj in objs:
+                key = klass.get_secondary_key(obj)
+                matches = remotes.get(key, []) if key is not None else []
+                if key is not None and len(local[key]) > 1:
+                    logger.error(f"{obj.path} has the same {', '.join(klass.secondary_keys)} as "
+                                 f"{', '.join(p for p in local[key] if p != obj.path)}. Skipping it")
+                    summary["duplicates"].append(obj.path)
+                elif len(matches) > 1:
+                    ids = ",".join(str(remote.id) for remote in matches)
+                    logger.error(f"Found duplicates of {obj.path} on server: {ids}. Skipping it")
+                    summary["duplicates"].append(obj.path)
+                elif len(matches) == 0:
+                    summary["missing"].append(obj.path)
+                    if obj.id is None:
+                        logger.info(f"{obj.path} wasn't found on server")
+                    else:
+                        logger.info(f"{obj.path} wasn't found on server. Changing id from {obj.id} to None")
+                        obj.id = None
+                        to_save.append(obj)
+                elif matches[0].id == obj.id:
+                    logger.debug(f"{obj.path} already has correct id on server: {obj.id}")
+                    summary["unchanged"].append(obj.path)
+                else:
+                    logger.info(f"Changing id of {obj.path} from {obj.id} to {matches[0].id}")
+                    obj.id = matches[0].id
+                    obj.updated_at = matches[0].updated_at
+                    summary["changed"].append(obj.path)
+                    to_save.append(obj)
+
+        with self.repo.notes_transaction(message="Ids updated by netmri-bootstrap"):
+            for obj in to_save:
+                obj.save_note()
+        logger.info(f"Changed ids of {len(summary['changed'])} objects, "
+                    f"{len(summary['unchanged'])} are unchanged, "
+                    f"{len(summary['missing'])} weren't found on server, "
+                    f"{len(summary['duplicates'])} have duplicates")
+        return summary
+
+    @profiling.traced()
     def fetch(self, path, id=None, overwrite=False):
         """Download object from API and commit it to the repo"""
         repo_path = self.repo.get_path_in_repo(path)
@@ -266,14 +835,161 @@ class Bootstrapper:
             msg = obj._parse_error(e)
             logger.error(f"Cannot fetch {obj.broker.controller} id {obj.id}: {msg}")
             return
-        self.repo.write_file(obj.path, obj.export_to_repo())
+        written = obj.write_to_repo(self.repo)
 
         obj._blob = self.repo.stage_file(obj.path)
 
-        logger.debug("Committing downloaded objects to repo")
-        self.repo.commit(message=f"Fetch of {path} by netmri-bootstrap")
+        if written:
+            logger.debug("Committing downloaded objects to repo")
+            self.repo.commit(message=f"Fetch of {path} by netmri-bootstrap")
+        else:
+            logger.info(f"{path} is the same as on the server, nothing to commit")
         obj.save_note()
 
+    @profiling.traced()
+    def fetch_many(self, paths):
+        """
+        Download objects from API and commit them to the repo. Paths can be
+        files, directories (e.g. scripts/) or glob patterns (e.g.
+        "scripts/*.py"; unlike shell, * also matches /). Only objects that
+        are already in the repo and have id in their note can be fetched.
+        Objects are downloaded in parallel and committed together in one
+        commit with one notes update.
+        Returns list of paths that have been fetched
+        """
+        objs = []
+        for repo_path in self._expand_paths(paths):
+            blob = git.Blob.from_path(self.repo, repo_path)
+            obj = api.ApiObject.from_blob(blob)
+            if obj.id is None:
+                logger.error(f"Cannot fetch {repo_path}: it has no id. Run sync_id first")
+                continue
+            objs.append(obj)
+
+        def download(obj):
+            remote = obj.get_broker().show(id=obj.id)
+            fetched = obj.from_api(remote)
+            fetched.path = obj.path
+            return fetched
+        fetched = self._download_objects(objs, download)
+        if fetched:
+            if len(fetched) == 1:
+                message = f"Fetch of {fetched[0].path} by netmri-bootstrap"
+            else:
+                message = f"Fetch of {len(fetched)} objects by netmri-bootstrap"
+            self._commit_objects(fetched, message)
+        logger.info(f"Fetched {len(fetched)} of {len(objs)} objects")
+        return [obj.path for obj in fetched]
+
+    def _expand_paths(self, paths):
+        """Translates paths, directories and globs into list of files in the repo"""
+        repo_paths = [blob.path for blob in self.repo.get_blobs()]
+        res = []
+        for path in paths:
+            if any(c in path for c in "*?["):
+                # get_path_in_repo normalizes the pattern as if it were a path
+                pattern = self.repo.get_path_in_repo(path)
+                matches = fnmatch.filter(repo_paths, pattern)
+            else:
+                repo_path = self.repo.get_path_in_repo(path)
+                prefix = repo_path.rstrip("/") + "/"
+                matches = [p for p in repo_paths if p == repo_path or p.startswith(prefix)]
+            if not matches:
+                raise ValueError(f"{path} doesn't match any file in the repository")
+            res.extend(p for p in matches if p not in res)
+        return res
+
+    def _download_objects(self, objs, download=None):
+        """
+        Loads content of objects from API in parallel. If download is given,
+        download(obj) is called first and must return object to be written
+        to the repo instead of obj.
+        Objects that fail to download are logged and skipped.
+        With async_transfers enabled, content is downloaded through event
+        loop (see aio.load_contents) instead of threads.
+        Returns downloaded objects in the same order as objs
+        """
+        # Authenticate and create brokers before threads start using them
+        config.get_api_client()
+        for klass in {obj.__class__ for obj in objs}:
+            klass.get_broker()
+        use_async = self.config.async_transfers and aio.is_available()
+        if self.config.async_transfers and not use_async:
+            logger.warning("async_transfers requires aiohttp, downloading content in threads")
+
+        def load(obj):
+            fetched = download(obj) if download is not None else obj
+            if self.config.xml_processes and isinstance(fetched, api.XmlObject):
+                fetched.render_in_worker = True
+            if not use_async:
+                with profiling.span(f"{fetched.__class__.__name__} download", category="content"):
+                    fetched.load_content_from_api()
+            return fetched
+
+        res = []
+        for obj, fetched, error in run_parallel(load, objs, max_workers=self.config.max_workers):
+            if error is not None:
+                msg = obj._parse_error(error)
+                logger.error(f"Cannot fetch {obj.get_broker().controller} id {obj.id}: {msg}")
+                continue
+            res.append(fetched)
+        if use_async and res:
+            with profiling.span("async download", category="content", objects=len(res)):
+                loaded = aio.load_contents(res, limit=self.config.async_concurrency)
+            res = []
+            for obj, error in loaded:
+                if error is not None:
+                    msg = obj._parse_error(error)
+                    logger.error(f"Cannot fetch {obj.get_broker().controller} id {obj.id}: {msg}")
+                    continue
+                res.append(obj)
+        pending = [obj for obj in res if isinstance(obj, api.XmlObject) and obj.render_in_worker]
+        if pending:
+            failed = set()
+            for obj, error in api.render_xml_objects(pending, self.config.xml_processes):
+                if error is not None:
+                    logger.error(f"Cannot fetch {obj.get_broker().controller} id {obj.id}: {error}")
+                    failed.add(id(obj))
+            res = [obj for obj in res if id(obj) not in failed]
+        return res
+
+    def _commit_objects(self, objs, message, removed=()):
+        """Writes objects to the repo and commits them with their notes.
+        Files of removed blobs are deleted in the same commit"""
+        self._commit_written(objs, self._write_objects(objs), message, removed)
+
+    def _write_objects(self, objs):
+        """Returns number of objects whose files have been changed"""
+        written = 0
+        for obj in objs:
+            with profiling.span(f"{obj.__class__.__name__} render", category="content"):
+                written += obj.write_to_repo(self.repo)
+        return written
+
+    def _commit_written(self, objs, written, message, removed=()):
+        """Commits objects written to the working tree along with their
+        notes. Objects whose content hasn't changed (see
+        ApiObject.write_to_repo) only get new notes; if there are no other
+        changes, nothing is committed"""
+        if objs:
+            blobs = self.repo.stage_files([obj.path for obj in objs])
+            for obj, blob in zip(objs, blobs):
+                obj._blob = blob
+                obj._content = None
+        if removed:
+            self.repo.remove_files([blob.path for blob in removed])
+
+        if written or removed:
+            logger.debug(f"Committing {written} downloaded and {len(removed)} removed objects to repo")
+            self.repo.commit(message=message)
+        else:
+            logger.info("Downloaded objects are the same as in the repo, nothing to commit")
+        with self.repo.notes_transaction(message=message):
+            for obj in objs:
+                obj.save_note()
+            for blob in removed:
+                blob.note.clear()
+
     @staticmethod
     def get_object_classes(class_names=None):
         """
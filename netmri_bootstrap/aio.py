@@ -0,0 +1,310 @@
+"""
+Asynchronous transport for API and webui brokers, used to download content
+of many objects at once without a thread per request. Requires aiohttp
+(pip install netmri-bootstrap[async]); use is_available() before calling
+anything else. Brokers here only replace the transport: controller names,
+unwrapping of responses and Remote models come from the synchronous
+brokers of infoblox_netmri and webui_broker.
+"""
+import ssl
+import json
+import types
+import base64
+import asyncio
+import logging
+import contextlib
+from http.cookies import SimpleCookie
+from requests.exceptions import HTTPError, ConnectionError, Timeout
+from infoblox_netmri.utils.utils import to_snake
+from netmri_bootstrap import config, profiling, webui_broker
+from netmri_bootstrap.client import NetMRIClient
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+logger = logging.getLogger(__name__)
+
+
+def is_available():
+    return aiohttp is not None
+
+
+class AsyncResponse():
+    """Just enough of requests.Response for ApiObject._parse_error
+    and governor to handle errors of async requests"""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf8", errors="replace")
+
+
+def _raise_for_status(status, content, headers):
+    if 400 <= status < 600:
+        raise HTTPError(content, response=AsyncResponse(status, content, dict(headers)))
+
+
+def _decode(content, headers):
+    if "application/json" in headers.get("content-type", ""):
+        return json.loads(content)
+    return content.decode("utf8")
+
+
+def _ssl_context(ssl_verify):
+    """Returns value of aiohttp ssl argument for ssl_verify of requests:
+    False, True or path to CA bundle"""
+    if not ssl_verify:
+        return False
+    if isinstance(ssl_verify, str):
+        return ssl.create_default_context(cafile=ssl_verify)
+    # Default verification of aiohttp
+    return None
+
+
+class AsyncNetMRIClient():
+    """
+    Counterpart of client.NetMRIClient for asyncio. Must be used as async
+    context manager, so aiohttp session belongs to the running event loop.
+    Requests share governor and saved session with the synchronous clients
+    of the same server
+    """
+
+    def __init__(self, host, username, password, use_ssl=True, ssl_verify=False,
+                 api_version=config.NETMRI_API_VERSION, port=None, limit=16,
+                 session_store=None, governor=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.protocol = "https" if use_ssl else "http"
+        self.ssl_verify = ssl_verify
+        self.api_version = api_version
+        self.limit = limit
+        self.session_store = session_store
+        self.governor = governor
+        self.session = None
+        self._is_authenticated = False
+        self._using_saved_session = False
+        self._auth_lock = None
+
+    @classmethod
+    def from_client(cls, client, limit=16):
+        """Returns async client for the same server as client.NetMRIClient"""
+        return cls(client.host, client.username, client.password,
+                   use_ssl=client.protocol == "https", ssl_verify=client.ssl_verify,
+                   api_version=client.api_version, port=client.port, limit=limit,
+                   session_store=client.session_store, governor=client.governor)
+
+    async def __aenter__(self):
+        # NetMRI is often addressed by IP. aiohttp ignores cookies of such
+        # hosts unless cookie jar is "unsafe"
+        connector = aiohttp.TCPConnector(limit=self.limit, ssl=_ssl_context(self.ssl_verify))
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self._auth_lock = asyncio.Lock()
+        if self.session_store is not None:
+            cookies = self.session_store.load(self._base_url(), self.username)
+            if cookies:
+                self.restore_cookies(cookies)
+                self._using_saved_session = True
+                self._is_authenticated = True
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    def restore_cookies(self, cookies):
+        """Puts cookies returned by SessionStore.load() into aiohttp session"""
+        jar = SimpleCookie()
+        for c in cookies:
+            jar[c["name"]] = c["value"]
+            jar[c["name"]]["path"] = c["path"]
+        self.session.cookie_jar.update_cookies(jar, response_url=URL(self._base_url()))
+
+    def _saved_cookies(self):
+        # SessionStore.save expects cookies of requests
+        return [types.SimpleNamespace(name=name, value=morsel.value, domain=morsel["domain"],
+                                      path=morsel["path"] or "/", secure=bool(morsel["secure"]))
+                for name, morsel in self.session.cookie_jar.filter_cookies(URL(self._base_url())).items()]
+
+    def _base_url(self):
+        if self.port is None:
+            return f"{self.protocol}://{self.host}"
+        return f"{self.protocol}://{self.host}:{self.port}"
+
+    def _method_url(self, method_name):
+        return f"{self._base_url()}/api/{self.api_version}/{method_name}"
+
+    async def _authenticate(self):
+        async with self._auth_lock:
+            # Another task may have authenticated while we waited
+            if self._is_authenticated:
+                return
+            logger.debug(f"Authenticating on {self._base_url()} as {self.username}")
+            self.session.cookie_jar.clear()
+            url = f"{self._base_url()}/api/authenticate"
+            data = json.dumps({"username": self.username, "password": self.password})
+            await self.send(url, data=data, headers={"Content-type": "application/json"})
+            self._is_authenticated = True
+            self._using_saved_session = False
+            if self.session_store is not None:
+                self.session_store.save(self._base_url(), self.username, self._saved_cookies())
+
+    def _governed(self):
+        if self.governor is None:
+            return contextlib.nullcontext()
+        return self.governor.async_slot()
+
+    async def send(self, url, method="post", data=None, headers=None, span=None):
+        """Sends one request through governor and returns decoded JSON or
+        text. aiohttp errors are raised as their requests counterparts,
+        so governor and callers can handle them the same way"""
+        if span is None:
+            span = NetMRIClient._request_span(url, method, span=profiling.task_span)
+        async with self._governed():
+            with span as current:
+                try:
+                    async with self.session.request(method, url, data=data, headers=headers) as res:
+                        content = await res.read()
+                        current.set(status=res.status, bytes=len(content))
+                        _raise_for_status(res.status, content, res.headers)
+                        return _decode(content, res.headers)
+                except asyncio.TimeoutError as e:
+                    raise Timeout(str(e)) from e
+                except aiohttp.ClientConnectionError as e:
+                    raise ConnectionError(str(e)) from e
+
+    async def request(self, url, data=None, headers=None):
+        """Sends POST request to url, re-authenticating once if the session
+        has expired. Returns decoded JSON or text"""
+        attempts = 0
+        while True:
+            if not self._is_authenticated:
+                await self._authenticate()
+            try:
+                return await self.send(url, data=data, headers=headers)
+            except HTTPError as e:
+                if e.response.status_code not in (401, 403) or attempts > 0:
+                    raise
+                attempts += 1
+                logger.debug(f"Got HTTP {e.response.status_code} from {url}, re-authenticating")
+                self._is_authenticated = False
+                if self._using_saved_session:
+                    self.session_store.invalidate(self._base_url(), self.username)
+
+    async def api_request(self, method_name, params):
+        return await self.request(self._method_url(method_name), data=json.dumps(params),
+                                  headers={"Content-type": "application/json"})
+
+
+class AsyncBroker():
+    """
+    Async version of infoblox_netmri broker. broker is the synchronous
+    broker of the same class: its controller name is used to build method
+    names, and responses are unwrapped into Remote models the same way.
+    Only methods used to download content (see ApiObject.content_requests)
+    are implemented
+    """
+
+    def __init__(self, client, broker):
+        self.client = client
+        self.broker = broker
+        self.controller = broker.controller
+
+    async def _request(self, method, params):
+        method_name = self.broker._get_method_fullname(method)
+        data = await self.client.api_request(method_name, params)
+        # Same as Broker.api_request of infoblox_netmri
+        if isinstance(data, dict) and len(data) > 1:
+            return {key: self.broker._get_return_object_type(value) for key, value in data.items()}
+        class_name = to_snake(self.broker.__class__.__name__.replace("Broker", ""))
+        if isinstance(data, dict) and class_name in data:
+            result_name = class_name
+        else:
+            result_name = method.split('/')[-1]
+            if not isinstance(data, dict) or result_name not in data:
+                return data
+        return self.broker._get_return_object_type(data.get(result_name))
+
+    async def show(self, **kwargs):
+        return await self._request("show", kwargs)
+
+    async def export(self, **kwargs):
+        return await self._request("export", kwargs)
+
+    async def export_file(self, **kwargs):
+        return await self._request("export_file", kwargs)
+
+    async def policy_rules(self, **kwargs):
+        return await self._request("policy_rules", kwargs)
+
+
+class AsyncIssueAdhocBroker():
+    """Async version of webui_broker.IssueAdhocBroker. Credentials and
+    server are taken from the synchronous broker"""
+    controller = webui_broker.IssueAdhocBroker.controller
+
+    def __init__(self, client, broker):
+        self.client = client
+        self.broker = broker
+        credentials = f"{broker.login}:{broker.password}".encode("utf8")
+        self.headers = {"Authorization": f"Basic {base64.b64encode(credentials).decode('ascii')}"}
+
+    async def do_request(self, url, method="get", params=None):
+        full_url = f"{self.broker._base_url()}{url}"
+        res = await self.client.send(full_url, method=method, data=params, headers=self.headers,
+                                     span=self.broker._request_span(url, method, span=profiling.task_span))
+        if isinstance(res, str):
+            return {"content": res}
+        return res
+
+    async def show(self, id):
+        res = await self.do_request(f"/webui/issues_adhoc/{id}.json")
+        item = res['ad_hoc_issue']
+        item['Details'] = res['details']
+        return webui_broker.IssueAdHocRemote.from_row(item)
+
+
+def load_contents(objs, limit=32):
+    """
+    Downloads content of objects (see ApiObject.content_requests) from the
+    current target through an event loop, with at most limit requests at
+    the same time. Returns list of (obj, exception) in the same order as
+    objs; exception is None if content has been loaded
+    """
+    if not is_available():
+        raise RuntimeError("aiohttp is required for async transfers: pip install netmri-bootstrap[async]")
+    # Synchronous brokers are created here, in the caller's thread and context
+    brokers = {obj.__class__: obj.get_broker() for obj in objs}
+    client = config.get_api_client()
+    return asyncio.run(_load_contents(objs, brokers, client, limit))
+
+
+async def _load_contents(objs, brokers, client, limit):
+    semaphore = asyncio.Semaphore(limit)
+    async with AsyncNetMRIClient.from_client(client, limit=limit) as client:
+        async_brokers = {}
+        for klass, broker in brokers.items():
+            if isinstance(broker, webui_broker.IssueAdhocBroker):
+                async_brokers[klass] = AsyncIssueAdhocBroker(client, broker)
+            else:
+                async_brokers[klass] = AsyncBroker(client, broker)
+
+        async def load(obj):
+            broker = async_brokers[obj.__class__]
+            async with semaphore:
+                responses = [await getattr(broker, method)(**params)
+                             for method, params in obj.content_requests()]
+            obj.set_content_from_api(*responses)
+
+        results = await asyncio.gather(*(load(obj) for obj in objs), return_exceptions=True)
+    profiling.counter("async downloads", objects=len(objs),
+                      errors=sum(1 for res in results if isinstance(res, Exception)))
+    return [(obj, res if isinstance(res, BaseException) else None)
+            for obj, res in zip(objs, results)]
@@ -0,0 +1,139 @@
+import os
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _state_path(repo, filename):
+    """State of every named target is kept in its own file"""
+    if repo.target_name is not None:
+        base, ext = os.path.splitext(filename)
+        filename = f"{base}-{repo.target_name}{ext}"
+    return os.path.join(repo.get_state_dir(), filename)
+
+
+class InitCheckpoint():
+    """
+    Records objects that init has already committed to the repo along with
+    their notes, so interrupted init can be resumed without downloading
+    them again. Stored in .git/netmri-bootstrap/ (see Repo.get_state_dir)
+    """
+    filename = "init-checkpoint.json"
+
+    def __init__(self, repo):
+        self.path = _state_path(repo, self.filename)
+        # class name -> set of ids
+        self.done = {}
+        self.chunks = 0
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as fh:
+            data = json.load(fh)
+        self.done = {klass: set(ids) for klass, ids in data["done"].items()}
+        self.chunks = data["chunks"]
+        logger.debug(f"Loaded init checkpoint with {self.count()} objects "
+                     f"in {self.chunks} chunks")
+
+    def save(self):
+        data = {
+            "done": {klass: sorted(ids) for klass, ids in self.done.items()},
+            "chunks": self.chunks,
+        }
+        # Checkpoint must never be left half-written
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, class_name, id):
+        return id in self.done.get(class_name, ())
+
+    def add(self, class_name, id):
+        self.done.setdefault(class_name, set()).add(id)
+
+    def count(self):
+        return sum(len(ids) for ids in self.done.values())
+
+
+class PushJournal():
+    """
+    Records objects that push has already applied to the server, so push
+    restarted after a failure doesn't apply them again. Objects that failed
+    are recorded too, but they're pushed again on restart. The journal belongs
+    to the commit being pushed: it's discarded if the next push has another
+    target, and removed when sync tag (synced_to_netmri) is moved to the target.
+    Every entry is a line of JSON written as soon as the object is done.
+    """
+    filename = "push-journal.jsonl"
+
+    def __init__(self, repo):
+        self.path = _state_path(repo, self.filename)
+        self.target = None
+        # (action, path, blob id) of objects that have been applied successfully
+        self.done = set()
+        self._fh = None
+
+    def open(self, target):
+        """Starts journal for target commit, or continues existing one
+        if it has the same target. Returns number of finished objects"""
+        self.target = target
+        self.done = set()
+        try:
+            with open(self.path, 'r') as fh:
+                content = fh.read()
+        except FileNotFoundError:
+            content = ""
+        lines = content.splitlines()
+        if lines and json.loads(lines[0]).get("target") == target:
+            for line in lines[1:]:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be cut short if we were killed while writing it
+                    logger.debug(f"Ignoring broken line in {self.path}: {line}")
+                    continue
+                if entry.get("status") == "ok":
+                    self.done.add((entry["action"], entry["path"], entry["blob"]))
+            self._fh = open(self.path, 'a')
+            if not content.endswith("\n"):
+                self._fh.write("\n")
+        else:
+            if lines:
+                logger.debug(f"Discarding push journal for another commit: {lines[0]}")
+            self._fh = open(self.path, 'w')
+            self._write({"target": target})
+        return len(self.done)
+
+    def _write(self, entry):
+        self._fh.write(json.dumps(entry) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def is_done(self, action, blob):
+        return (action, blob.path, blob.id) in self.done
+
+    def add(self, action, blob, status):
+        if status == "ok":
+            self.done.add((action, blob.path, blob.id))
+        self._write({"action": action, "path": blob.path, "blob": blob.id, "status": status})
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,130 @@
+import json
+import logging
+import threading
+import contextlib
+from urllib.parse import urlparse
+from requests.exceptions import HTTPError
+from infoblox_netmri.client import InfobloxNetMRI
+from netmri_bootstrap import profiling
+from netmri_bootstrap.session import SessionStore
+logger = logging.getLogger(__name__)
+
+
+class NetMRIClient(InfobloxNetMRI):
+    """
+    InfobloxNetMRI client that can reuse authenticated session saved
+    by previous run of netmri-bootstrap (see session.SessionStore).
+    If governor is given, it limits number of concurrent requests
+    (see governor.RequestGovernor)
+    """
+
+    def __init__(self, *args, session_store=None, port=None, governor=None, **kwargs):
+        # InfobloxNetMRI doesn't allow port in host name
+        self.port = port
+        self.session_store = session_store
+        self.governor = governor
+        # Saved session is tried only once per process. If the server
+        # rejects it, we fall back to authentication with the password
+        self._try_saved_session = session_store is not None
+        self._using_saved_session = False
+        # Brokers are shared by all objects of the same class
+        # (see ApiObject.get_broker)
+        self.broker_cache = {}
+        # Client is shared by worker threads (see concurrency.run_parallel)
+        self._auth_lock = threading.Lock()
+        super(NetMRIClient, self).__init__(*args, **kwargs)
+        profiling.instrument_session(self.session)
+
+    def _base_url(self):
+        if self.port is None:
+            return super(NetMRIClient, self)._base_url()
+        return f"{self.protocol}://{self.host}:{self.port}"
+
+    def _authenticate(self):
+        if self._try_saved_session:
+            self._try_saved_session = False
+            cookies = self.session_store.load(self._base_url(), self.username)
+            if cookies:
+                SessionStore.restore_cookies(self.session, cookies)
+                self._using_saved_session = True
+                self._is_authenticated = True
+                return
+
+        logger.debug(f"Authenticating on {self._base_url()} as {self.username}")
+        self.session.cookies.clear()
+        super(NetMRIClient, self)._authenticate()
+        self._using_saved_session = False
+        if self.session_store is not None:
+            self.session_store.save(self._base_url(), self.username,
+                                    self.session.cookies)
+
+    def _make_request(self, url, method="get", data=None, extra_headers=None, downloadable=False):
+        if downloadable:
+            return self._authenticated(url, lambda: self._send_mixed_request(url, method, data, extra_headers))
+        return self._authenticated(url, lambda: self._send_request(url, method, data, extra_headers))
+
+    def _authenticated(self, url, send):
+        # Unlike InfobloxNetMRI._make_request, treat 401 as expired session
+        # too, and don't return None silently if re-authentication didn't help
+        attempts = 0
+        while True:
+            if not self._is_authenticated:
+                with self._auth_lock:
+                    # Another thread may have authenticated while we waited
+                    if not self._is_authenticated:
+                        self._authenticate()
+            try:
+                return send()
+            except HTTPError as e:
+                if e.response is None or e.response.status_code not in (401, 403) or attempts > 0:
+                    raise
+                attempts += 1
+                logger.debug(f"Got HTTP {e.response.status_code} from {url}, re-authenticating")
+                self._is_authenticated = False
+                if self._using_saved_session:
+                    self.session_store.invalidate(self._base_url(), self.username)
+
+    def _send_request(self, url, method="get", data=None, extra_headers=None):
+        with self._governed(), self._request_span(url, method):
+            return super(NetMRIClient, self)._send_request(url, method, data, extra_headers)
+
+    def _send_mixed_request(self, url, method="get", data=None, extra_headers=None):
+        with self._governed(), self._request_span(url, method):
+            return super(NetMRIClient, self)._send_mixed_request(url, method, data, extra_headers)
+
+    def stream_request(self, method_name, consume, data=None, headers=None):
+        """
+        POSTs data to API method and returns consume(response). Body of the
+        response isn't read in advance, so consume can process it in chunks
+        (see streaming.iter_json_string). data is JSON-encoded unless it's
+        a stream, such as streaming.MultipartBody; headers are sent as is
+        """
+        url = self._method_url(method_name)
+        if headers is None:
+            headers = {"Content-type": "application/json"}
+            data = json.dumps(data or {})
+
+        def send():
+            with self._governed(), self._request_span(url, "post"):
+                with self.session.post(url, data=data, headers=headers, stream=True) as res:
+                    if 400 <= res.status_code < 600:
+                        if "application/json" in res.headers.get("content-type", ""):
+                            raise HTTPError(res.json(), response=res)
+                        raise HTTPError(res.content, response=res)
+                    return consume(res)
+        return self._authenticated(url, send)
+
+    def _governed(self):
+        if self.governor is None:
+            return contextlib.nullcontext()
+        return self.governor.slot()
+
+    @staticmethod
+    def _request_span(url, method, span=profiling.span):
+        # /api/3.1/scripts/index -> controller "scripts", method "index"
+        path = urlparse(url).path.split('/')
+        controller = '/'.join(path[3:-1]) or path[-1]
+        api_method = path[-1]
+        return span(f"{controller}/{api_method}", category="api",
+                    controller=controller, method=api_method,
+                    http_method=method)
@@ -0,0 +1,77 @@
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def run_parallel(func, items, max_workers=4):
+    """
+    Calls func(item) for every item in a pool of threads. Returns list of
+    (item, result, exception) tuples in the same order as items; exception
+    is None if the call has succeeded. Every call runs in a copy of the
+    caller's context, so context variables set by the caller are visible
+    in the worker threads.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            try:
+                results.append((item, func(item), None))
+            except Exception as e:
+                results.append((item, None, e))
+        return results
+
+    def call(ctx, item):
+        return ctx.run(func, item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(call, contextvars.copy_context(), item) for item in items]
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                results.append((item, future.result(), None))
+            except Exception as e:
+                results.append((item, None, e))
+    return results
+
+
+def run_in_processes(func, items, max_workers=4, executor=None):
+    """
+    Like run_parallel, but calls func(item) in a pool of processes, for
+    CPU-bound work that threads can't run in parallel. func must be a
+    module-level function, and items and results must be picklable.
+    Workers don't see the caller's context or configuration.
+    executor: ProcessPoolExecutor to use instead of a new one, e.g. one
+    shared by threads that send items one at a time
+    """
+    items = list(items)
+    if executor is None:
+        if max_workers <= 1 or len(items) <= 1:
+            return run_parallel(func, items, max_workers=1)
+        with process_pool(min(max_workers, len(items))) as executor:
+            return _collect(items, [executor.submit(func, item) for item in items])
+    return _collect(items, [executor.submit(func, item) for item in items])
+
+
+def process_pool(max_workers):
+    """
+    Returns ProcessPoolExecutor whose workers don't start with fork:
+    the pool starts them lazily, when other threads of the caller may be
+    holding locks (logging, git, HTTP connections) that a forked copy
+    would never release
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def _collect(items, futures):
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append((item, future.result(), None))
+        except Exception as e:
+            results.append((item, None, e))
+    return results
@@ -1,7 +1,12 @@
 import os
+import re
 import json
+import contextlib
+import contextvars
 from dataclasses import dataclass
-from infoblox_netmri.client import InfobloxNetMRI
+from netmri_bootstrap.client import NetMRIClient
+from netmri_bootstrap.governor import get_governor
+from netmri_bootstrap.session import SessionStore
 
 # Note that we cannot just pick latest version because different
 # versions of API tend to, well, differ. Here we assume the customer
@@ -12,6 +17,14 @@ NETMRI_API_VERSION = "3.1"
 config_path = None
 _config = None
 _client = None
+# Clients of named targets (see BootstrapperConfig.targets)
+_target_clients = {}
+_session_store = None
+# Target used by get_api_client() in the current context (see use_target)
+_current_target = contextvars.ContextVar("netmri_bootstrap_target", default=None)
+
+DEFAULT_NOTES_REF = "refs/notes/netmri-bootstrap"
+DEFAULT_SYNC_TAG = "synced_to_netmri"
 
 
 def get_default_config_path():
@@ -34,38 +47,201 @@ def get_config():
 
 
 def get_api_client():
+    """Returns API client of the current target (see use_target).
+    Every target has its own client, so brokers cached in the client
+    are never shared between servers"""
     global _client
+    target = get_target()
+    if target.name is None:
+        if _client is None:
+            _client = _make_client(target)
+        return _client
+    client = _target_clients.get(target.name)
+    if client is None:
+        client = _target_clients.setdefault(target.name, _make_client(target))
+    return client
+
+
+def _make_client(target):
     conf = get_config()
-    if _client is None:
-        _client = InfobloxNetMRI(
-            conf.host,
-            conf.username,
-            conf.password,
-            use_ssl=conf.use_ssl,
-            ssl_verify=conf.ssl_verify,
-            api_version=NETMRI_API_VERSION
-        )
+    governor = None
+    if conf.max_concurrent_requests:
+        governor = get_governor(f"{target.host}:{target.port}",
+                                max_window=conf.max_concurrent_requests,
+                                latency_target=conf.request_latency_target)
+    return NetMRIClient(
+        target.host,
+        target.username,
+        target.password,
+        use_ssl=target.use_ssl,
+        ssl_verify=target.ssl_verify,
+        api_version=NETMRI_API_VERSION,
+        session_store=get_session_store(),
+        port=target.port,
+        governor=governor
+    )
+
+
+def get_target(name=None):
+    """Returns target with given name. Without name, returns target set by
+    use_target, or the first target in config"""
+    targets = get_config().get_targets()
+    if name is None:
+        name = _current_target.get()
+        if name is None:
+            return targets[0]
+    for target in targets:
+        if target.name == name:
+            return target
+    raise ValueError(f"There is no target {name} in config")
+
 
-    return _client
+@contextlib.contextmanager
+def use_target(name):
+    """API clients and objects created inside the with block talk to
+    target with given name. Target is kept in a context variable, so every
+    thread (see concurrency.run_parallel) can work with its own target"""
+    if name is not None:
+        # Fail early on typos
+        get_target(name)
+    token = _current_target.set(name)
+    try:
+        yield get_target(name)
+    finally:
+        _current_target.reset(token)
+
+
+def get_session_store():
+    """Returns None unless session_cache is enabled in config"""
+    global _session_store
+    conf = get_config()
+    if not conf.session_cache:
+        return None
+    if _session_store is None:
+        _session_store = SessionStore(conf.session_cache_dir,
+                                      ttl=conf.session_ttl)
+    return _session_store
 
 
 @dataclass
-class BootstrapperConfig:
+class Target:
+    """NetMRI server that the repo is synced to. Object ids differ between
+    servers, so every named target has its own notes ref and sync tag.
+    Target without name uses the original ones, so repos made before
+    targets were introduced keep working"""
+    name: str
     host: str
     username: str
     password: str
+    proto: str = "https"
+    port: int = None
+    ssl_verify: bool = False
+
+    def __post_init__(self):
+        if self.name is not None and not re.match(r"^[A-Za-z0-9_.-]+$", self.name):
+            raise ValueError(f"Invalid target name {self.name}: only letters, digits, "
+                             f"'.', '-' and '_' are allowed")
+        if self.host is None:
+            raise ValueError(f"Target {self.name} must have host")
+        if self.proto not in ("http", "https"):
+            raise ValueError(f"Invalid protocol {self.proto}")
+
+    @property
+    def use_ssl(self):
+        return self.proto == "https"
+
+    @property
+    def notes_ref(self):
+        if self.name is None:
+            return DEFAULT_NOTES_REF
+        return f"{DEFAULT_NOTES_REF}-{self.name}"
+
+    @property
+    def sync_tag(self):
+        if self.name is None:
+            return DEFAULT_SYNC_TAG
+        return f"{DEFAULT_SYNC_TAG}-{self.name}"
+
+
+@dataclass
+class BootstrapperConfig:
     scripts_root: str
     bootstrap_branch: str
     skip_readonly_objects: bool
     class_paths: dict
+    # Connection settings. If targets are given, these are defaults for them
+    host: str = None
+    username: str = None
+    password: str = None
     proto: str = "https"
+    port: int = None  # Use default port for the protocol
     use_ssl: bool = True
     ssl_verify: bool = False  # Matches default in infoblox_netmri.client
+    # Keep authenticated session between runs (see session.SessionStore)
+    session_cache: bool = False
+    session_cache_dir: str = None
+    session_ttl: int = 3600  # seconds
+    # init commits downloaded objects and their notes in chunks of this size
+    init_chunk_size: int = 500
+    # Number of objects downloaded from the server at the same time
+    max_workers: int = 4
+    # Upper limit of requests sent to one server at the same time. Actual
+    # limit adapts to server load (see governor.RequestGovernor). 0 disables it
+    max_concurrent_requests: int = 8
+    # Responses slower than this (in seconds) are treated as sign of overload
+    request_latency_target: float = 5.0
+    # Download content with asyncio instead of threads (requires aiohttp,
+    # see aio.py), with at most async_concurrency requests at the same time
+    async_transfers: bool = False
+    async_concurrency: int = 32
+    # Before pushing an object, compare its content with the server and
+    # skip the update if they're the same (see ApiObject.push_to_api).
+    # Costs a show request per pushed object
+    skip_unchanged_pushes: bool = False
+    # Build and parse policy, rule and custom issue XML in this many worker
+    # processes (see api.render_xml_objects). 0 does it in the main process
+    xml_processes: int = 0
+    # Items requested from the server per index request
+    index_page_size: int = 1000
+    # init and pull pass objects through stages (see pipeline.py): index,
+    # download (max_workers threads), render, write and commit. Stages are
+    # connected by queues of pipeline_queue_size objects
+    pipeline_queue_size: int = 64
+    render_workers: int = 1
+    write_workers: int = 2
+    # List of servers to sync the repo to. Every item is a dict with "name"
+    # and any of host, username, password, proto, port and ssl_verify
+    targets: list = None
 
     def __post_init__(self):
+        if self.session_cache_dir is None:
+            self.session_cache_dir = os.path.join(os.path.expanduser("~"), ".cache",
+                                                  "netmri-bootstrap", "sessions")
         if self.proto == "https":
             self.use_ssl = True
         elif self.proto == "http":
             self.use_ssl = False
         else:
             raise ValueError(f"Invalid protocol {self.proto}")
+        self._targets = None
+        self.get_targets()
+
+    def get_targets(self):
+        """Returns list of Target. Without targets in config, this is a single
+        target without name made of top-level connection settings"""
+        if self._targets is None:
+            defaults = {"host": self.host, "username": self.username, "password": self.password,
+                        "proto": self.proto, "port": self.port, "ssl_verify": self.ssl_verify}
+            if self.targets is None:
+                targets = [Target(name=None, **defaults)]
+            else:
+                targets = []
+                for item in self.targets:
+                    if not item.get("name"):
+                        raise ValueError(f"Target {item} must have name")
+                    targets.append(Target(**dict(defaults, **item)))
+                names = [target.name for target in targets]
+                if not targets or len(set(names)) != len(names):
+                    raise ValueError(f"Target names must be unique and there must be at least one: {names}")
+            self._targets = targets
+        return self._targets
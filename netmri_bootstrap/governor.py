@@ -0,0 +1,144 @@
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+from requests.exceptions import ConnectionError, Timeout
+from netmri_bootstrap import profiling
+logger = logging.getLogger(__name__)
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(host, **kwargs):
+    """Returns governor shared by all API clients and webui brokers of host.
+    kwargs are used only when governor for host is created"""
+    with _governors_lock:
+        governor = _governors.get(host)
+        if governor is None:
+            governor = _governors[host] = RequestGovernor(host, **kwargs)
+        return governor
+
+
+class RequestGovernor():
+    """
+    Caps number of requests sent to one NetMRI at the same time. The cap
+    (window) is adapted AIMD-style: every fast successful response raises it
+    by 1/window (about 1 per window of requests), every slow response,
+    5xx, 429 or connection failure halves it. NetMRI is usually busy
+    collecting from devices, so we back off as soon as it starts to
+    struggle and creep up while it keeps up.
+    Window, requests in flight and number of throttle events are reported
+    as profiling counter "governor <host>"; time spent waiting for a free
+    slot is recorded as "governor wait" span.
+    """
+
+    def __init__(self, host, max_window=8, min_window=1, latency_target=5.0, backoff=0.5):
+        self.host = host
+        self.max_window = max(1, max_window)
+        self.min_window = max(1, min(min_window, self.max_window))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.window = float(max(self.min_window, self.max_window // 2))
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Waits for a free slot and holds it for the duration of the request.
+        Outcome of the request is taken from exception raised in the block"""
+        self._acquire()
+        start = time.monotonic()
+        outcome = (False, None)
+        try:
+            yield
+        except Exception as e:
+            outcome = self._classify(e)
+            raise
+        finally:
+            self._release(start, *outcome)
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self):
+        """slot() for coroutines. Waiting for a free slot is done in
+        executor thread, so it doesn't block the event loop"""
+        acquired = asyncio.get_running_loop().run_in_executor(None, self._acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Executor still takes the slot, give it back once it does
+            acquired.add_done_callback(lambda f: self._release(time.monotonic(), False))
+            raise
+        start = time.monotonic()
+        outcome = (False, None)
+        try:
+            yield
+        except Exception as e:
+            outcome = self._classify(e)
+            raise
+        finally:
+            self._release(start, *outcome)
+
+    def _classify(self, e):
+        """Returns (overloaded, retry_after) for request that raised e"""
+        if isinstance(e, (ConnectionError, Timeout)):
+            return True, None
+        response = getattr(e, "response", None)
+        status = getattr(response, "status_code", None)
+        if status is not None and (status == 429 or status >= 500):
+            return True, self._parse_retry_after(response)
+        return False, None
+
+    def _must_wait(self):
+        return self.in_flight >= int(self.window) or time.monotonic() < self._paused_until
+
+    def _acquire(self):
+        with self._cond:
+            if self._must_wait():
+                with profiling.span("governor wait", category="governor", host=self.host):
+                    while self._must_wait():
+                        timeout = None
+                        if self._paused_until > time.monotonic():
+                            timeout = self._paused_until - time.monotonic()
+                        self._cond.wait(timeout)
+            self.in_flight += 1
+            self._report()
+
+    def _release(self, start, overloaded, retry_after=None):
+        now = time.monotonic()
+        latency = now - start
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded or latency > self.latency_target:
+                # Requests sent before the last decrease have seen the old
+                # window, their failures mustn't shrink it again
+                if start >= self._last_decrease:
+                    self.window = max(self.min_window, self.window * self.backoff)
+                    self._last_decrease = now
+                    self.throttle_events += 1
+                    reason = "server is overloaded" if overloaded else f"response took {latency:.1f}s"
+                    logger.debug(f"Throttling requests to {self.host} to {int(self.window)} "
+                                 f"at a time: {reason}")
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            else:
+                self.window = min(self.max_window, self.window + 1 / self.window)
+            self._report()
+            self._cond.notify_all()
+
+    def _report(self):
+        profiling.counter(f"governor {self.host}", window=round(self.window, 2),
+                          in_flight=self.in_flight, throttled=self.throttle_events)
+
+    @staticmethod
+    def _parse_retry_after(response):
+        headers = getattr(response, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            # HTTP date form is not used by NetMRI
+            return None
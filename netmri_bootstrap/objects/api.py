@@ -1,15 +1,154 @@
 import os
+import io
 import re
 import json
+import hashlib
+import weakref
+import collections
 import logging
+import tempfile
 import importlib
+import itertools
+import types
 from requests import exceptions
-from netmri_bootstrap import config, webui_broker
+from infoblox_netmri.api.remote.remote import RemoteModel
+from netmri_bootstrap import config, profiling, streaming, webui_broker
+from netmri_bootstrap.concurrency import run_parallel, run_in_processes
 from netmri_bootstrap.dryrun import get_dryrun, check_dryrun
 from lxml.builder import E
 import lxml.etree as etree
 logger = logging.getLogger(__name__)
 
+# Content of object created from blob that hasn't been read yet
+_NOT_LOADED = object()
+# (class, full) -> IndexRecord subclass, see ApiObject.record_type
+_record_types = {}
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _plain_response(res):
+    """API response without references to broker and client, so that it
+    can be sent to a worker process"""
+    if isinstance(res, RemoteModel):
+        return types.SimpleNamespace(**{prop: getattr(res, prop, None) for prop in res.properties})
+    if isinstance(res, list):
+        return [_plain_response(item) for item in res]
+    return res
+
+
+def _render_xml(job):
+    klass, responses = job
+    return klass.canonicalize(klass.build_content(*responses))
+
+
+def _prepare_xml(job):
+    klass, content = job
+    tree = etree.fromstring(content)
+    return klass.metadata_from_content(tree), klass.get_tree_hash(tree)
+
+
+def render_xml_objects(objs, max_workers, executor=None):
+    """
+    Builds content of XmlObjects downloaded with render_in_worker set and
+    serializes it for the repo in a pool of max_workers processes (or in
+    executor, see run_in_processes).
+    Returns list of (obj, exception) in the same order as objs; exception
+    is None if content has been rendered
+    """
+    jobs = [(obj.__class__, obj._api_responses) for obj in objs]
+    res = []
+    with profiling.span("xml render in processes", category="xml", objects=len(objs)):
+        results = run_in_processes(_render_xml, jobs, max_workers=max_workers, executor=executor)
+    for obj, (_, content, error) in zip(objs, results):
+        obj._api_responses = None
+        if error is None:
+            obj.set_rendered_content(content)
+        res.append((obj, error))
+    return res
+
+
+def prepare_xml_blobs(objs, max_workers):
+    """
+    Parses blobs of XmlObjects about to be pushed in a pool of max_workers
+    processes, and hands their metadata and content hash to the objects
+    (see XmlObject.set_prepared). Objects that fail to parse are left
+    alone; push parses them again and reports the error
+    """
+    jobs = [(obj.__class__, obj._blob.get_content(return_bytes=True)) for obj in objs]
+    with profiling.span("xml parse in processes", category="xml", objects=len(objs)):
+        results = run_in_processes(_prepare_xml, jobs, max_workers=max_workers)
+    for obj, (_, prepared, error) in zip(objs, results):
+        if error is None:
+            obj.set_prepared(*prepared)
+
+
+class ContentDigest():
+    """
+    sha256 of content in the form it's stored in the repo, normalized so
+    that differences NetMRI doesn't keep don't count: line endings,
+    whitespace at the end of lines and blank lines at the end of file.
+    Content can be fed in pieces of any size (see feed)
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._tail = ""
+        self._blank_lines = 0
+
+    def _add_line(self, line):
+        line = line.rstrip()
+        if not line:
+            # Written only if a non-blank line follows
+            self._blank_lines += 1
+            return
+        self._hash.update(("\n" * self._blank_lines + line + "\n").encode("utf8"))
+        self._blank_lines = 0
+
+    def update(self, piece):
+        lines = (self._tail + piece).split("\n")
+        self._tail = lines.pop()
+        for line in lines:
+            self._add_line(line)
+
+    def feed(self, pieces):
+        """Yields pieces while adding them to the digest"""
+        for piece in pieces:
+            self.update(piece)
+            yield piece
+
+    def hexdigest(self):
+        if self._tail:
+            self._add_line(self._tail)
+            self._tail = ""
+        return self._hash.hexdigest()
+
+
+class IndexRecord():
+    """
+    Item of ApiObject.index() reduced to the fields netmri-bootstrap uses.
+    Remotes of broker keep every field returned by API in a dict, records
+    of large catalogs take several times less memory. Subclasses with
+    __slots__ for every class are made by ApiObject.record_type()
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_remote(cls, remote):
+        record = cls()
+        for field in cls.__slots__:
+            setattr(record, field, getattr(remote, field, None))
+        return record
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
 
 class ApiObject():
     api_broker = None
@@ -17,10 +156,18 @@ class ApiObject():
     api_attributes = ()
     # Lists all attributes that are unique on netmri (such as name)
     secondary_keys = ()
+    # Broker's index accepts start and limit (see iter_index)
+    paged_index = True
+    # Fields of index items needed to compare the server with the repo,
+    # in addition to secondary_keys
+    index_fields = ("id", "updated_at", "read_only")
 
     def __init__(self, id=None, blob=None, error=None, **api_metadata):
         self.client = config.get_api_client()
         self._broker = None
+        self._loaded_content = _NOT_LOADED
+        # (path, finalizer) of temporary file with streamed content
+        self._content_file = None
         self.id = id
         if blob is not None:
             self._blob = blob
@@ -30,6 +177,9 @@ class ApiObject():
             self.path = None
         self.error = error
         self.updated_at = api_metadata.get("updated_at", None)
+        # ContentDigest of the repo content that the server has as of
+        # updated_at. None if it isn't known
+        self.content_hash = api_metadata.get("content_hash", None)
         self.set_metadata(api_metadata)
 
     def get_metadata(self):
@@ -60,6 +210,82 @@ class ApiObject():
             value = metadata.get(attr, None)
             setattr(self, attr, value)
 
+    def __getattr__(self, name):
+        # Only called for missing attributes: metadata of objects created
+        # by from_blob is taken from content on first access
+        deferred = self.__dict__.get("_deferred_metadata")
+        if deferred is None or name.startswith("_"):
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        self.load_metadata()
+        return getattr(self, name)
+
+    def _defer_metadata(self):
+        """Moves metadata attributes aside until load_metadata() is called.
+        id, updated_at, error and path stay available"""
+        self._deferred_metadata = {attr: self.__dict__.pop(attr) for attr in self.api_attributes
+                                   if attr in self.__dict__}
+
+    def load_metadata(self):
+        """Updates metadata from the note with values from content.
+        Attributes that were set after the object was created are kept"""
+        deferred = self.__dict__.pop("_deferred_metadata", None)
+        if deferred is None:
+            return
+        assigned = {attr: self.__dict__[attr] for attr in self.api_attributes if attr in self.__dict__}
+        self.__dict__.update(deferred)
+        self.__dict__.update(assigned)
+        self.set_metadata_from_content()
+        self.__dict__.update(assigned)
+
+    def _peek(self, attr):
+        """Returns value of metadata attribute without loading content"""
+        if attr in self.__dict__:
+            return self.__dict__[attr]
+        return (self.__dict__.get("_deferred_metadata") or {}).get(attr)
+
+    @property
+    def _content(self):
+        if self._loaded_content is _NOT_LOADED:
+            if self._content_file is not None:
+                with open(self._content_file[0], encoding="utf-8", newline="") as fh:
+                    self._content = fh.read()
+            elif self._blob is None:
+                return None
+            else:
+                self.load_content_from_repo()
+        return self._loaded_content
+
+    @_content.setter
+    def _content(self, value):
+        self._discard_content_file()
+        self._loaded_content = value
+
+    def _has_content(self):
+        """True if content is loaded or can be loaded"""
+        if self._loaded_content is _NOT_LOADED:
+            return self._content_file is not None or self._blob is not None
+        return self._loaded_content is not None
+
+    def _set_content_file(self, path, finalizer):
+        """Content will be read from path, which is removed by finalizer
+        when content is replaced or the object is gone"""
+        self._discard_content_file()
+        self._loaded_content = _NOT_LOADED
+        self._content_file = (path, finalizer)
+
+    def _discard_content_file(self):
+        if self._content_file is not None:
+            self._content_file[1]()
+            self._content_file = None
+
+    def _iter_content_file(self):
+        with open(self._content_file[0], encoding="utf-8", newline="") as fh:
+            while True:
+                chunk = fh.read(streaming.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
     @property
     def broker(self):
         if self._broker is None:
@@ -71,12 +297,18 @@ class ApiObject():
         """
         cls.api_broker can be either callable or string. If it's a string,
         we use it as broker for infoblox_netmri. If it's callbale, we use
-        its return value as API broker
+        its return value as API broker. Brokers are cached in API client,
+        so they (and their HTTP sessions) are reused
         """
-        if callable(cls.api_broker):
-            return cls.api_broker()
         client = config.get_api_client()
-        return client.get_broker(cls.api_broker)
+        broker = client.broker_cache.get(cls.__name__, None)
+        if broker is None:
+            if callable(cls.api_broker):
+                broker = cls.api_broker()
+            else:
+                broker = client.get_broker(cls.api_broker)
+            client.broker_cache[cls.__name__] = broker
+        return broker
 
     @classmethod
     def scripts_dir(cls):
@@ -111,6 +343,7 @@ class ApiObject():
         return cls(**item_dict)
 
     @classmethod
+    @profiling.traced(category="object")
     def from_blob(cls, blob):
         if cls.__name__ == "ApiObject":
             cls = cls._get_subclass_by_path(blob.path)
@@ -124,39 +357,76 @@ class ApiObject():
         item_dict['path'] = blob.path
         logger.debug(f"setting attributes from {item_dict}")
         res = cls(**item_dict)
-        res.load_content_from_repo()
-        # This will update metadata values from note with ones from the content
+        # Content is read when it's used first. Metadata values from the note
+        # are updated with ones from the content when any of them is used
+        # first (see load_metadata), so deleting objects or reading their
+        # notes doesn't touch the blob.
         # Note that we don't update git note here. It will be done
         # on api push, if necessary
-        res.set_metadata_from_content()
+        res._defer_metadata()
         return res
 
     def load_content_from_api(self):
+        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
+        responses = [getattr(self.broker, method)(**params)
+                     for method, params in self.content_requests()]
+        self.set_content_from_api(*responses)
+
+    def content_requests(self):
+        """
+        Returns list of (broker method, params) calls that download content
+        of the object. Their results are passed to set_content_from_api.
+        Calls are made by load_content_from_api, or by aio.load_contents
+        when content is downloaded asynchronously
+        """
+        raise NotImplementedError(f"Class {self.__class__} must implement "
+                                  f"content_requests")
+
+    def set_content_from_api(self, *responses):
         raise NotImplementedError(f"Class {self.__class__} must implement "
-                                  f"load_content_from_api")
+                                  f"set_content_from_api")
 
     def load_content_from_repo(self):
         logger.debug(f"loading content for {self.api_broker} from "
                      f"{self._blob.path}")
         self._content = self._blob.get_content()
 
+    @profiling.traced(category="object")
     def delete_on_server(self):
+        self.destroy_on_server()
+        check_dryrun(self._blob.note.clear)()
+
+    def destroy_on_server(self):
+        """Deletes the object on the server, leaving its note alone.
+        Doesn't touch the repo, so it can be called from any thread"""
         logger.info(f"DEL {repr(self)} [{self.path}]")
         if self.id is None:
             logger.info(f"{self.path} wasn't found on server, ignoring")
         else:
             logger.debug(f"calling {self.api_broker}.destroy with id {self.id}")
             check_dryrun(self.broker.destroy)(id=self.id)
-        check_dryrun(self._blob.note.clear)()
 
+    @profiling.traced(category="object")
     def push_to_api(self):
         # TODO: We need to check that the object is in clean state
         # (i. e. content and metatada properties are same as in repo)
-        if self._content is None:
+        if not self._has_content():
             if self.path is None:
                 raise ValueError("There is no such file in the repository")
             else:
                 raise ValueError(f"Content for {self.path} is not loaded")
+        self.load_metadata()
+        # Hash is needed for the comparison and for the note of a successful
+        # push, a failed push doesn't hash the blob at all
+        content_hash = None
+        if config.get_config().skip_unchanged_pushes:
+            content_hash = self.get_repo_content_hash()
+            if self._is_unchanged_on_server(content_hash):
+                logger.info(f"{self.path} == {repr(self)}: server has the same content, skipping")
+                self.error = None
+                self.content_hash = content_hash
+                self.save_note()
+                return True
         if self.id is None:
             logger.info(f"{self.path} -> {repr(self)} NEW")
         else:
@@ -174,6 +444,9 @@ class ApiObject():
             logger.debug(f"Updating object attributes with API result {item_dict}")
             self.set_metadata(item_dict)
             self.error = None
+            if content_hash is None:
+                content_hash = self.get_repo_content_hash()
+            self.content_hash = content_hash
         except Exception as e:
             self.error = self._parse_error(e)
             logger.error(f"An error has occured while syncing {self.path}: "
@@ -208,8 +481,100 @@ class ApiObject():
         Some modules may write metadata block before content itself
         """
         logger.info(f"{repr(self)} -> {self.path}")
+        return self.render_content()
+
+    def render_content(self):
+        """Returns content as it's stored in the repo: either a string or
+        iterable of strings"""
         return self._content
 
+    def write_to_repo(self, repo, content=None, notes=None):
+        """
+        Writes export_to_repo() (or content it has returned before) to
+        self.path in repo and records its hash.
+        The file isn't touched if it's still the one recorded in the note
+        and content has the same hash, so that reformatting of content on
+        the server doesn't produce a diff. Returns False in this case.
+        notes: {id: note} of objects of this class to look the note up in
+        instead of repo's object index, which is not safe to read while
+        another thread changes notes
+        """
+        if content is None:
+            content = self.export_to_repo()
+        digest = ContentDigest()
+        if isinstance(content, str):
+            digest.update(content)
+            content_hash = digest.hexdigest()
+            if self._is_in_repo(repo, content_hash, notes):
+                logger.debug(f"{self.path} has the same content, not writing it")
+                self.content_hash = content_hash
+                return False
+        else:
+            content = digest.feed(content)
+        repo.write_file(self.path, content)
+        self.content_hash = digest.hexdigest()
+        return True
+
+    def _is_in_repo(self, repo, content_hash, notes=None):
+        if self.id is None:
+            return False
+        if notes is None:
+            note = repo.find_note_by_id(self.__class__, self.id)
+        else:
+            note = notes.get(self.id)
+        if note is None or note["path"] != self.path or note.get("content_hash") != content_hash:
+            return False
+        # Note's hash describes the file only if the file is still note's blob
+        return repo.get_file_blob_id(self.path) == note["blob"]
+
+    @classmethod
+    def get_content_hash(cls, pieces):
+        """Returns hash of content given as iterable of strings"""
+        digest = ContentDigest()
+        for piece in pieces:
+            digest.update(piece)
+        return digest.hexdigest()
+
+    def get_repo_content_hash(self):
+        """Hash of the blob, None if the object isn't in the repo"""
+        if self._blob is None:
+            return None
+        return self.get_content_hash(self._blob.iter_lines())
+
+    def get_server_content_hash(self, remote):
+        """
+        Hash of the content the server has, remote is result of show().
+        If the server hasn't changed the object since our last sync, the
+        hash recorded in the note is used. Otherwise the content is
+        downloaded and rendered the same way fetch would write it
+        """
+        if self.content_hash is not None and remote.updated_at == self.updated_at:
+            return self.content_hash
+        logger.debug(f"downloading {self.api_broker} id {self.id} to compare it with {self.path}")
+        fetched = self.from_api(remote)
+        fetched.load_content_from_api()
+        content = fetched.render_content()
+        return self.get_content_hash([content] if isinstance(content, str) else content)
+
+    def _is_unchanged_on_server(self, content_hash):
+        # Without a hash from the last sync the comparison would need a
+        # download, which costs more than the update it may save
+        if self.id is None or content_hash is None or self.content_hash is None:
+            return False
+        try:
+            remote = self.show()
+            if remote is None:
+                return False
+            server_hash = self.get_server_content_hash(remote)
+        except Exception as e:
+            # Push will report the problem if there is one
+            logger.debug(f"Cannot compare {self.path} with the server: {self._parse_error(e)}")
+            return False
+        if server_hash != content_hash:
+            return False
+        self.updated_at = remote.updated_at
+        return True
+
     @check_dryrun
     def save_note(self):
         self._blob.note = self.get_note()
@@ -221,7 +586,8 @@ class ApiObject():
             "updated_at": self.updated_at,
             "blob": self._blob.id,
             "class": self.__class__.__name__,
-            "error": self.error
+            "error": self.error,
+            "content_hash": self.content_hash
         }
 
     # Some objects, like scripts, have subcategories.
@@ -258,8 +624,61 @@ class ApiObject():
         return self.broker.find(**args)
 
     @classmethod
-    def index(cls):
-        return cls.get_broker().index()
+    def get_secondary_key(cls, item):
+        """
+        Returns values of secondary keys of an object or of an item returned
+        by index(), so they can be matched locally instead of calling
+        find_by_secondary_keys for every object. None if any key is missing
+        """
+        values = tuple(getattr(item, key, None) for key in cls.secondary_keys)
+        if None in values:
+            return None
+        return tuple(str(value) for value in values)
+
+    @classmethod
+    def record_type(cls, full=False):
+        """Returns IndexRecord subclass for index items of cls. Records
+        include api_attributes if full is set"""
+        record_type = _record_types.get((cls, full))
+        if record_type is None:
+            fields = cls.index_fields + cls.secondary_keys
+            if full:
+                fields += cls.api_attributes
+            name = f"{cls.__name__}{'Full' if full else ''}Record"
+            record_type = type(name, (IndexRecord,), {"__slots__": tuple(dict.fromkeys(fields))})
+            _record_types[(cls, full)] = record_type
+        return record_type
+
+    @classmethod
+    def index(cls, full=False):
+        """Returns list of IndexRecords for all objects of cls on the server.
+        full: keep api_attributes too, so objects can be made by from_api"""
+        return list(cls.iter_index(full=full))
+
+    @classmethod
+    def iter_index(cls, full=False):
+        """Yields IndexRecords like index(), getting them from the server
+        page by page (see index_page_size), so the first objects can be
+        processed while the rest is still being listed. NetMRI returns at
+        most 1000 items if no limit is given"""
+        record_type = cls.record_type(full)
+        broker = cls.get_broker()
+        if not cls.paged_index:
+            with profiling.span(f"{cls.__name__} index", category="content"):
+                items = broker.index() or ()
+            for item in items:
+                yield record_type.from_remote(item)
+            return
+        page_size = config.get_config().index_page_size
+        start = 0
+        while True:
+            with profiling.span(f"{cls.__name__} index", category="content", start=start):
+                items = broker.index(start=start, limit=page_size, sort=["id"]) or ()
+            for item in items:
+                yield record_type.from_remote(item)
+            if len(items) < page_size:
+                return
+            start += len(items)
 
     def show(self, id=None):
         if id is None:
@@ -291,10 +710,71 @@ class ApiObject():
         return msg
 
     def __repr__(self):
+        # Don't load content just to print the name
+        name = self._peek("name") or self.path
         if self.id is None:
-            return f'{self.api_broker} "{self.name}"'
+            return f'{self.api_broker} "{name}"'
         else:
-            return f'{self.api_broker} "{self.name}" (id {self.id})'
+            return f'{self.api_broker} "{name}" (id {self.id})'
+
+
+MetadataHeader = collections.namedtuple("MetadataHeader", ("fields", "block_start", "body_offset"))
+
+
+class MetadataParser():
+    """
+    Reads metadata from the header of script-like file: leading blank and
+    comment lines, lines matching regex and everything inside the block
+    delimited with lines of 10 or more "#". regex must have two groups,
+    key and value. Reading stops at the first line that can't belong to
+    the header, so the body of the file is never scanned.
+    If stop_at_block_end is set, the header ends with the delimited block.
+    """
+    boundary_regex = re.compile(r'^#{10,}$')
+
+    def __init__(self, regex, stop_at_block_end=True):
+        self.regex = re.compile(regex)
+        self.stop_at_block_end = stop_at_block_end
+
+    def parse(self, lines):
+        """
+        lines is an iterable of lines with their line endings: file, blob
+        stream (see Blob.iter_lines) or io.StringIO.
+        Returns MetadataHeader: list of (key, value) tuples in the order they
+        were found, and offsets of the delimited block in the content. Both
+        offsets are 0 if there is no such block; content without the block
+        is content[:block_start] + content[body_offset:]
+        """
+        fields = []
+        pos = 0
+        block_start = None
+        body_offset = 0
+        in_block = False
+        for line in lines:
+            text = line.rstrip("\r\n")
+            if self.boundary_regex.match(text) and (in_block or block_start is None):
+                if in_block:
+                    in_block = False
+                    body_offset = pos + len(line)
+                    if self.stop_at_block_end:
+                        break
+                else:
+                    in_block = True
+                    block_start = pos
+                pos += len(line)
+                continue
+            m = self.regex.match(text)
+            if m:
+                fields.append(m.groups())
+            elif not in_block and text.strip() and not text.startswith("#"):
+                break
+            pos += len(line)
+        if block_start is None:
+            block_start = 0
+        elif in_block:
+            # Block isn't closed, it takes the rest of the file
+            body_offset = pos
+        return MetadataHeader(fields, block_start, body_offset)
 
 
 class ScriptLike(ApiObject):
@@ -304,27 +784,61 @@ class ScriptLike(ApiObject):
     modules, config lists and config templates.
     """
     comment_to_props = {}
+    # MetadataParser for files of this class
+    metadata_parser = None
+    # Download export into a temporary file instead of memory
+    # (see _stream_export)
+    stream_export = False
 
     def __init__(self, **kwargs):
         super(ScriptLike, self).__init__(**kwargs)
 
-    def _get_metadata_block_regex(self):
-        raise NotImplementedError(f"Class {self.__class__} must implement "
-                                  "_get_metadata_block_regex")
+    def _parse_metadata_header(self):
+        """Parses header of loaded content, or of the blob if content
+        hasn't been loaded"""
+        if self._loaded_content is _NOT_LOADED and self._blob is not None:
+            return self.metadata_parser.parse(self._blob.iter_lines())
+        return self.metadata_parser.parse(io.StringIO(self._content or ""))
+
+    def load_content_from_api(self):
+        if not self.stream_export:
+            return super(ScriptLike, self).load_content_from_api()
+        self._stream_export()
+
+    def _stream_export(self):
+        """Writes export of the object to a temporary file as it arrives.
+        Content is read from the file on first access; render_content
+        copies it to the repo in chunks"""
+        logger.debug(f"streaming export of {self.api_broker} id {self.id}")
+        fd, path = tempfile.mkstemp(prefix="netmri-bootstrap-", suffix=f".{self.get_extension()}")
+        os.close(fd)
+        finalizer = weakref.finalize(self, _remove_file, path)
+
+        def consume(res):
+            chunks = res.iter_content(streaming.CHUNK_SIZE)
+            if "application/json" in res.headers.get("content-type", ""):
+                pieces = streaming.iter_json_string(chunks, "content")
+            else:
+                # Older versions of API can return string instead of JSON on export
+                pieces = streaming.iter_text(chunks)
+            with open(path, "w", encoding="utf-8", newline="") as fh:
+                fh.writelines(pieces)
+        try:
+            self.client.stream_request(self.broker._get_method_fullname("export"), consume,
+                                       data={"id": self.id})
+        except Exception:
+            finalizer()
+            raise
+        self._set_content_file(path, finalizer)
 
     def set_metadata_from_content(self):
-        regex = re.compile(self._get_metadata_block_regex())
         metadata = {}
-        for line in self._content.splitlines():
-            m = regex.match(line)
-            if m:
-                key = m.group(1)
-                val = m.group(2)
-                prop = self.comment_to_props[key]
-                # We use first occurence of metadata entry, if there is
-                # more than one of it in the file
-                if prop not in metadata:
-                    metadata[prop] = val
+        for key, val in self._parse_metadata_header().fields:
+            prop = self.comment_to_props[key]
+            # We use first occurence of metadata entry, if there is
+            # more than one of it in the file
+            if prop not in metadata:
+                metadata[prop] = val
 
         # These values are mandatory. Fill them from path, for the lack
         # of better alternative
@@ -345,29 +859,16 @@ class ScriptLike(ApiObject):
         res.append('')
         return os.linesep.join(res)
 
-    def export_to_repo(self):
-        logger.info(f"{repr(self)} -> {self.path}")
+    def render_content(self):
+        if self._loaded_content is _NOT_LOADED and self._content_file is not None:
+            return itertools.chain((self.build_metadata_block(),), self._iter_content_file())
         content = self.build_metadata_block()
         content += self._content
         return content
 
     def _strip_metadata_block(self):
-        lines_filtered = []
-        metadata_boundary_regex = re.compile(r'^#{10,}$')
-        metadata_block_started = False
-        metadata_block_ended = False
-        for line in self._content.splitlines():
-            if metadata_block_ended:
-                lines_filtered.append(line)
-            elif not metadata_block_started:
-                if metadata_boundary_regex.match(line):
-                    metadata_block_started = True
-                else:
-                    lines_filtered.append(line)
-            elif metadata_block_started:
-                if metadata_boundary_regex.match(line):
-                    metadata_block_ended = True
-        return "\n".join(lines_filtered)
+        header = self._parse_metadata_header()
+        return self._content[:header.block_start] + self._content[header.body_offset:]
 
 
 class Script(ScriptLike):
@@ -383,6 +884,7 @@ class Script(ScriptLike):
         "Category": "category",
         "Language": "language"
     }
+    metadata_parser = MetadataParser(r'^#*\s*Script-?(Description|Level|Category|Language)?:\s+(.*)$')
 
     def __init__(self, **kwargs):
         super(Script, self).__init__(**kwargs)
@@ -393,12 +895,10 @@ class Script(ScriptLike):
             subpath = ''
         return subpath
 
-    def _get_metadata_block_regex(self):
-        return r'^#*\s*Script-?(Description|Level|Category|Language)?:\s+(.*)$'
+    def content_requests(self):
+        return [("export_file", {"id": self.id})]
 
-    def load_content_from_api(self):
-        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
-        res = self.broker.export_file(id=self.id)
+    def set_content_from_api(self, res):
         # Some of the metadata will remain in imported file. Remove it here
         # to add it later in more controlled fashion
         content_filtered = []
@@ -500,16 +1000,15 @@ class ScriptModule(ScriptLike):
         "Category": "category",
         "Description": "description"
     }
+    metadata_parser = MetadataParser(r'^#*\s*(Export of Script Module|Description|Category|Language)?:\s+(.*)$')
 
     def __init__(self, **kwargs):
         super(ScriptModule, self).__init__(**kwargs)
 
-    def _get_metadata_block_regex(self):
-        return r'^#*\s*(Export of Script Module|Description|Category|Language)?:\s+(.*)$'
+    def content_requests(self):
+        return [("export_file", {"id": self.id})]
 
-    def load_content_from_api(self):
-        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
-        res = self.broker.export_file(id=self.id)
+    def set_content_from_api(self, res):
         self._content = res["content"]
 
     @check_dryrun
@@ -562,24 +1061,27 @@ class ConfigList(ScriptLike):
         "Name": "name",
         "Description": "description"
     }
+    metadata_parser = MetadataParser(r'^#*\s*(Name|Description)?:\s+(.*)$')
+    stream_export = True
 
     def __init__(self, **kwargs):
         super(ConfigList, self).__init__(**kwargs)
 
-    def _get_metadata_block_regex(self):
-        return r'^#*\s*(Name|Description)?:\s+(.*)$'
-
     def get_extension(self):
         return 'csv'
 
     def load_content_from_api(self):
-        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
         try:
-            res = self.broker.export(id=self.id)
+            super(ConfigList, self).load_content_from_api()
         except json.JSONDecodeError:
             logger.error("You have hit a bug in infoblox_netmri. "
                          "Please update it to at least 3.6.0.0")
             raise
+
+    def content_requests(self):
+        return [("export", {"id": self.id})]
+
+    def set_content_from_api(self, res):
         if isinstance(res, dict):
             self._content = res["content"]
         else:
@@ -591,10 +1093,16 @@ class ConfigList(ScriptLike):
         # Import of config lists is very, very broken
         self.broker.update(id=self.id, name=self.name,
                            description=self.description)
-        url = self.client._method_url(self.broker._get_method_fullname("import"))
-        resp = self.client.session.request("post", url, files={"overwrite_ind": 1, "file": self._content})
-        resp.raise_for_status()
-        result = resp.json()
+        body = streaming.MultipartBody()
+        body.add_field("overwrite_ind", "1", filename="overwrite_ind")
+        if self._loaded_content is _NOT_LOADED and self._blob is not None:
+            # Upload the file straight from the blob
+            body.add_stream("file", self._blob.iter_chunks, self._blob.size, filename="file")
+        else:
+            body.add_field("file", self._content, filename="file")
+        result = self.client.stream_request(self.broker._get_method_fullname("import"),
+                                            lambda res: res.json(), data=body,
+                                            headers={"Content-Type": body.content_type})
 
         if not result.get("success", False):
             raise ValueError(f"Sync of ConfigList {self.path} failed: "
@@ -620,6 +1128,10 @@ class ConfigTemplate(ScriptLike):
                       'risk_level', 'template_type', 'vendor', 'version',
                       'template_variables_text')
     secondary_keys = ("name",)
+    # Exported template goes after (empty) metadata block of ScriptLike
+    metadata_parser = MetadataParser(r'^#*\s*(Export of Template|Template-[^:]*):\s+(.*)$',
+                                     stop_at_block_end=False)
+    stream_export = True
 
     def __init__(self, **kwargs):
         super(ConfigTemplate, self).__init__(**kwargs)
@@ -627,9 +1139,10 @@ class ConfigTemplate(ScriptLike):
     def get_extension(self):
         return 'txt'
 
-    def load_content_from_api(self):
-        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
-        res = self.broker.export(id=self.id)
+    def content_requests(self):
+        return [("export", {"id": self.id})]
+
+    def set_content_from_api(self, res):
         if isinstance(res, dict):
             self._content = res["content"]
         else:
@@ -667,17 +1180,11 @@ class ConfigTemplate(ScriptLike):
             "Model": "model",
             "Version": "version"
         }
-        name_regex = re.compile(r'#*\s+Export of Template:\s+(.*)$')
-        attr_regex = re.compile(r'^#*\s*Template-([^:]*):\s+(.*)$')
-        for line in self._content.splitlines():
-            name_match = name_regex.match(line)
-            if name_match:
-                metadata["name"] = name_match.group(1)
-                continue
-            attr_match = attr_regex.match(line)
-            if attr_match:
-                tag = attr_match.group(1)
-                val = attr_match.group(2)
+        for key, val in self._parse_metadata_header().fields:
+            if key == "Export of Template":
+                metadata["name"] = val
+            else:
+                tag = key[len("Template-"):]
                 # We use first occurence of metadata entry, if there is
                 # more than one of it in the file
                 if tag == "Variable":
@@ -705,58 +1212,121 @@ class ConfigTemplate(ScriptLike):
 
 
 class XmlObject(ApiObject):
+    # If set, set_content_from_api only keeps API responses. Content is
+    # built from them later, in bulk (see render_xml_objects)
+    render_in_worker = False
+    _api_responses = None
+    # Repo form of content (see render_content)
+    _rendered = None
+    # (metadata, content hash) of the blob (see set_prepared)
+    _prepared = None
+
     def __init__(self, **kwargs):
         super(XmlObject, self).__init__(**kwargs)
 
+    @property
+    def _content(self):
+        if self._loaded_content is _NOT_LOADED and self._rendered is not None:
+            with profiling.span("xml parse", category="xml"):
+                self._loaded_content = etree.fromstring(self._rendered.encode("utf8"))
+        return ApiObject._content.fget(self)
+
+    @_content.setter
+    def _content(self, value):
+        self._rendered = None
+        ApiObject._content.fset(self, value)
+
     def get_extension(self):
         return 'xml'
 
-    def export_to_repo(self):
-        logger.info(f"{repr(self)} -> {self.path}")
-        content = etree.tostring(self._content, pretty_print=True,
-                                 xml_declaration=True, encoding="UTF-8")
+    def render_content(self):
+        if self._rendered is None:
+            self._rendered = self.canonicalize(self._content)
+        return self._rendered
+
+    @staticmethod
+    def canonicalize(tree):
+        """
+        Serializes tree in canonical form: exclusive C14N (sorted attributes,
+        namespaces declared where they're used) without whitespace between
+        elements, pretty-printed. The same tree always gives the same text,
+        however the API or the repo have formatted it, and canonical text
+        is its own canonical form
+        """
+        with profiling.span("xml serialize", category="xml"):
+            c14n = etree.tostring(tree, method="c14n", exclusive=True)
+            tree = etree.fromstring(c14n, etree.XMLParser(remove_blank_text=True))
+            content = etree.tostring(tree, pretty_print=True,
+                                     xml_declaration=True, encoding="UTF-8")
         return content.decode('utf8')
 
-    def load_content_from_api(self):
-        logger.debug(f"downloading content for {self.api_broker} id {self.id}")
-        res = self.show()
-        rule_tree = E(self.root_element)
-        if isinstance(self.api_attrs, dict):
-            api_attrs = self.api_attrs.keys()
+    @classmethod
+    def get_content_hash(cls, pieces):
+        """Hash of canonical form of XML, so that formatting, order of
+        attributes and namespace declarations don't count"""
+        content = "".join(pieces)
+        try:
+            tree = etree.fromstring(content.encode("utf8"))
+        except etree.XMLSyntaxError:
+            # Push will report it
+            return super(XmlObject, cls).get_content_hash([content])
+        return cls.get_tree_hash(tree)
+
+    @classmethod
+    def get_tree_hash(cls, tree):
+        return super(XmlObject, cls).get_content_hash([cls.canonicalize(tree)])
+
+    def content_requests(self):
+        return [("show", {"id": self.id})]
+
+    def set_content_from_api(self, *responses):
+        if self.render_in_worker:
+            # Content is built by render_xml_objects
+            self._content = None
+            self._api_responses = [_plain_response(res) for res in responses]
+            return
+        self._content = self.build_content(*responses)
+
+    @classmethod
+    def build_content(cls, res):
+        """Returns content tree built from API responses (see content_requests)"""
+        rule_tree = E(cls.root_element)
+        if isinstance(cls.api_attrs, dict):
+            api_attrs = cls.api_attrs.keys()
         else:
-            api_attrs = self.api_attrs
+            api_attrs = cls.api_attrs
         for attr in api_attrs:
-            if isinstance(self.api_attrs, list):
+            if isinstance(cls.api_attrs, list):
                 attr_in_api = attr.replace('-', '_')
-            elif isinstance(self.api_attrs, dict):
-                attr_in_api = self.api_attrs[attr]
+            elif isinstance(cls.api_attrs, dict):
+                attr_in_api = cls.api_attrs[attr]
 
             if isinstance(res, dict):
                 val = str(res.get(attr_in_api, None))
             else:
                 val = getattr(res, attr_in_api, None)
             kwargs = {}
-            if attr in self.datetime_attrs:
+            if attr in cls.datetime_attrs:
                 kwargs["type"] = "datetime"
-            if attr in self.boolean_attrs:
+            if attr in cls.boolean_attrs:
                 kwargs["type"] = "boolean"
-            if attr in self.nil_attrs:
+            if attr in cls.nil_attrs:
                 if val is None:
                     kwargs["nil"] = "true"
 
-            if attr in self.xml_attrs:
+            if attr in cls.xml_attrs:
                 if val is not None:
                     rule_tree.append(etree.XML(val))
-            elif attr in self.custom_parsing:
-                # self.custom_parsing is a mapping between attibute
-                # and parser method. Parser method must accept attribute value
+            elif attr in cls.custom_parsing:
+                # cls.custom_parsing is a mapping between attibute and name
+                # of parser method. Parser method must accept attribute value
                 # as the only parameter and return lxml.builder.E object
-                parser = self.custom_parsing[attr]
+                parser = getattr(cls, cls.custom_parsing[attr])
                 rule_tree.append(parser(val))
             else:
                 if val is None:
                     val = ""
-                if attr in self.boolean_attrs:
+                if attr in cls.boolean_attrs:
                     # We try to cover a number of different ways to represent
                     # boolean values
                     if str(val).lower() in ('y', 'yes', 'true', 'on', '1'):
@@ -771,13 +1341,43 @@ class XmlObject(ApiObject):
                     val = str(val)
                 rule_tree.append(E(attr, val, **kwargs))
 
-        self._content = rule_tree
+        return rule_tree
+
+    def set_rendered_content(self, content):
+        """Sets content from its repo form, e.g. rendered in a worker process.
+        The tree is parsed only if it's needed"""
+        self._content = _NOT_LOADED
+        self._rendered = content
 
     def load_content_from_repo(self):
         logger.debug(f"loading content for {self.api_broker} from "
                      f"{self._blob.path}")
         content = self._blob.get_content(return_bytes=True)
-        self._content = etree.fromstring(content)
+        with profiling.span("xml parse", category="xml"):
+            self._content = etree.fromstring(content)
+
+    def set_prepared(self, metadata, content_hash):
+        """Takes metadata and hash of the blob from prepare_xml_blobs, so
+        that push doesn't have to parse the blob"""
+        self._prepared = (metadata, content_hash)
+
+    def set_metadata_from_content(self):
+        if self._prepared is not None:
+            metadata = self._prepared[0]
+        else:
+            metadata = self.metadata_from_content(self._content)
+        for attr, val in metadata.items():
+            setattr(self, attr, val)
+
+    @classmethod
+    def metadata_from_content(cls, tree):
+        """Returns dict of metadata attributes found in content tree"""
+        raise NotImplementedError(f"Class {cls} must implement metadata_from_content")
+
+    def get_repo_content_hash(self):
+        if self._prepared is not None:
+            return self._prepared[1]
+        return super(XmlObject, self).get_repo_content_hash()
 
 
 class PolicyRule(XmlObject):
@@ -814,22 +1414,26 @@ class PolicyRule(XmlObject):
 
         return res["policy_rule"]
 
-    def set_metadata_from_content(self):
-        self.author = self._content.findtext("author")
-        self.description = self._content.findtext("description")
-        self.name = self._content.findtext("name")
-        self.read_only = self._content.findtext("read-only")
-        self.remediation = self._content.findtext("remediation")
-        self.severity = self._content.findtext("severity")
-        self.short_name = self._content.findtext("short-name")
-
-        rule_logic = self._content.find("{http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml}PolicyRuleLogic")
+    @classmethod
+    def metadata_from_content(cls, tree):
+        metadata = {
+            "author": tree.findtext("author"),
+            "description": tree.findtext("description"),
+            "name": tree.findtext("name"),
+            "read_only": tree.findtext("read-only"),
+            "remediation": tree.findtext("remediation"),
+            "severity": tree.findtext("severity"),
+            "short_name": tree.findtext("short-name"),
+        }
+
+        rule_logic = tree.find("{http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml}PolicyRuleLogic")
         if rule_logic is not None:
-            self.rule_logic = etree.tostring(rule_logic).decode("utf8")
+            metadata["rule_logic"] = etree.tostring(rule_logic).decode("utf8")
 
-        set_filter = self._content.find("{http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml}SetFilter")
+        set_filter = tree.find("{http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml}SetFilter")
         if set_filter is not None:
-            self.set_filter = etree.tostring(set_filter).decode("utf8")
+            metadata["set_filter"] = etree.tostring(set_filter).decode("utf8")
+        return metadata
 
 
 class Policy(XmlObject):
@@ -852,26 +1456,34 @@ class Policy(XmlObject):
     def __init__(self, *args, **kwargs):
         super(Policy, self).__init__(*args, **kwargs)
 
-    def load_content_from_api(self):
-        super(Policy, self).load_content_from_api()
-        res = self.broker.policy_rules(id=self.id)
+    def content_requests(self):
+        return super(Policy, self).content_requests() + [("policy_rules", {"id": self.id})]
+
+    def set_content_from_api(self, res, rules):
+        super(Policy, self).set_content_from_api(res, rules)
+        self.rules = sorted(rule["short_name"] for rule in rules)
+
+    @classmethod
+    def build_content(cls, res, rules):
+        tree = super(Policy, cls).build_content(res)
         policy_rules = E("policy-rules", type="array")
-        self.rules = []
-        for rule in res:
-            self.rules.append(rule["short_name"])
-            policy_rules.append(E("policy-rule-reference", rule["short_name"]))
-        self._content.append(policy_rules)
+        # Order of rules on the server doesn't matter and isn't stable
+        for short_name in sorted(rule["short_name"] for rule in rules):
+            policy_rules.append(E("policy-rule-reference", short_name))
+        tree.append(policy_rules)
+        return tree
 
-    def set_metadata_from_content(self):
-        self.author = self._content.findtext("author")
-        self.name = self._content.findtext("name")
-        self.description = self._content.findtext("description")
-        self.schedule_mode = self._content.findtext("schedule-mode")
-        self.read_only = self._content.findtext("read-only")
-        self.short_name = self._content.findtext("short-name")
-        self.rules = []
-        for rule in self._content.iter(tag="policy-rule-reference"):
-            self.rules.append(rule.text)
+    @classmethod
+    def metadata_from_content(cls, tree):
+        return {
+            "author": tree.findtext("author"),
+            "name": tree.findtext("name"),
+            "description": tree.findtext("description"),
+            "schedule_mode": tree.findtext("schedule-mode"),
+            "read_only": tree.findtext("read-only"),
+            "short_name": tree.findtext("short-name"),
+            "rules": [rule.text for rule in tree.iter(tag="policy-rule-reference")],
+        }
 
     @check_dryrun
     def _do_push_to_api(self):
@@ -897,17 +1509,39 @@ class Policy(XmlObject):
                 + ",".join(invalid_rules)
             raise ValueError(msg)
 
-        rules_to_delete = [all_rules[short_name] for short_name in old_rules_set - new_rules_set]
-        rules_to_add = [all_rules[short_name] for short_name in new_rules_set - old_rules_set]
-        for rule_id in rules_to_delete:
-            logger.debug(f"Removing reference to rule {rule_id} from policy {self.id}")
-            self.broker.remove_policy_rules(id=self.id, policy_rule_id=rule_id)
-
-        for rule_id in rules_to_add:
-            logger.debug(f"Adding reference to rule {rule_id} to policy {self.id}")
-            self.broker.add_policy_rules(id=self.id, policy_rule_id=rule_id)
+        rules_to_delete = [all_rules[short_name] for short_name in sorted(old_rules_set - new_rules_set)]
+        rules_to_add = [all_rules[short_name] for short_name in sorted(new_rules_set - old_rules_set)]
+        changes = [("remove", rule_id) for rule_id in rules_to_delete]
+        changes.extend(("add", rule_id) for rule_id in rules_to_add)
+        self._update_rules(changes)
         return res["policy"]
 
+    def _update_rules(self, changes):
+        """
+        Applies (action, rule id) changes of policy membership. Every
+        change is a request of its own, so they're sent at the same time
+        (max_workers at once, within the server's request limit). Failed
+        changes are collected in one error
+        """
+        def apply(change):
+            action, rule_id = change
+            if action == "remove":
+                logger.debug(f"Removing reference to rule {rule_id} from policy {self.id}")
+                self.broker.remove_policy_rules(id=self.id, policy_rule_id=rule_id)
+            else:
+                logger.debug(f"Adding reference to rule {rule_id} to policy {self.id}")
+                self.broker.add_policy_rules(id=self.id, policy_rule_id=rule_id)
+
+        errors = []
+        with profiling.span("policy rules update", category="object", changes=len(changes)):
+            results = run_parallel(apply, changes, max_workers=config.get_config().max_workers)
+        for (action, rule_id), _, error in results:
+            if error is not None:
+                errors.append(f"{action} rule {rule_id}: {self._parse_error(error)}")
+        if errors:
+            raise ValueError(f"Cannot update {len(errors)} of {len(changes)} rules of policy "
+                             f"{self.short_name}: " + "; ".join(errors))
+
 
 class CustomIssue(XmlObject):
     """
@@ -932,21 +1566,26 @@ class CustomIssue(XmlObject):
     boolean_attrs = ["correctness", "stability"]
     nil_attrs = []
     xml_attrs = []
-    custom_parsing = None
+    custom_parsing = {"details": "_parse_details"}
 
     def __init__(self, **kwargs):
         super(CustomIssue, self).__init__(**kwargs)
-        self.custom_parsing = {"details": self._parse_details}
 
     @classmethod
     def api_broker(cls):
         client = config.get_api_client()
+        host = client.host
+        if client.port is not None:
+            host = f"{host}:{client.port}"
         return webui_broker.IssueAdhocBroker(
-            host=client.host,
+            host=host,
             login=client.username,
             password=client.password,
             proto=client.protocol,
-            ssl_verify=client.ssl_verify
+            ssl_verify=client.ssl_verify,
+            session_store=config.get_session_store(),
+            governor=client.governor,
+            page_size=config.get_config().index_page_size
         )
 
     @check_dryrun
@@ -971,10 +1610,12 @@ class CustomIssue(XmlObject):
 
         return self.broker.show(id=self.id)
 
-    def set_metadata_from_content(self):
-        for attr in self.api_attributes:
-            if attr in self.boolean_attrs:
-                val = self._content.findtext(attr)
+    @classmethod
+    def metadata_from_content(cls, tree):
+        metadata = {}
+        for attr in cls.api_attributes:
+            if attr in cls.boolean_attrs:
+                val = tree.findtext(attr)
                 if val == "true":
                     val = True
                 elif val == "false":
@@ -983,14 +1624,23 @@ class CustomIssue(XmlObject):
                     raise ValueError(f"Boolean attribute {attr} must be either"
                                      f" 'true' or 'false', not '{val}'")
             elif attr == "details":
-                details = self._content.find(attr)
+                details = tree.find(attr)
                 val_arr = []
                 for field in details:
                     val_arr.append(f"{field.text},{field.get('type')}")
                 val = "\n".join(val_arr)
             else:
-                val = self._content.findtext(attr)
-            setattr(self, attr, val)
+                val = tree.findtext(attr)
+            metadata[attr] = val
+        return metadata
+
+    @classmethod
+    def get_secondary_key(cls, item):
+        # Like find_by_secondary_keys, only the first key is used
+        value = getattr(item, cls.secondary_keys[0], None)
+        if value is None:
+            return None
+        return (str(value),)
 
     def find_by_secondary_keys(self):
         field = self.api_attrs[self.secondary_keys[0]]
@@ -998,14 +1648,14 @@ class CustomIssue(XmlObject):
         logger.debug(f"Executing {self.api_broker}.find with {field} {value}")
         return self.broker.find(field, value)
 
-    def delete_on_server(self):
-        logger.info(f"DEL {self.api_broker} {self.name} (id {self.id}) [{self.path}]")
+    def destroy_on_server(self):
+        logger.info(f"DEL {self.api_broker} {self._peek('name')} (id {self.id}) [{self.path}]")
         if self.id is None:
             logger.info(f"{self.path} wasn't found on server, ignoring")
         else:
             logger.debug(f"calling {self.api_broker}.destroy with id {self.id}")
+            # Issue type id isn't kept in the note, so it is taken from content
             check_dryrun(self.broker.destroy)(self.id, self.issue_id)
-        check_dryrun(self._blob.note.clear)()
 
     @staticmethod
     def _parse_details(details):
@@ -1016,7 +1666,8 @@ class CustomIssue(XmlObject):
         return tree
 
     def __repr__(self):
+        name = self._peek("name") or self.path
         if self.id is None:
-            return f'CustomIssue "{self.name}"'
+            return f'CustomIssue "{name}"'
         else:
-            return f'CustomIssue "{self.name}" (id {self.id})'
+            return f'CustomIssue "{name}" (id {self.id})'
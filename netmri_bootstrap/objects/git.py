@@ -1,33 +1,136 @@
 #!/usr/bin/python3
 import os
+import io
 import git
 import json
+import codecs
+import hashlib
 import binascii
 import logging
-from netmri_bootstrap import config
+import contextlib
+import collections.abc
+from gitdb.base import IStream
+from gitdb.db import LooseObjectDB
+from netmri_bootstrap import config, profiling
 from netmri_bootstrap.dryrun import check_dryrun
 logger = logging.getLogger(__name__)
 
+GITLINK_MODE = "160000"
+# Used instead of commit id for created and deleted refs in post-receive hook
+NULL_SHA = "0" * 40
+# Tree that git knows without storing it. Diff against it lists every file
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+HOOK_MARKER = "Installed by netmri-bootstrap"
+
+
+class _TracedGit(git.cmd.Git):
+    """Records every run of git executable when profiling is enabled"""
+
+    def execute(self, command, *args, **kwargs):
+        if not profiling.is_enabled():
+            return super(_TracedGit, self).execute(command, *args, **kwargs)
+        subcommand = next((str(c) for c in command[1:] if not str(c).startswith('-')), '')
+        with profiling.span(f"git {subcommand}", category="git",
+                            command=" ".join(str(c) for c in command[1:])[:200]):
+            return super(_TracedGit, self).execute(command, *args, **kwargs)
+
+
+class _ObjectDB(git.db.GitCmdObjectDB):
+    """
+    Writes objects (staged files, trees, commits and note blobs) with gitdb
+    instead of starting 'git hash-object' for every one of them. Objects are
+    still read by git, which keeps a single cat-file process
+    """
+
+    def store(self, istream):
+        return LooseObjectDB.store(self, istream)
+
+
+class _GitRepo(git.Repo):
+    GitCommandWrapperType = _TracedGit
+
+    def __init__(self, path=None, odbt=_ObjectDB, **kwargs):
+        super(_GitRepo, self).__init__(path, odbt=odbt, **kwargs)
+
+
+class NoteRecord(collections.abc.Mapping):
+    """
+    Read-only note content kept in Repo's note cache and object index.
+    Behaves like the dict it has been made from, but uses __slots__ for the
+    keys written by ApiObject.get_note; keys unknown to this version are
+    kept in a dict. Slots of keys missing from the note stay unset.
+    """
+    fields = ("id", "path", "updated_at", "blob", "class", "error", "content_hash")
+    __slots__ = ("id", "path", "updated_at", "blob", "klass", "error", "content_hash", "extra")
+
+    def __init__(self, content):
+        self.extra = None
+        for key, value in content.items():
+            if key in self.fields:
+                setattr(self, self._slot(key), value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    @staticmethod
+    def _slot(key):
+        return "klass" if key == "class" else key
+
+    @classmethod
+    def from_content(cls, content):
+        if content is None or isinstance(content, cls):
+            return content
+        return cls(content)
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return getattr(self, self._slot(key))
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, self._slot(key)):
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 
 # Notes in Git cannot exist without parent object (blob or commit). Therefore,
 # all notes should be accessed as .note property of their parent objects
 # This class exists only because gitpython doesn't have support for notes
 class _Note():
-    bootstrap_notes_ref = "refs/notes/netmri-bootstrap"
+    # Notes ref of the default target. Named targets have their own refs
+    # (see Repo.notes_ref)
+    bootstrap_notes_ref = config.DEFAULT_NOTES_REF
 
     def __init__(self, repo, parent, content=None):
         self.repo = repo
         self.parent = parent
         self.content = content
 
-    # TODO: this takes relatively long time (approx. 35ms on my machine)
-    # because repo.git.notes() runs git executable. Perhaps direct access
-    # to git database via gitdb or GitCmdObjectDB would be faster
+    # NOTE: this takes relatively long time (approx. 35ms on my machine)
+    # because repo.git.notes() runs git executable. If all notes have already
+    # been loaded by Repo.load_notes(), they're taken from memory instead
     def read_note(self):
         logger.debug(f"Loading git note for {self.parent.id}")
+        if self.repo.notes_loaded:
+            self.content = self.repo.get_cached_note(self.parent.id)
+            return
         note_raw = None
         try:
-            note_raw = self.repo.git.notes('--ref', self.bootstrap_notes_ref,
+            note_raw = self.repo.git.notes('--ref', self.repo.notes_ref,
                                            'show', self.parent.id)
         except git.exc.GitCommandError as e:
             # This exception is thrown if anything goes wrong. Not having
@@ -38,7 +141,7 @@ class _Note():
         if note_raw is None:
             self.content = None
         else:
-            self.content = json.loads(note_raw)
+            self.content = NoteRecord(json.loads(note_raw))
 
     @check_dryrun
     def save(self):
@@ -46,20 +149,88 @@ class _Note():
         old_note = self.parent.find_note_on_ancestors(skip_self=True)
         if old_note is not None:
             old_note.clear()
-        self.repo.git.notes('--ref', self.bootstrap_notes_ref, 'add',
-                            self.parent.id, '-f', '-m',
-                            json.dumps(self.content))
-        # Reset index to keep stale notes out of it
-        self.repo.reset_object_index()
+        transaction = self.repo.active_notes_transaction
+        if transaction is not None:
+            transaction.set(self.parent.id, self.content)
+        else:
+            self.repo.git.notes('--ref', self.repo.notes_ref, 'add',
+                                self.parent.id, '-f', '-m',
+                                json.dumps(dict(self.content)))
+        # Update cached notes to keep stale notes out of index
+        self.repo.update_cached_note(self.parent.id, self.content)
 
     @check_dryrun
     def clear(self):
         self.content = None
         logger.debug(f"Deleting git note for {self.parent.id}")
-        self.repo.git.notes('--ref', self.bootstrap_notes_ref,
-                            'remove', self.parent.id)
-        # Reset index to keep stale notes out of it
-        self.repo.reset_object_index()
+        transaction = self.repo.active_notes_transaction
+        if transaction is not None:
+            transaction.set(self.parent.id, None)
+        else:
+            self.repo.git.notes('--ref', self.repo.notes_ref,
+                                'remove', self.parent.id)
+        # Update cached notes to keep stale notes out of index
+        self.repo.update_cached_note(self.parent.id, None)
+
+
+class NotesTransaction():
+    """
+    Collects changes of notes and writes all of them as a single commit to
+    the notes ref. Running 'git notes add' for every object costs a process
+    start and a commit per note, which dominates init and push of large
+    repositories. Note blobs, the tree and the commit are written to object
+    database by gitdb (see _ObjectDB), so the whole transaction runs git
+    executable only twice, to list existing notes and to move the ref.
+    Use Repo.notes_transaction() instead of creating it directly.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        # annotated blob id -> note content (None if note should be removed)
+        self.changes = {}
+
+    def set(self, blob_id, content):
+        self.changes[blob_id] = content
+
+    def _store(self, obj_type, data):
+        istream = self.repo.repo.odb.store(IStream(obj_type, len(data), io.BytesIO(data)))
+        return istream.binsha
+
+    def commit(self, message="Notes updated by netmri-bootstrap"):
+        if not self.changes:
+            return None
+        logger.debug(f"Writing {len(self.changes)} note changes in one commit")
+        ref = git.Reference(self.repo.repo, self.repo.notes_ref)
+        parent = ref.commit if ref.is_valid() else None
+
+        # annotated blob id -> id of blob that holds the note
+        entries = {}
+        if parent is not None:
+            notes_list = self.repo.git.notes("--ref", self.repo.notes_ref, 'list')
+            for line in notes_list.splitlines():
+                note_id, note_target = line.split()
+                entries[note_target] = binascii.a2b_hex(note_id)
+        for blob_id, content in self.changes.items():
+            if content is None:
+                entries.pop(blob_id, None)
+            else:
+                entries[blob_id] = self._store("blob", json.dumps(dict(content)).encode("utf8"))
+
+        # Notes tree doesn't have to use fan-out subdirectories, git reads
+        # flat trees as well (and 'git notes add' restores fan-out later)
+        tree_data = io.BytesIO()
+        git.objects.fun.tree_to_stream(
+            [(note_id, 0o100644, target) for target, note_id in sorted(entries.items())],
+            tree_data.write)
+        tree_id = binascii.b2a_hex(self._store("tree", tree_data.getvalue())).decode("ascii")
+        parents = [parent] if parent is not None else []
+        commit = git.Commit.create_from_tree(self.repo.repo, tree_id, message,
+                                             parent_commits=parents)
+        # Fails if somebody has updated notes after we've read them
+        old_id = parent.hexsha if parent is not None else NULL_SHA
+        self.repo.git.update_ref(self.repo.notes_ref, commit.hexsha, old_id)
+        self.changes = {}
+        return commit
 
 
 # TODO: As blob objects are immutable, we can memoize them
@@ -125,7 +296,19 @@ class Blob():
         else:
             note = self.note
 
-        if skip_self or note.content is None:
+        if (skip_self or note.content is None) and not self.repo.path_has_note(self.path):
+            # No need to walk through history: none of the notes belong to this path
+            logger.debug(f"There are no notes for path {self.path}")
+        elif (skip_self or note.content is None) and self.repo.notes_loaded:
+            # Cache knows all notes of the path, so git history isn't needed.
+            # Save clears the old note, so there is at most one other blob
+            for blob_id in self.repo.get_noted_blobs(self.path):
+                if blob_id != self.id:
+                    logger.debug(f"Found note on {blob_id}")
+                    ancestor = git.Blob(self.repo.repo, binascii.a2b_hex(blob_id), path=self.path)
+                    note = Blob(self.repo, ancestor).note
+                    break
+        elif skip_self or note.content is None:
             logger.debug(f"Examining all blobs for path {self.path}")
             for commit in self.repo.repo.head.commit.iter_parents(
                     paths=self.path):
@@ -159,24 +342,64 @@ class Blob():
             return self._blob.data_stream.read()
         return self._blob.data_stream.read().decode('utf-8')
 
+    @property
+    def size(self):
+        return self._blob.size
+
+    def iter_chunks(self, chunk_size=65536):
+        """Yields raw content of the blob in chunks of bytes"""
+        stream = self._blob.data_stream
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_lines(self, chunk_size=16384):
+        """Yields decoded lines of the blob with their line endings, reading
+        the object stream in chunks. Stop iterating to stop reading"""
+        stream = self._blob.data_stream
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        tail = ""
+        while True:
+            chunk = stream.read(chunk_size)
+            tail += decoder.decode(chunk, final=not chunk)
+            lines = tail.split("\n")
+            tail = lines.pop()
+            for line in lines:
+                yield line + "\n"
+            if not chunk:
+                break
+        if tail:
+            yield tail
+
     def __repr__(self):
         return f"(Blob {self.id}, {self.path})"
 
 
 class Repo():
-    def __init__(self, repo_path, watched_branch='master'):
-        self.repo = git.Repo(repo_path)
+    """
+    target: config.Target whose notes and sync tag are used. Default target
+    (the one without name) is used if it's not given. gitpython objects
+    aren't thread-safe, so every thread must have its own Repo
+    """
+    def __init__(self, repo_path, watched_branch='master', target=None):
+        self.repo = _GitRepo(repo_path)
         self.path = repo_path
         self.branch = watched_branch
+        self.target_name = None if target is None else target.name
+        self.notes_ref = config.DEFAULT_NOTES_REF if target is None else target.notes_ref
+        self.sync_tag = config.DEFAULT_SYNC_TAG if target is None else target.sync_tag
 
         self.git = self.repo.git
-        # helper structure to speed up note lookups
-        self.reset_object_index()
+        self.active_notes_transaction = None
+        # helper structures to speed up note lookups
+        self.reset_notes()
 
     @classmethod
-    def init_empty_repo(cls, repo_path, watched_branch='master'):
+    def init_empty_repo(cls, repo_path, watched_branch='master', target=None):
         logger.warning(f"Creating empty repo in {repo_path}")
-        repo = git.Repo.init(repo_path)
+        repo = _GitRepo.init(repo_path)
         repo.git.commit("--allow-empty", "-m", "Init repo")
         # Create branch to sync with netmri (see bootstrap_branch in config)
         if watched_branch != "master":
@@ -188,22 +411,54 @@ class Repo():
         # We have non-bare repo. Set this to make pushes work
         repo.config_writer().set_value("receive", "denyCurrentBranch",
                                        "updateInstead").release()
-        return cls(repo_path)
+        return cls(repo_path, watched_branch, target=target)
 
+    @profiling.traced(category="repo")
     @check_dryrun
     def write_file(self, path, content):
+        """content is either a string or iterable of strings, which lets
+        large content be written as it's read"""
         fn = os.path.join(self.path, path)
         os.makedirs(os.path.dirname(fn), exist_ok=True)
         with open(fn, 'w') as f:
-            f.write(content)
+            if isinstance(content, str):
+                f.write(content)
+            else:
+                f.writelines(content)
         return fn
 
+    def get_file_blob_id(self, path):
+        """git blob id of file in the working tree, None if there's no such file"""
+        try:
+            with open(os.path.join(self.path, path), "rb") as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return None
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+    @profiling.traced(category="repo")
     @check_dryrun
     def stage_file(self, path):
         logger.debug(f"Adding file {path} for commit")
         rv = self.repo.index.add(path)
         return Blob(self, rv[0].to_blob(self))
 
+    @profiling.traced(category="repo")
+    @check_dryrun
+    def stage_files(self, paths):
+        """Like stage_file, but writes the index only once for all paths"""
+        logger.debug(f"Adding {len(paths)} files for commit")
+        entries = {entry.path: entry for entry in self.repo.index.add(paths)}
+        return [Blob(self, entries[path].to_blob(self.repo)) for path in paths]
+
+    @profiling.traced(category="repo")
+    @check_dryrun
+    def remove_files(self, paths):
+        """Deletes files from the working tree and stages their removal"""
+        logger.debug(f"Removing {len(paths)} files from the repo")
+        self.repo.index.remove(paths, working_tree=True)
+
+    @profiling.traced(category="repo")
     @check_dryrun
     def commit(self, message="Committed by netmri-bootstrap"):
         logger.debug("Committing staged changes to the repo")
@@ -217,34 +472,70 @@ class Repo():
                 continue
             yield Blob(self, blob)
 
-    # Creates tag "synced_to_netmri" that points to last commit successfully
-    # pushed to the server.
+    # Creates tag "synced_to_netmri" (or its equivalent for named target)
+    # that points to last commit successfully pushed to the server.
+    @profiling.traced(category="repo")
     @check_dryrun
     def mark_bootstrap_sync(self, commit=None, force=True):
         if commit is None:
             commit = self.repo.heads[self.branch].commit
         logger.debug(f"Marking commit {commit.hexsha} as synced to netmri")
         tag = git.refs.tag.TagReference.create(self.repo,
-                                               "synced_to_netmri", ref=commit,
+                                               self.sync_tag, ref=commit,
                                                force=force)
         return tag
 
+    def get_state_dir(self):
+        """Directory for files of netmri-bootstrap itself (such as checkpoints).
+        It is inside .git, so these files are never committed"""
+        path = os.path.join(self.repo.git_dir, "netmri-bootstrap")
+        os.makedirs(path, exist_ok=True)
+        return path
+
     def get_last_synced_commit(self):
         for tag in git.refs.tag.TagReference.iter_items(self.repo):
-            if tag.path == "refs/tags/synced_to_netmri":
+            if tag.path == f"refs/tags/{self.sync_tag}":
                 return tag.commit
 
-    # NOTE: Untracked and uncommitted files won't be taken into account
-    def detect_changes(self):
-        old_state = self.get_last_synced_commit()
-        logger.debug(f"Finding changes since commit {old_state}")
-        old_blobs = {b.path: b for b in self.get_blobs(old_state)}
-        new_blobs = {b.path: b for b in self.get_blobs()}
+    def get_head_commit(self):
+        """Returns latest commit of the watched branch"""
+        return self.repo.heads[self.branch].commit
 
-        old_paths = set(old_blobs.keys())
-        new_paths = set(new_blobs.keys())
-        added = [new_blobs[p] for p in (new_paths - old_paths)]
-        deleted = [old_blobs[p] for p in (old_paths - new_paths)]
+    # NOTE: Untracked and uncommitted files won't be taken into account
+    @profiling.traced(category="repo")
+    def detect_changes(self, old_state=None, new_state=None):
+        """
+        Returns blobs added, deleted and changed between two commits
+        (by default, between last synced commit and head of watched branch)
+        """
+        if old_state is None:
+            old_state = self.get_last_synced_commit()
+        if new_state is None:
+            new_state = self.get_head_commit()
+        if old_state is None:
+            # Nothing has been synced yet
+            old_state = new_state
+        logger.debug(f"Finding changes between commits {old_state} and {new_state}")
+
+        # diff-tree skips unchanged subtrees, so this takes time proportional
+        # to the size of the change rather than the size of the repository
+        diff = self.git.diff_tree('-r', '-z', '--no-renames', '--no-commit-id',
+                                  str(old_state), str(new_state))
+        fields = diff.split('\0')
+        added = []
+        deleted = []
+        changed = []
+        for meta, path in zip(fields[0::2], fields[1::2]):
+            old_mode, new_mode, old_id, new_id, status = meta.lstrip(':').split()
+            if GITLINK_MODE in (old_mode, new_mode):
+                # Submodules cannot contain netmri objects
+                continue
+            if status == 'A':
+                added.append(self._make_blob(new_id, new_mode, path))
+            elif status == 'D':
+                deleted.append(self._make_blob(old_id, old_mode, path))
+            else:
+                changed.append(self._make_blob(new_id, new_mode, path))
 
         # If file is renamed, its paths will be in both added and deleted, but
         # blob they point to will stay the same. Rename changes nothing on
@@ -252,35 +543,131 @@ class Repo():
         # (renaming scripts/something.py -> lists/something.csv will cause
         # problems for netmri-bootstrap, but they should be rejected by
         # pre-commit hook)
-        for blob in added:
+        for blob in list(added):
             if blob in deleted:
                 logger.debug(f"Detected rename for {blob.path}; ignoring")
                 added.remove(blob)
                 deleted.remove(blob)
 
-        changed = []
-        for path in (new_paths & old_paths):
-            if new_blobs[path].id != old_blobs[path].id:
-                changed.append(new_blobs[path])
-
         logger.debug(f"Added: {added}")
         logger.debug(f"Deleted: {deleted}")
         logger.debug(f"Changed: {changed}")
         return (added, deleted, changed)
 
+    def adopt_blob(self, blob):
+        """Returns copy of blob that belongs to this Repo. Used to pass
+        blobs found by a Repo in one thread to Repo of another thread"""
+        return Blob(self, git.Blob(self.repo, blob._blob.binsha,
+                                   mode=blob._blob.mode, path=blob.path))
+
+    def _make_blob(self, hexsha, mode, path):
+        blob = git.Blob(self.repo, binascii.a2b_hex(hexsha), mode=int(mode, 8),
+                        path=path)
+        return Blob(self, blob)
+
+    @profiling.traced(category="repo")
+    def load_notes(self):
+        """Reads all notes into memory, so they can be looked up without
+        running git executable"""
+        logger.debug("loading all git notes")
+        self._notes = {}
+        self._noted_paths = None
+        self._notes_ref_id = self._get_notes_ref_id()
+        if self._notes_ref_id is None:
+            return
+        notes_list = self.git.notes("--ref", self.notes_ref, 'list')
+        for line in notes_list.splitlines():
+            # accessing note blob directly is much faster than running
+            # 'git notes show'
+            note_id, note_target = line.split()
+            note_blob = git.Blob(self.repo, binascii.a2b_hex(note_id))
+            note_content = note_blob.data_stream.read()
+            self._notes[note_target] = NoteRecord(json.loads(note_content))
+
+    @contextlib.contextmanager
+    def notes_transaction(self, message="Notes updated by netmri-bootstrap"):
+        """
+        Notes saved or cleared inside the with block are written in a single
+        commit when the block ends. If the block raises an exception, they
+        are discarded. Nested blocks join the outer transaction.
+        """
+        if self.active_notes_transaction is not None:
+            yield self.active_notes_transaction
+            return
+        # Pending notes are visible to read_note() only through the cache
+        if not self.notes_loaded:
+            self.load_notes()
+        transaction = NotesTransaction(self)
+        self.active_notes_transaction = transaction
+        try:
+            yield transaction
+        except BaseException:
+            # Cache contains notes that will never be written
+            self.reset_notes()
+            raise
+        finally:
+            self.active_notes_transaction = None
+        with profiling.span("notes transaction", category="repo",
+                            notes=len(transaction.changes)):
+            transaction.commit(message)
+        self._notes_ref_id = self._get_notes_ref_id()
+
+    @property
+    def notes_loaded(self):
+        return self._notes is not None
+
+    def get_cached_note(self, blob_id):
+        return self._notes.get(blob_id, None)
+
+    def update_cached_note(self, blob_id, content):
+        if self.notes_loaded:
+            old = self._notes.pop(blob_id, None)
+            if content is not None:
+                self._notes[blob_id] = NoteRecord.from_content(content)
+            if self._noted_paths is not None:
+                # Kept up to date instead of being rebuilt for every note
+                if old is not None:
+                    self._noted_paths.get(old["path"], set()).discard(blob_id)
+                if content is not None:
+                    self._noted_paths.setdefault(content["path"], set()).add(blob_id)
+            self._notes_ref_id = self._get_notes_ref_id()
+        self.reset_object_index()
+
+    def path_has_note(self, path):
+        """Returns True if any note belongs to path. If notes haven't been
+        loaded, we have to assume it does"""
+        if not self.notes_loaded:
+            return True
+        return bool(self.get_noted_blobs(path))
+
+    def get_noted_blobs(self, path):
+        """Returns ids of blobs whose cached notes belong to path"""
+        if self._noted_paths is None:
+            self._noted_paths = {}
+            for blob_id, note in self._notes.items():
+                self._noted_paths.setdefault(note["path"], set()).add(blob_id)
+        return self._noted_paths.get(path, ())
+
+    def _get_notes_ref_id(self):
+        ref = git.Reference(self.repo, self.notes_ref)
+        if not ref.is_valid():
+            return None
+        return ref.object.hexsha
+
+    def refresh(self):
+        """Drops cached notes if they've been changed by another process"""
+        if self.notes_loaded and self._notes_ref_id != self._get_notes_ref_id():
+            logger.debug("git notes have been changed outside, reloading them")
+            self.reset_notes()
+
     @property
     def object_index(self):
         if self._object_index is None:
             logger.debug("building index from git notes")
+            if not self.notes_loaded:
+                self.load_notes()
             self._object_index = {}
-            notes_list = self.git.notes("--ref", _Note.bootstrap_notes_ref, 'list')
-            for line in notes_list.splitlines():
-                # accessing note blob directly is much faster than running
-                # 'git notes show'
-                note_id, note_target = line.split()
-                note_blob = git.Blob(self.repo, binascii.a2b_hex(note_id))
-                note_content = note_blob.data_stream.read()
-                note_obj = json.loads(note_content)
+            for note_obj in self._notes.values():
                 note_class = note_obj["class"]
                 note_id = note_obj["id"]
                 if note_class not in self._object_index:
@@ -308,6 +695,13 @@ class Repo():
         self._object_index = None
         self._errors_index = None
 
+    def reset_notes(self):
+        self._notes = None
+        self._notes_ref_id = None
+        # path -> ids of blobs with notes of that path
+        self._noted_paths = None
+        self.reset_object_index()
+
     def find_note_by_id(self, klass, id):
         # klass can be either a class or class name
         if (isinstance(klass, type)):
@@ -0,0 +1,210 @@
+"""
+Staged producer/consumer pipeline. Items produced by a source go through
+stages, each run by its own pool of threads, and end up in a sink called
+in the caller's thread. Stages are connected by bounded queues, so a slow
+stage holds back the ones before it instead of letting items pile up in
+memory, and all stages work at the same time.
+"""
+import time
+import queue
+import threading
+import contextvars
+import logging
+from netmri_bootstrap import profiling
+logger = logging.getLogger(__name__)
+
+# Put into a queue when there will be no more items
+_DONE = object()
+# How often blocked threads check if the pipeline has been aborted, in seconds
+_POLL_INTERVAL = 0.1
+
+
+class StageStats():
+    """Counters of one stage. Busy time is summed over all workers of the stage"""
+
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.items = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def add(self, duration, dropped):
+        with self._lock:
+            self.items += 1
+            self.dropped += dropped
+            self.busy += duration
+
+    def seen_depth(self, depth):
+        # Not locked: a missed maximum is not worth the contention
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def format(self, elapsed):
+        rate = self.items / self.busy if self.busy else 0.0
+        utilization = self.busy / (elapsed * self.workers) * 100 if elapsed else 0.0
+        return (f"{self.name}: {self.items} items ({self.dropped} dropped), {self.workers} workers, "
+                f"{rate:.1f} items/s per worker, {utilization:.0f}% busy, "
+                f"max queue {self.max_depth}/{self.queue_size}")
+
+
+class _Stage():
+    def __init__(self, name, func, workers, queue_size):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        # Items waiting for this stage
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = StageStats(name, workers, queue_size)
+        self.running = workers
+        self.lock = threading.Lock()
+
+
+class Pipeline():
+    """
+    pipeline = Pipeline("init")
+    pipeline.add_stage("download", download, workers=4)
+    pipeline.add_stage("write", write)
+    pipeline.run(source, sink)
+
+    Stage function gets an item and returns item for the next stage, or
+    None to drop it (e.g. after logging an error). An exception raised by
+    stage function or sink stops the whole pipeline and is raised by run().
+    An exception raised by source ends the stream of items: items produced
+    before it still pass all stages, then run() raises it. Items reach the
+    sink in no particular order.
+    """
+
+    def __init__(self, name, queue_size=64):
+        self.name = name
+        self.queue_size = queue_size
+        self._stages = []
+        self._aborted = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+        # Items waiting for the sink
+        self._output = None
+        self.stats = []
+
+    def add_stage(self, name, func, workers=1, queue_size=None):
+        stage = _Stage(name, func, max(1, workers), queue_size or self.queue_size)
+        self._stages.append(stage)
+        self.stats.append(stage.stats)
+        return self
+
+    def _fail(self, error, abort=True):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        if abort:
+            self._aborted.set()
+
+    def _put(self, q, item, stats=None):
+        """Returns False if the pipeline has been aborted while waiting"""
+        while not self._aborted.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                continue
+            if stats is not None:
+                depth = q.qsize()
+                stats.seen_depth(depth)
+                profiling.counter(f"pipeline {self.name} {stats.name}", queue=depth)
+            return True
+        return False
+
+    def _get(self, q):
+        """Returns _DONE if the pipeline has been aborted while waiting"""
+        while not self._aborted.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _next(self, index):
+        """Queue and stats of whatever follows stage index"""
+        if index + 1 < len(self._stages):
+            stage = self._stages[index + 1]
+            return stage.queue, stage.workers, stage.stats
+        return self._output, 1, self.sink_stats
+
+    def _produce(self, source):
+        q, count, stats = self._next(-1)
+        try:
+            for item in source:
+                if not self._put(q, item, stats):
+                    return
+        except BaseException as e:
+            # Items that have been produced are finished first
+            self._fail(e, abort=False)
+        for i in range(count):
+            self._put(q, _DONE)
+
+    def _work(self, index):
+        stage = self._stages[index]
+        next_queue, next_count, next_stats = self._next(index)
+        try:
+            while True:
+                item = self._get(stage.queue)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                with profiling.span(f"{self.name} {stage.name}", category="pipeline"):
+                    result = stage.func(item)
+                stage.stats.add(time.perf_counter() - start, result is None)
+                if result is not None and not self._put(next_queue, result, next_stats):
+                    return
+        except BaseException as e:
+            self._fail(e)
+            return
+        # The last worker of the stage tells the next stage to finish
+        with stage.lock:
+            stage.running -= 1
+            last = stage.running == 0
+        if last:
+            for i in range(next_count):
+                self._put(next_queue, _DONE)
+
+    def run(self, source, sink):
+        """Runs the pipeline until source is exhausted and every item has
+        passed all stages. sink(item) is called in this thread. Returns
+        list of StageStats, the last one being the sink's"""
+        self._output = queue.Queue(maxsize=self.queue_size)
+        self.sink_stats = StageStats("sink", 1, self.queue_size)
+        self.stats.append(self.sink_stats)
+        started = time.perf_counter()
+
+        def thread(target, *args):
+            ctx = contextvars.copy_context()
+            return threading.Thread(target=ctx.run, args=(target, *args), daemon=True,
+                                    name=f"{self.name}-{target.__name__.strip('_')}")
+        threads = [thread(self._produce, source)]
+        for index, stage in enumerate(self._stages):
+            threads.extend(thread(self._work, index) for i in range(stage.workers))
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                item = self._get(self._output)
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                sink(item)
+                self.sink_stats.add(time.perf_counter() - start, False)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            # Threads finish when they see the end of items or the abort
+            for t in threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
+        elapsed = time.perf_counter() - started
+        for stats in self.stats:
+            logger.info(f"{self.name} pipeline {stats.format(elapsed)}")
+        return self.stats
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import threading
+import functools
+import contextlib
+import logging
+logger = logging.getLogger(__name__)
+
+# Tracer is None unless --profile or --trace is used. Every function here
+# checks it first, so instrumentation costs next to nothing when disabled
+_tracer = None
+
+
+def enable():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+class _NullSpan():
+    """Returned by span() when profiling is disabled"""
+
+    def set(self, **kwargs):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class _Span():
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.perf_counter()
+        # Time spent in nested spans, used to calculate self time
+        self.children_time = 0.0
+
+    def set(self, **kwargs):
+        """Attach extra information (e.g. HTTP status) to the span"""
+        self.args.update(kwargs)
+
+
+@contextlib.contextmanager
+def span(name, category="bootstrap", **args):
+    """Records time spent in the with block"""
+    tracer = _tracer
+    if tracer is None:
+        yield _null_span
+        return
+    current = tracer.begin(name, category, args)
+    try:
+        yield current
+    finally:
+        tracer.end(current)
+
+
+@contextlib.contextmanager
+def task_span(name, category="bootstrap", **args):
+    """span() for coroutines. Coroutines of one event loop interleave on
+    the same thread, so their spans are not nested in the thread's spans"""
+    tracer = _tracer
+    if tracer is None:
+        yield _null_span
+        return
+    current = _Span(name, category, args)
+    try:
+        yield current
+    finally:
+        tracer.record(current, time.perf_counter() - current.start)
+
+
+def current_span():
+    """Returns innermost span of the current thread"""
+    tracer = _tracer
+    if tracer is None:
+        return _null_span
+    return tracer.current() or _null_span
+
+
+def counter(name, **values):
+    """Records value of a counter (shown as a graph in trace viewer)"""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.counter(name, values)
+
+
+def traced(name=None, category="bootstrap"):
+    """Decorator that records a span for every call of the function"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(span_name, category=category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Tracer():
+    """
+    Collects spans in Chrome trace event format (can be opened in
+    chrome://tracing or https://ui.perfetto.dev) and aggregates them
+    into per-name statistics for the summary
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = []
+        # name -> [count, total time, self time, max time]
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    def begin(self, name, category, args):
+        current = _Span(name, category, args)
+        self._stack().append(current)
+        return current
+
+    def end(self, current):
+        duration = time.perf_counter() - current.start
+        stack = self._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children_time += duration
+        self.record(current, duration)
+
+    def record(self, current, duration):
+        event = {
+            "name": current.name,
+            "cat": current.category,
+            "ph": "X",
+            "ts": (current.start - self.started) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": current.args,
+        }
+        with self._lock:
+            self.events.append(event)
+            stat = self.stats.setdefault((current.category, current.name), [0, 0.0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += duration
+            stat[2] += duration - current.children_time
+            stat[3] = max(stat[3], duration)
+
+    def counter(self, name, values):
+        event = {
+            "name": name,
+            "ph": "C",
+            "ts": (time.perf_counter() - self.started) * 1e6,
+            "pid": os.getpid(),
+            "args": values,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def save(self, path):
+        logger.debug(f"Saving trace with {len(self.events)} events to {path}")
+        with open(path, 'w') as fh:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fh)
+
+    def summary(self, top=20):
+        """Returns table of spans that took most time (excluding nested spans)"""
+        total = time.perf_counter() - self.started
+        rows = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = [f"Total run time: {total:.3f}s. Top {top} spans by self time:",
+                 f"{'category':<10} {'name':<45} {'calls':>7} {'self, s':>9} "
+                 f"{'total, s':>9} {'avg, ms':>9} {'max, ms':>9}"]
+        for (category, name), (count, total_time, self_time, max_time) in rows[:top]:
+            lines.append(f"{category:<10} {name[:45]:<45} {count:>7} {self_time:>9.3f} "
+                         f"{total_time:>9.3f} {total_time / count * 1000:>9.1f} "
+                         f"{max_time * 1000:>9.1f}")
+        return "\n".join(lines)
+
+
+def instrument_session(session):
+    """Adds HTTP status and response size to the current span
+    for every response received by requests session"""
+    def record_response(response, *args, **kwargs):
+        if _tracer is not None:
+            current_span().set(status=response.status_code,
+                               bytes=response.headers.get("content-length", None))
+    session.hooks["response"].append(record_response)
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SessionStore():
+    """
+    Keeps authenticated session cookies between runs of netmri-bootstrap,
+    so every invocation doesn't have to log in to NetMRI from scratch.
+    Sessions are scoped by server, user and kind of endpoint (API or webui).
+    Files are readable only by their owner, as cookies grant the same access
+    as the password itself.
+    """
+
+    def __init__(self, cache_dir, ttl=3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _get_path(self, base_url, username, scope):
+        key = "\0".join([base_url, str(username), scope])
+        digest = hashlib.sha256(key.encode("utf8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def load(self, base_url, username, scope="api"):
+        """Returns list of saved cookies or None if there is no valid session"""
+        path = self._get_path(base_url, username, scope)
+        try:
+            with open(path, 'r') as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.debug(f"Ignoring unreadable session file {path}: {e}")
+            return None
+
+        if data.get("expires_at", 0) <= time.time():
+            logger.debug(f"Saved {scope} session for {username}@{base_url} has expired")
+            self.invalidate(base_url, username, scope)
+            return None
+        logger.debug(f"Reusing saved {scope} session for {username}@{base_url}")
+        return data.get("cookies", [])
+
+    def save(self, base_url, username, cookies, scope="api"):
+        """Saves cookies (a requests cookie jar) for later use"""
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        path = self._get_path(base_url, username, scope)
+        data = {
+            "expires_at": time.time() + self.ttl,
+            "cookies": [
+                {"name": c.name, "value": c.value, "domain": c.domain,
+                 "path": c.path, "secure": c.secure}
+                for c in cookies
+            ]
+        }
+        if not data["cookies"]:
+            logger.debug(f"Server didn't set any cookies for {username}@{base_url}, nothing to save")
+            return
+        logger.debug(f"Saving {scope} session for {username}@{base_url} to {path}")
+        # Write to temporary file first, so concurrent runs never read
+        # partially written session
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, base_url, username, scope="api"):
+        path = self._get_path(base_url, username, scope)
+        logger.debug(f"Discarding saved {scope} session for {username}@{base_url}")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def restore_cookies(session, cookies):
+        """Puts cookies returned by load() into requests session"""
+        for c in cookies:
+            session.cookies.set(c["name"], c["value"], domain=c["domain"],
+                                path=c["path"], secure=c["secure"])
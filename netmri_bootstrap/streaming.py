@@ -0,0 +1,124 @@
+"""
+Helpers to transfer large content (config lists and templates) without
+holding it in memory: decoding of API export responses as they arrive and
+multipart request bodies generated while they're sent.
+"""
+import re
+import json
+import uuid
+import codecs
+
+CHUNK_SIZE = 65536
+
+# Beginning of JSON object whose first value is a string: {"key": "
+_JSON_PREFIX = re.compile(r'\s*\{\s*"((?:[^"\\]|\\.)*)"\s*:\s*"')
+# Longest run of complete characters and escapes of JSON string. A high
+# surrogate escape is only complete together with the low one
+_JSON_STRING_PART = re.compile(r'(?:[^"\\]+|\\["\\/bfnrt]'
+                               r'|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[0-9a-fA-F]{4}'
+                               r'|\\u(?![dD][89abAB])[0-9a-fA-F]{4})*')
+# Prefix that doesn't match in this many characters is not going to match
+_MAX_PREFIX = 1024
+
+
+def iter_json_string(chunks, key="content"):
+    """
+    Yields decoded pieces of string value of key from JSON object read from
+    chunks (iterable of bytes), as soon as they arrive. Only responses that
+    start with this value are streamed; anything else, like responses with
+    other keys first, is read in full and decoded with json.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+        m = _JSON_PREFIX.match(buf)
+        if m is not None or len(buf) >= _MAX_PREFIX:
+            break
+    else:
+        m = _JSON_PREFIX.match(buf)
+
+    if m is None or json.loads(f'"{m.group(1)}"') != key:
+        buf += "".join(decoder.decode(chunk) for chunk in chunks) + decoder.decode(b"", final=True)
+        yield json.loads(buf)[key]
+        return
+
+    buf = buf[m.end():]
+    while True:
+        end = _JSON_STRING_PART.match(buf).end()
+        if end:
+            yield json.loads(f'"{buf[:end]}"')
+            buf = buf[end:]
+        if buf.startswith('"'):
+            # Rest of the object is not needed
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError(f"Response has ended inside value of {key}")
+        buf += decoder.decode(chunk)
+
+
+def iter_text(chunks):
+    """Yields text decoded from chunks (iterable of bytes)"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class MultipartBody():
+    """
+    multipart/form-data request body. Streams added by add_stream are read
+    only while the body is sent, and the whole body is never in memory.
+    Length is known in advance, so requests sends Content-Length instead of
+    chunked encoding. The body can be iterated more than once, which lets
+    the client resend it after re-authentication.
+    """
+
+    def __init__(self, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        # (part header, bytes or function that opens stream, length)
+        self._parts = []
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _part_header(self, name, filename):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        return f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode("utf8")
+
+    def add_field(self, name, value, filename=None):
+        if isinstance(value, str):
+            value = value.encode("utf8")
+        self._parts.append((self._part_header(name, filename), value, len(value)))
+
+    def add_stream(self, name, open_stream, length, filename=None):
+        """open_stream() must return iterable of bytes with length bytes in total"""
+        self._parts.append((self._part_header(name, filename), open_stream, length))
+
+    def _closing(self):
+        return f"--{self.boundary}--\r\n".encode("utf8")
+
+    def __len__(self):
+        length = len(self._closing())
+        for header, _, part_length in self._parts:
+            length += len(header) + part_length + 2
+        return length
+
+    def __iter__(self):
+        for header, value, _ in self._parts:
+            yield header
+            if isinstance(value, bytes):
+                yield value
+            else:
+                yield from value()
+            yield b"\r\n"
+        yield self._closing()
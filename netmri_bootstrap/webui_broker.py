@@ -1,6 +1,12 @@
 from dataclasses import dataclass
+import re
+import json
+import contextlib
 import requests
 import logging
+from urllib.parse import urlencode
+from netmri_bootstrap import profiling
+from netmri_bootstrap.session import SessionStore
 logger = logging.getLogger(__name__)
 
 
@@ -11,17 +17,34 @@ class WebuiBroker():
     behavior can and will change without warning. If there is any possibility
     to use API, use API instead.
     """
+    controller = None
 
-    def __init__(self, host=None, login=None, password=None, proto="https", ssl_verify=True):
+    def __init__(self, host=None, login=None, password=None, proto="https", ssl_verify=True,
+                 session_store=None, governor=None, page_size=1000):
         self.proto = proto
         self.host = host
         self.login = login
         self.password = password
+        # Number of grid rows requested at once
+        self.page_size = page_size
+        # Shared with API client of the same server (see governor.RequestGovernor)
+        self.governor = governor
 
         self.is_authenticated = False
         self.session = requests.Session()
         # Disable SSL verify because NetMRI often operates on self-signed certificates
         self.session.verify = ssl_verify
+        profiling.instrument_session(self.session)
+
+        # Session cookie saved by previous run is sent along with credentials.
+        # If the server rejects it, we retry with credentials only
+        self.session_store = session_store
+        self._using_saved_session = False
+        if session_store is not None:
+            cookies = session_store.load(self._base_url(), login, scope="webui")
+            if cookies:
+                SessionStore.restore_cookies(self.session, cookies)
+                self._using_saved_session = True
 
     def show(self, id):
         raise NotImplementedError("WebuiBroker.show must be implemented in a subclass")
@@ -39,10 +62,31 @@ class WebuiBroker():
         raise NotImplementedError("WebuiBroker.find must be implemented in a subclass")
 
     def do_request(self, url, method="get", params=None, bypass_auth=False):
+        slot = self.governor.slot() if self.governor is not None else contextlib.nullcontext()
+        with slot, self._request_span(url, method):
+            return self._do_request(url, method=method, params=params)
+
+    def _request_span(self, url, method, span=profiling.span):
+        # Ids are replaced so all requests to the same endpoint are counted together
+        endpoint = re.sub(r"/\d+", "/:id", url.split('?')[0])
+        return span(endpoint, category="webui", controller=self.controller, http_method=method)
+
+    def _do_request(self, url, method="get", params=None):
         full_url = f"{self._base_url()}{url}"
         self.session.auth = requests.auth.HTTPBasicAuth(self.login, self.password)
         res = self.session.request(method, full_url, data=params)
+        if res.status_code in (401, 403) and self._using_saved_session:
+            logger.debug(f"Saved webui session for {self.login}@{self.host} was rejected")
+            self.session_store.invalidate(self._base_url(), self.login, scope="webui")
+            self._using_saved_session = False
+            self.session.cookies.clear()
+            res = self.session.request(method, full_url, data=params)
         res.raise_for_status()
+        if not self.is_authenticated:
+            self.is_authenticated = True
+            if self.session_store is not None and not self._using_saved_session:
+                self.session_store.save(self._base_url(), self.login,
+                                        self.session.cookies, scope="webui")
         if 'application/json' in res.headers.get('content-type'):
             return res.json()
         else:
@@ -52,8 +96,13 @@ class WebuiBroker():
         return f"{self.proto}://{self.host}"
 
 
+GRID_URL = "/webui/grid_data/custom_issues_config_manage_job_manage_grid.json"
+
+
 class IssueAdhocBroker(WebuiBroker):
     controller = "IssueAdhoc"
+    # Grid columns that find can search in
+    filter_fields = ("IssueAdHocID", "IssueTypeID", "Title")
 
     def show(self, id):
         logger.debug("WARNING: CustomIssue uses undocumented API. It may stop working at some point in the future")
@@ -61,16 +110,54 @@ class IssueAdhocBroker(WebuiBroker):
         res = self.do_request(url)
         item = res['ad_hoc_issue']
         item['Details'] = res['details']
-        return IssueAdHocRemote(**item)
+        return IssueAdHocRemote.from_row(item)
 
-    def index(self):
+    def index(self, start=0, limit=None, sort=None):
+        """Returns one page of the grid, or the whole grid if limit is None.
+        sort: list of IssueAdHocRemote attributes, only the first one is used"""
         logger.debug("WARNING: CustomIssue uses undocumented API. It may stop working at some point in the future")
-        url = "/webui/grid_data/custom_issues_config_manage_job_manage_grid.json?IssueSource=C"
-        res = self.do_request(url)
-        out = []
-        for item in res['rows']:
-            out.append(IssueAdHocRemote(**item))
-        return out
+        res = self.do_request(self.grid_url(start=start, limit=limit, sort=sort))
+        return [IssueAdHocRemote.from_row(item) for item in res['rows']]
+
+    def iter_rows(self, search=None, sort=None):
+        """Yields IssueAdHocRemote for every grid row found by search
+        ((grid field, text), see grid_url), requesting page_size rows at a time"""
+        seen = set()
+        start = 0
+        while True:
+            url = self.grid_url(start=start, limit=self.page_size, sort=sort, search=search)
+            res = self.do_request(url)
+            rows = [IssueAdHocRemote.from_row(item) for item in res['rows']]
+            new_rows = [item for item in rows if item.id not in seen]
+            # Server that ignores start would send the same page forever
+            if not new_rows:
+                return
+            for item in new_rows:
+                seen.add(item.id)
+                yield item
+            start += len(rows)
+            if len(rows) < self.page_size or ('total' in res and start >= int(res['total'])):
+                return
+
+    @classmethod
+    def grid_url(cls, start=0, limit=None, sort=None, search=None):
+        """search is (grid field, text). Grid search of the web UI matches
+        rows whose field contains the text, so exact matches are picked
+        by the caller (see find)"""
+        params = {"IssueSource": "C", "start": start}
+        if limit is not None:
+            params["limit"] = limit
+        if sort:
+            params["sort"] = IssueAdHocRemote.grid_fields.get(sort[0], sort[0])
+            params["dir"] = "ASC"
+        if search is not None:
+            field, text = search
+            if field not in cls.filter_fields:
+                raise ValueError(f"Custom issues can't be searched by {field}, "
+                                 f"only by {', '.join(cls.filter_fields)}")
+            params["fields"] = json.dumps([field])
+            params["query"] = text
+        return f"{GRID_URL}?{urlencode(params)}"
 
     def create(self, data):
         url = "/webui/issues_adhoc/create"
@@ -88,12 +175,10 @@ class IssueAdhocBroker(WebuiBroker):
         self.do_request(url, params=data, method="post")
 
     def find(self, field, value):
-        url = f'/webui/grid_data/custom_issues_config_manage_job_manage_grid.json?IssueSource=C&start=0&limit=31&fields=["{field}"]&query={value}'
-        res = self.do_request(url)
-        out = []
-        for item in res['rows']:
-            out.append(IssueAdHocRemote(**item))
-        return out
+        """Returns all issues whose grid field equals value"""
+        value = str(value)
+        return [item for item in self.iter_rows(search=(field, value), sort=["id"])
+                if str(getattr(item, field, "")) == value]
 
 
 @dataclass
@@ -114,6 +199,14 @@ class IssueAdHocRemote:
     Details: str = ""
     updated_at: str = "1970-01-01 00:00:00"
 
+    # Attributes that are copies of grid fields
+    grid_fields = {"id": "IssueAdHocID", "name": "Title", "issue_id": "IssueTypeID"}
+
+    @classmethod
+    def from_row(cls, row):
+        """Grid rows may have columns this class doesn't know"""
+        return cls(**{key: value for key, value in row.items() if key in cls.__dataclass_fields__})
+
     def __post_init__(self):
         self.name = self.Title
         self.issue_id = self.IssueTypeID
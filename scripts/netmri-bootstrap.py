@@ -1,13 +1,20 @@
 #!/usr/bin/python3
+import io
+import os
 import sys
+import json
+import shlex
 import argparse
 import logging
+import contextlib
 
 from netmri_bootstrap import Bootstrapper
+from netmri_bootstrap import config
 from netmri_bootstrap import dryrun
+from netmri_bootstrap import profiling
 
 
-def initialize_logging(args):
+def initialize_logging(args, stream=sys.stdout):
     loglevel = logging.INFO
     # Every -q will increase loglevel by 10.
     # Every -v will decrease loglevel by 10.
@@ -29,18 +36,21 @@ def initialize_logging(args):
     # Remove extra info from log messages when loglevel is INFO or above
     if loglevel >= logging.INFO:
         log_format = "%(message)s"
-    logging.basicConfig(stream=sys.stdout, level=loglevel, format=log_format)
+    logging.basicConfig(stream=stream, level=loglevel, format=log_format)
 
 
-def parse_cmdline_args():
+def build_parser():
     parser = argparse.ArgumentParser(description="netmri-bootstrap")
 
     # arguments for subcommands
     subparsers = parser.add_subparsers(help="Possible subcommands",
                                        dest="command", required=True)
 
-    subparsers.add_parser("init", help="Create empty repository "
-                                       "and fill it with data from server")
+    parser_init = subparsers.add_parser("init", help="Create empty repository "
+                                        "and fill it with data from server")
+    parser_init.add_argument("--resume", help="Continue interrupted init "
+                             "without downloading objects that are already "
+                             "in the repo", action='store_true')
 
     parser_check = subparsers.add_parser("check", help="Verify that repo and "
                                          "the server are in sync")
@@ -57,18 +67,26 @@ def parse_cmdline_args():
     parser_push.add_argument("paths", type=str, help="Paths to sync",
                              nargs='*')
 
+    subparsers.add_parser("pull", help="Download objects added, changed or "
+                          "deleted on the server since last sync and commit "
+                          "them to the repo")
+
     parser_cat = subparsers.add_parser("cat", help="Show object contents in "
                                        "the repo or on server")
     parser_cat.add_argument("--api", dest="api", help="Get object content from"
                             " the server", action='store_true')
-    parser_cat.add_argument("path", type=str, help="Path to the object")
+    parser_cat.add_argument("paths", type=str, help="Path to the object",
+                            nargs='+')
 
     parser_relink = subparsers.add_parser("sync_id", help="Get id from server "
                                           "based on secondary key "
                                           "(usually name)")
     parser_relink.add_argument("--dry-run", dest="dryrun", help="Don't make "
                                "changes in the repo", action='store_true')
-    parser_relink.add_argument("path", type=str, help="Path to the object")
+    parser_relink.add_argument("--all", dest="all", help="Update ids of all "
+                               "objects in the repo", action='store_true')
+    parser_relink.add_argument("paths", type=str, help="Path to the object",
+                               nargs='*')
 
     parser_show = subparsers.add_parser("show_metadata", help="show metadata "
                                         "for the object")
@@ -76,15 +94,50 @@ def parse_cmdline_args():
 
     parser_show = subparsers.add_parser("fetch", help="Get file from server "
                                         "and store it in the repository")
-    parser_show.add_argument("path", type=str, help="Path to the object. Every"
-                             " object must be in its class subdir (e.g. all "
-                             "scripts must be in scrpts/ directory)")
+    parser_show.add_argument("paths", type=str, help="Path to the object, "
+                             "directory or glob pattern (quote it to keep "
+                             "shell from expanding it). Every object must be "
+                             "in its class subdir (e.g. all scripts must be in "
+                             "scrpts/ directory)", nargs='+')
     parser_show.add_argument("--id", type=int, help="Id. Optional for objects "
-                             "already in repo", default=None)
+                             "already in repo. Can be used only with single "
+                             "path", default=None)
     parser_show.add_argument("--overwrite", help="Allow overwriting of "
                              "existing file, if file in repo has different id",
                              action="store_true")
 
+    parser_watch = subparsers.add_parser("watch", help="Keep running and "
+                                         "push new commits to the server as "
+                                         "soon as they appear")
+    parser_watch.add_argument("--interval", type=float, help="How often to "
+                              "look for new commits, in seconds (default: 5)",
+                              default=5)
+    parser_watch.add_argument("--check-server", dest="check_server",
+                              help="Also report objects changed on the server",
+                              action='store_true')
+    parser_watch.add_argument("--server-interval", dest="server_interval",
+                              type=float, help="How often to poll the server, "
+                              "in seconds (default: 60)", default=60)
+
+    parser_receive = subparsers.add_parser("post_receive", help="Push commits "
+                                           "received by git push. Reads "
+                                           "post-receive hook input from stdin")
+    parser_receive.add_argument("--dry-run", dest="dryrun",
+                                help="Preview changes that'll be made to server",
+                                action='store_true')
+
+    subparsers.add_parser("install_hook", help="Install git post-receive hook "
+                          "that pushes received commits to the server")
+
+    parser_batch = subparsers.add_parser("batch", help="Run subcommands read "
+                                         "line by line from file or stdin, "
+                                         "sharing connection to the server")
+    parser_batch.add_argument("file", type=str, help="File with subcommands "
+                              "(default: stdin)", nargs='?', default='-')
+    parser_batch.add_argument("--keep-going", dest="keep_going",
+                              help="Run the rest of subcommands after one "
+                              "has failed", action='store_true')
+
     # Global arguments
     quiet_args = {
         "action": 'count', "default": 0,
@@ -97,42 +150,228 @@ def parse_cmdline_args():
     # Subparsers need to have their own -q and -v definitions.
     # Otherwise, netmri_bootstrap.py init -v wouldn't work while
     # netmri_bootstrap.py -v init would
+    profile_args = {
+        "action": 'store_true',
+        "help": "Print summary of where time was spent at the end of the run"}
+    trace_args = {
+        "metavar": "FILE", "type": str,
+        "help": "Save timings of all operations to FILE in Chrome trace "
+                "format (can be viewed in chrome://tracing)"}
+    target_args = {
+        "metavar": "NAME", "action": 'append',
+        "help": "Name of target server from config. push and check run on "
+                "all targets by default and accept many --target options; "
+                "other subcommands use the first target by default"}
+    parser.add_argument("--profile", dest="profile", default=False, **profile_args)
+    parser.add_argument("--trace", dest="trace", default=None, **trace_args)
+    parser.add_argument("--target", dest="target", default=None, **target_args)
     for sp in subparsers.choices.values():
         sp.add_argument("-q", dest="q_sub", **quiet_args)
         sp.add_argument("-v", dest="v_sub", **verbose_args)
-    return parser.parse_args()
+        # Values of options given after subcommand mustn't be overwritten
+        # by defaults of the main parser
+        sp.add_argument("--profile", dest="profile", default=argparse.SUPPRESS, **profile_args)
+        sp.add_argument("--trace", dest="trace", default=argparse.SUPPRESS, **trace_args)
+        sp.add_argument("--target", dest="target", default=argparse.SUPPRESS, **target_args)
+    return parser
 
 
-if __name__ == "__main__":
-    args = parse_cmdline_args()
-    initialize_logging(args)
+# Subcommands that run on all targets at once
+FAN_OUT_COMMANDS = ("push", "check", "post_receive")
 
-    if args.command == "init":
-        bs = Bootstrapper.init_empty_repo()
-        bs.export_from_netmri()
-    elif args.command == "push":
+
+def parse_cmdline_args():
+    return build_parser().parse_args()
+
+
+def run_command(bs, args):
+    """Runs subcommand (other than init, watch and batch) using existing Bootstrapper"""
+    if args.command == "push":
         dryrun.set_dryrun(args.dryrun)
-        bs = Bootstrapper()
         if len(args.paths) == 0:
-            bs.update_netmri(retry_errors=args.retry_errors)
+            return bs.update_netmri(retry_errors=args.retry_errors)
         else:
-            bs.force_push(args.paths)
+            return bs.force_push(args.paths)
     elif args.command == "check":
-        bs = Bootstrapper()
-        bs.check_netmri(local_only=args.brief)
+        return bs.check_netmri(local_only=args.brief)
+    elif args.command == "pull":
+        return bs.pull()
     elif args.command == "cat":
-        bs = Bootstrapper()
-        bs.cat_file(args.path, from_api=args.api)
+        for path in args.paths:
+            bs.cat_file(path, from_api=args.api)
     elif args.command == "show_metadata":
-        bs = Bootstrapper()
         bs.show_metadata(args.path)
     elif args.command == "sync_id":
         dryrun.set_dryrun(args.dryrun)
-        bs = Bootstrapper()
-        bs.relink(args.path)
+        if args.all and args.paths:
+            raise ValueError("Either --all or paths must be given, not both")
+        if args.all:
+            return bs.relink_many()
+        elif len(args.paths) > 1:
+            # One index request per class is cheaper than a find per object
+            return bs.relink_many(args.paths)
+        elif len(args.paths) == 1:
+            bs.relink(args.paths[0])
+        else:
+            raise ValueError("Either --all or paths must be given")
+    elif args.command == "post_receive":
+        dryrun.set_dryrun(args.dryrun)
+        watched_ref = f"refs/heads/{bs.repo.branch}"
+        for line in sys.stdin:
+            old_sha, new_sha, ref = line.split()
+            if ref == watched_ref:
+                bs.push_received(old_sha, new_sha)
+    elif args.command == "install_hook":
+        command = " ".join(shlex.quote(arg) for arg in
+                           [sys.executable, os.path.abspath(sys.argv[0])])
+        bs.install_hook(command)
     elif args.command == "fetch":
+        if args.id is not None:
+            if len(args.paths) > 1:
+                raise ValueError("--id can be used only with single path")
+            bs.fetch(args.paths[0], id=args.id, overwrite=args.overwrite)
+        else:
+            bs.fetch_many(args.paths)
+    else:
+        raise ValueError(f"Subcommand {args.command} cannot be used here")
+
+
+def get_targets(args):
+    """Returns names of targets the subcommand runs on"""
+    if args.target:
+        return args.target
+    if args.command in FAN_OUT_COMMANDS:
+        return [target.name for target in config.get_config().get_targets()]
+    return [config.get_target().name]
+
+
+def run_on_targets(args, targets):
+    """Runs push, check or post_receive on many targets at once"""
+    if args.command == "push":
+        dryrun.set_dryrun(args.dryrun)
+        if len(args.paths) == 0:
+            return Bootstrapper.push_to_targets(targets, retry_errors=args.retry_errors)
+        results = Bootstrapper.run_on_targets(lambda bs: bs.force_push(args.paths), targets)
+    elif args.command == "check":
+        return Bootstrapper.check_targets(targets, local_only=args.brief)
+    elif args.command == "post_receive":
+        dryrun.set_dryrun(args.dryrun)
+        watched_ref = f"refs/heads/{config.get_config().bootstrap_branch}"
+        results = []
+        for line in sys.stdin:
+            old_sha, new_sha, ref = line.split()
+            if ref == watched_ref:
+                results += Bootstrapper.run_on_targets(
+                    lambda bs: bs.push_received(old_sha, new_sha), targets)
+    else:
+        raise ValueError(f"Subcommand {args.command} cannot be used with many targets")
+    failed = [target.name for target, _, error in results if error is not None]
+    for target, _, error in results:
+        if error is not None:
+            logging.getLogger(__name__).error(f"{args.command} has failed for {target.name}: {error}")
+    if failed:
+        raise ValueError(f"{args.command} has failed for {', '.join(failed)}")
+
+
+def run_batch(parser, batch_file, keep_going=False):
+    """
+    Runs subcommands from batch_file in single Bootstrapper, so API client,
+    brokers and git notes index are shared between them. Result of each
+    subcommand is printed as a line of JSON. Stops at the first failed
+    subcommand unless keep_going is set. Returns True if all have succeeded
+    """
+    bs = Bootstrapper()
+    all_ok = True
+    if batch_file == '-':
+        fh = sys.stdin
+    else:
+        fh = open(batch_file, 'r')
+    with fh:
+        for line_no, line in enumerate(fh, start=1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            result = {"line": line_no, "command": line}
+            output = io.StringIO()
+            errors = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(errors):
+                    args = parser.parse_args(shlex.split(line))
+                    if args.command in ("init", "batch", "watch", "post_receive"):
+                        raise ValueError(f"{args.command} cannot be used in batch mode")
+                    if args.target:
+                        raise ValueError("--target must be given to batch itself")
+                    rv = run_command(bs, args)
+                result["status"] = "ok"
+                if rv is not None:
+                    result["result"] = rv
+            except SystemExit:
+                # argparse exits on invalid arguments
+                result["status"] = "error"
+                result["error"] = errors.getvalue().strip() or "invalid arguments"
+            except Exception as e:
+                logging.getLogger(__name__).debug("batch command failed", exc_info=True)
+                result["status"] = "error"
+                result["error"] = str(e)
+            finally:
+                dryrun.set_dryrun(False)
+            result["output"] = output.getvalue()
+            print(json.dumps(result), flush=True)
+            if result["status"] != "ok":
+                all_ok = False
+                if not keep_going:
+                    break
+    return all_ok
+
+
+def main(parser, args):
+    targets = get_targets(args)
+    if len(targets) > 1:
+        if args.command not in FAN_OUT_COMMANDS:
+            raise ValueError(f"{args.command} can be used with a single --target only")
+        initialize_logging(args)
+        return run_on_targets(args, targets)
+    with config.use_target(targets[0]):
+        return run_single_target(parser, args)
+
+
+def run_single_target(parser, args):
+    if args.command == "init":
+        initialize_logging(args)
+        if args.resume:
+            bs = Bootstrapper()
+        else:
+            bs = Bootstrapper.init_empty_repo()
+        bs.export_from_netmri(resume=args.resume)
+    elif args.command == "watch":
+        initialize_logging(args)
         bs = Bootstrapper()
-        bs.fetch(args.path, id=args.id, overwrite=args.overwrite)
+        try:
+            bs.watch(interval=args.interval, check_server=args.check_server,
+                     server_interval=args.server_interval)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "batch":
+        # Keep stdout for results of subcommands
+        initialize_logging(args, stream=sys.stderr)
+        if not run_batch(parser, args.file, keep_going=args.keep_going):
+            sys.exit(1)
     else:
-        # We don't expect to get here because of argparse
-        pass
+        initialize_logging(args)
+        bs = Bootstrapper()
+        run_command(bs, args)
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.profile or args.trace:
+        profiling.enable()
+    try:
+        main(parser, args)
+    finally:
+        tracer = profiling.get_tracer()
+        if tracer is not None:
+            if args.trace:
+                tracer.save(args.trace)
+            print(tracer.summary(), file=sys.stderr)
@@ -27,7 +27,7 @@ setup(
     author="Ingmar Van Glabbeek",
     author_email='ingmar@infoblox.com',
     url='https://github.com/infobloxopen/netmri-bootstrap',
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks"]),
     scripts=['scripts/netmri-bootstrap.py'],
     package_dir={'netmri_bootstrap':
                  'netmri_bootstrap'},
@@ -36,6 +36,9 @@ setup(
         'netmri_bootstrap': ['config.json.in']
     },
     install_requires=requirements,
+    extras_require={
+        'async': ['aiohttp>=3.7'],
+    },
     license="Apache",
     zip_safe=False,
     keywords='netmri-bootstrap',
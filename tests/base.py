@@ -0,0 +1,58 @@
+import os
+import unittest
+from netmri_bootstrap import config, Bootstrapper
+from netmri_bootstrap.objects import git
+from tests.fake_netmri import FakeNetMRI, generate_catalog, USERNAME, PASSWORD
+
+BASE_PATH = "/tmp/netmri_bootstrap"
+CLASS_PATHS = {"Script": "scripts", "ScriptModule": "script_modules",
+               "ConfigList": "lists", "ConfigTemplate": "config_templates",
+               "PolicyRule": "policy/rules", "Policy": "policy",
+               "CustomIssue": "custom_issues"}
+
+
+class FakeNetMRITestCase(unittest.TestCase):
+    """Starts fake server with catalog made of catalog_args and points
+    config to it. Repo is made in repo_path by init_repo()"""
+    repo_path = None
+    catalog_args = {}
+    class_paths = CLASS_PATHS
+
+    def setUp(self):
+        os.makedirs(BASE_PATH, exist_ok=True)
+        self.server = FakeNetMRI(generate_catalog(**self.catalog_args), seed=0).start()
+        config._config = config.BootstrapperConfig(
+            host=self.server.host, port=self.server.port, proto="http",
+            username=USERNAME, password=PASSWORD, scripts_root=self.repo_path,
+            bootstrap_branch="master", skip_readonly_objects=True,
+            class_paths=dict(self.class_paths))
+        config._client = None
+
+    def tearDown(self):
+        self.server.stop()
+        config._config = None
+        config._client = None
+        os.system(f"rm -rf {self.repo_path}")
+
+    def init_repo(self):
+        """Runs init against the server, returns its Bootstrapper"""
+        bs = Bootstrapper.init_empty_repo()
+        bs.export_from_netmri()
+        return bs
+
+    def reopen(self):
+        """Returns Bootstrapper of a new run on the same repo"""
+        return Bootstrapper(repo=git.Repo(self.repo_path, "master"))
+
+    @staticmethod
+    def get_paths(repo, prefix, suffix=""):
+        return sorted(blob.path for blob in repo.get_blobs()
+                      if blob.path.startswith(prefix) and blob.path.endswith(suffix))
+
+    def edit_files(self, repo, paths, text="print('edited')\n"):
+        """Appends text to every file and commits them"""
+        for path in paths:
+            with open(f"{self.repo_path}/{path}", "a") as fh:
+                fh.write(text)
+        repo.stage_files(paths)
+        repo.commit(message="Edited by unittest")
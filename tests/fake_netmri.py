@@ -0,0 +1,664 @@
+"""
+Self-contained stand-in for NetMRI server, for end-to-end and load tests.
+
+It implements the parts of /api/3.1 and /webui that netmri-bootstrap uses,
+holds a synthetic catalog of objects of configurable size, and can add
+latency, jitter and errors to any endpoint. Run it with
+
+    python -m tests.fake_netmri --port 8080 --scripts 2000 --latency 0.05
+
+and point netmri-bootstrap to it with "proto": "http", "host": "127.0.0.1"
+and "port": 8080 in config.json.
+"""
+import re
+import sys
+import json
+import base64
+import time
+import random
+import fnmatch
+import argparse
+import threading
+import email.parser
+import email.policy
+from dataclasses import dataclass
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USERNAME = "admin"
+PASSWORD = "admin"
+SESSION_COOKIE = "netmri_session"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# NetMRI returns 1000 records per page unless asked otherwise
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+RULE_LOGIC = ("<PolicyRuleLogic editor='basic-file' xmlns='http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml'>"
+              "<If><Expr op='and'><ConfigFileCheck op='contains-some'>{pattern}</ConfigFileCheck></Expr>"
+              "<Then><PolicyRulePass/></Then><Else><PolicyRuleFail/></Else></If></PolicyRuleLogic>")
+
+# API controller -> name of the object in responses
+CONTROLLERS = {
+    "scripts": "script",
+    "script_modules": "script_module",
+    "config_lists": "config_list",
+    "config_templates": "config_template",
+    "policy_rules": "policy_rule",
+    "policies": "policy",
+}
+CLASS_NAMES = {
+    "scripts": "Script",
+    "script_modules": "ScriptModule",
+    "config_lists": "ConfigList",
+    "config_templates": "ConfigTemplate",
+    "policy_rules": "PolicyRule",
+    "policies": "Policy",
+}
+ISSUE_FIELDS = ("IssueAdHocID", "IssueTypeID", "Title", "Description",
+                "Component", "Correctness", "Stability", "Module",
+                "IssueSource", "Visible")
+
+
+def _now():
+    return time.strftime(DATE_FORMAT)
+
+
+class FakeApiError(Exception):
+    def __init__(self, status, message):
+        super(FakeApiError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Catalog():
+    """Objects stored on fake server. Records are dicts that look like
+    API responses; exported content is kept separately"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.records = {controller: {} for controller in CONTROLLERS}
+        self.contents = {controller: {} for controller in CONTROLLERS}
+        # policy id -> list of policy rule ids
+        self.policy_rules = {}
+        # IssueAdHocID -> row of custom issues grid
+        self.issues = {}
+        self.issue_details = {}
+        self._next_id = 1
+
+    def next_id(self):
+        with self.lock:
+            res = self._next_id
+            self._next_id += 1
+            return res
+
+    def add(self, controller, record, content=None):
+        with self.lock:
+            record.setdefault("id", self.next_id())
+            record.setdefault("created_at", _now())
+            record.setdefault("updated_at", record["created_at"])
+            record["_class"] = CLASS_NAMES[controller]
+            self.records[controller][record["id"]] = record
+            if content is not None:
+                self.contents[controller][record["id"]] = content
+            return record
+
+    def get(self, controller, id):
+        try:
+            return self.records[controller][int(id)]
+        except (KeyError, TypeError, ValueError):
+            raise FakeApiError(404, f"{CLASS_NAMES[controller]} with id {id} not found")
+
+    def update(self, controller, id, values, content=None):
+        with self.lock:
+            record = self.get(controller, id)
+            for key, value in values.items():
+                if key in record and key not in ("id", "_class"):
+                    record[key] = value
+            record["updated_at"] = _now()
+            if content is not None:
+                self.contents[controller][record["id"]] = content
+            return record
+
+    def destroy(self, controller, id):
+        with self.lock:
+            record = self.get(controller, id)
+            del self.records[controller][record["id"]]
+            self.contents[controller].pop(record["id"], None)
+            self.policy_rules.pop(record["id"], None)
+
+    def find_by(self, controller, field, value):
+        for record in list(self.records[controller].values()):
+            if str(record.get(field)) == str(value):
+                return record
+        return None
+
+    def add_issue(self, row, details=""):
+        with self.lock:
+            row = {field: row.get(field, "") for field in ISSUE_FIELDS}
+            if not row["IssueAdHocID"]:
+                row["IssueAdHocID"] = self.next_id()
+            row["IssueAdHocID"] = int(row["IssueAdHocID"])
+            row["IssueSource"] = "C"
+            self.issues[row["IssueAdHocID"]] = row
+            self.issue_details[row["IssueAdHocID"]] = details
+            return row
+
+    def size(self):
+        return sum(len(records) for records in self.records.values()) + len(self.issues)
+
+
+def generate_catalog(scripts=10, script_modules=5, config_lists=5, config_list_rows=20,
+                     config_templates=5, policy_rules=10, policies=3, rules_per_policy=3,
+                     custom_issues=3, read_only_fraction=0.0, seed=0):
+    """Creates catalog of synthetic objects. The same seed produces the same catalog"""
+    rnd = random.Random(seed)
+    catalog = Catalog()
+    languages = ["Python", "Perl", "CCS"]
+    for i in range(scripts):
+        language = languages[i % len(languages)]
+        name = f"script {i}"
+        record = {"name": name, "description": f"Synthetic script number {i}",
+                  "language": language, "risk_level": rnd.randint(1, 3),
+                  "category": f"category{i % 5}", "module": "CCS", "visible": True,
+                  "read_only": rnd.random() < read_only_fraction,
+                  "created_by": "admin", "updated_by": "admin"}
+        catalog.add("scripts", record, content=_script_export(record, rnd))
+
+    for i in range(script_modules):
+        language = ["Python", "Perl"][i % 2]
+        record = {"name": f"module_{i}", "category": "None", "language": language,
+                  "description": f"Synthetic module number {i}",
+                  "created_by": "admin", "updated_by": "admin"}
+        source = "\n".join(f"# line {n} of module {i}" for n in range(rnd.randint(5, 50)))
+        catalog.add("script_modules", record, content=source)
+
+    for i in range(config_lists):
+        record = {"name": f"list {i}", "description": f"Synthetic list number {i}",
+                  "auth_user_id": None}
+        rows = "\n".join(f'"{n}","value {rnd.randint(0, 10 ** 6)}"' for n in range(config_list_rows))
+        content = _config_list_export(record, '"DeviceID","Text"\n' + rows)
+        catalog.add("config_lists", record, content=content)
+
+    for i in range(config_templates):
+        record = {"name": f"template {i}", "description": f"Synthetic template number {i}",
+                  "device_type": "Router", "model": "", "vendor": "Cisco", "version": "",
+                  "risk_level": 1, "template_type": "Device",
+                  "template_text": f"hostname $name\ninterface Loopback{i}\n",
+                  "created_by": "admin", "updated_by": "admin"}
+        catalog.add("config_templates", record)
+
+    rule_ids = []
+    for i in range(policy_rules):
+        record = {"name": f"rule {i}", "short_name": f"rule_{i}", "author": "admin",
+                  "description": f"Synthetic rule number {i}", "remediation": "None",
+                  "severity": ["info", "warning", "error"][i % 3], "set_filter": None,
+                  "rule_logic": RULE_LOGIC.format(pattern=f"pattern {i}"),
+                  "action_after_exec": None,
+                  "read_only": rnd.random() < read_only_fraction}
+        rule_ids.append(catalog.add("policy_rules", record)["id"])
+
+    for i in range(policies):
+        record = {"name": f"policy {i}", "short_name": f"policy_{i}", "author": "admin",
+                  "description": f"Synthetic policy number {i}", "schedule_mode": "change",
+                  "set_filter": None, "read_only": rnd.random() < read_only_fraction}
+        policy = catalog.add("policies", record)
+        count = min(rules_per_policy, len(rule_ids))
+        catalog.policy_rules[policy["id"]] = rnd.sample(rule_ids, count)
+
+    for i in range(custom_issues):
+        row = {"IssueTypeID": f"CustomIssue{i}", "Title": f"custom issue {i}",
+               "Description": f"Synthetic issue number {i}", "Component": "Device",
+               "Correctness": "on", "Stability": "off", "Module": "", "Visible": "1"}
+        catalog.add_issue(row, details="Device,string\nReason,string")
+    return catalog
+
+
+def _script_export(record, rnd=random):
+    header = [f"## Script-Level: {record['risk_level']}",
+              f"## Script-Category: {record['category']}",
+              f"## Script-Language: {record['language']}"]
+    if record["language"] == "CCS":
+        body = [f"Script: {record['name']}", f"Script-Description: {record['description']}",
+                "Script-Filter:", "\ttrue", "", "Action:", "\tShow version", "",
+                "Action-Commands:", "\tshow version"]
+    else:
+        body = ["# BEGIN-SCRIPT-BLOCK", f"# Script: {record['name']}",
+                f"# Script-Description: {record['description']}",
+                "# Script-Filter:", "#   true", "# END-SCRIPT-BLOCK"]
+        body += [f"x{n} = {rnd.randint(0, 1000)}" for n in range(rnd.randint(5, 50))]
+    return "\n".join(header + body) + "\n"
+
+
+def _config_list_export(record, rows):
+    return (f"###################################\n# Name:        {record['name']}\n"
+            f"# Description: {record['description']}\n###################################\n\n"
+            f"{rows}")
+
+
+def _config_template_export(record):
+    lines = [f"## Export of Template: {record['name']}",
+             f"## Template-Level: {record['risk_level']}",
+             f"## Template-Vendor: {record['vendor']}",
+             f"## Template-Device Type: {record['device_type']}",
+             f"## Template-Model: {record['model']}",
+             f"## Template-Version: {record['version']}"]
+    for line in (record["description"] or "").splitlines():
+        lines.append(f"## Template-Description: {line}")
+    return "\n".join(lines) + "\n" + (record["template_text"] or "")
+
+
+def _parse_script_file(content):
+    """Extracts metadata from script file like NetMRI does on import"""
+    metadata = {}
+    regex = re.compile(r'^#*\s*Script-?(Description|Level|Category|Language)?:\s+(.*)$')
+    for line in content.splitlines():
+        m = regex.match(line)
+        if m:
+            key = (m.group(1) or "name").lower()
+            metadata.setdefault(key, m.group(2))
+    res = {}
+    for key, attr in (("name", "name"), ("description", "description"),
+                      ("level", "risk_level"), ("category", "category"),
+                      ("language", "language")):
+        if key in metadata:
+            res[attr] = metadata[key]
+    return res
+
+
+@dataclass
+class Fault:
+    """Latency and failures to inject into matching endpoints"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+
+
+class FakeNetMRI():
+    """Runs fake server in a background thread:
+
+        server = FakeNetMRI(generate_catalog(scripts=1000))
+        server.set_fault("scripts/export_file", latency=0.1, error_rate=0.01)
+        server.start()
+        ...
+        server.stop()
+    """
+
+    def __init__(self, catalog=None, host="127.0.0.1", port=0, seed=None):
+        self.catalog = catalog if catalog is not None else Catalog()
+        self.default_fault = Fault()
+        # glob pattern of endpoint (e.g. "scripts/*" or "webui/*") -> Fault
+        self.faults = {}
+        self.random = random.Random(seed)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self.sessions = set()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def set_fault(self, pattern="*", **kwargs):
+        if pattern == "*":
+            self.default_fault = Fault(**kwargs)
+        else:
+            self.faults[pattern] = Fault(**kwargs)
+
+    def get_fault(self, endpoint):
+        for pattern, fault in self.faults.items():
+            if fnmatch.fnmatch(endpoint, pattern):
+                return fault
+        return self.default_fault
+
+    def count(self, endpoint, status):
+        with self._stats_lock:
+            stat = self.stats.setdefault(endpoint, {"requests": 0, "errors": 0})
+            stat["requests"] += 1
+            if status >= 400:
+                stat["errors"] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    @property
+    def catalog(self):
+        return self.server.fake.catalog
+
+    def do_GET(self):
+        self._dispatch("get")
+
+    def do_POST(self):
+        self._dispatch("post")
+
+    def do_DELETE(self):
+        self._dispatch("delete")
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length) if length else b""
+        endpoint = self._endpoint(url.path)
+        status = 500
+        try:
+            fault = self.fake.get_fault(endpoint)
+            delay = fault.latency + self.fake.random.uniform(-fault.jitter, fault.jitter)
+            if delay > 0:
+                time.sleep(delay)
+            if fault.error_rate and self.fake.random.random() < fault.error_rate:
+                raise FakeApiError(fault.error_status, f"Injected failure of {endpoint}")
+            status, payload, headers = self._route(url, body)
+        except FakeApiError as e:
+            status, payload, headers = e.status, {"message": e.message}, {}
+        except Exception as e:
+            status, payload, headers = 500, {"message": f"{e.__class__.__name__}: {e}"}, {}
+        self.fake.count(endpoint, status)
+        self._respond(status, payload, headers)
+
+    @staticmethod
+    def _endpoint(path):
+        parts = path.strip('/').split('/')
+        if parts[0] == "api" and len(parts) >= 4:
+            return f"{parts[2]}/{parts[3]}"
+        if parts[0] == "webui" and len(parts) >= 2:
+            return f"webui/{parts[1]}"
+        return path.strip('/')
+
+    def _respond(self, status, payload, headers):
+        data = json.dumps(payload).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self, url, body):
+        parts = url.path.strip('/').split('/')
+        if url.path == "/api/authenticate":
+            return self._authenticate(body)
+        if url.path == "/api/server_info":
+            return 200, {"latest_api_version": "3.1"}, {}
+        if parts[0] == "api":
+            self._check_session()
+            if len(parts) != 4 or parts[2] not in CONTROLLERS:
+                raise FakeApiError(404, f"Unknown endpoint {url.path}")
+            params = self._parse_params(body)
+            handler = getattr(self, f"_api_{parts[3]}", None)
+            if handler is None:
+                raise FakeApiError(404, f"Unknown method {parts[3]}")
+            return 200, handler(parts[2], params), {}
+        if parts[0] == "webui":
+            self._check_basic_auth()
+            return 200, self._webui(url, body), {}
+        raise FakeApiError(404, f"Unknown endpoint {url.path}")
+
+    def _authenticate(self, body):
+        params = json.loads(body or b"{}")
+        if params.get("username") != USERNAME or params.get("password") != PASSWORD:
+            raise FakeApiError(401, "Invalid credentials")
+        session_id = f"{self.fake.random.getrandbits(64):016x}"
+        self.fake.sessions.add(session_id)
+        return 200, {}, {"Set-Cookie": f"{SESSION_COOKIE}={session_id}; Path=/"}
+
+    def _check_session(self):
+        for cookie in self.headers.get("Cookie", "").split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == SESSION_COOKIE and value in self.fake.sessions:
+                return
+        raise FakeApiError(403, "Not authenticated")
+
+    def _check_basic_auth(self):
+        auth = self.headers.get("Authorization", "")
+        expected = base64.b64encode(f"{USERNAME}:{PASSWORD}".encode()).decode()
+        if auth != f"Basic {expected}":
+            raise FakeApiError(401, "Not authenticated")
+
+    def _parse_params(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            params = {}
+            for part in message.iter_parts():
+                params[part.get_param("name", header="content-disposition")] = \
+                    part.get_payload(decode=True).decode("utf8")
+            return params
+        if not body:
+            return {}
+        return json.loads(body)
+
+    # API methods. Each one gets controller name and request parameters
+    def _api_index(self, controller, params):
+        records = sorted(self.catalog.records[controller].values(), key=lambda r: r["id"])
+        start = int(params.get("start", 0))
+        limit = min(int(params.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = records[start:start + limit]
+        return {controller: page, "current": len(page), "start": start,
+                "limit": limit, "total": len(records)}
+
+    def _api_find(self, controller, params):
+        records = list(self.catalog.records[controller].values())
+        for key, op in params.items():
+            if not key.startswith("op_"):
+                continue
+            field = key[3:]
+            value = params.get(f"val_c_{field}")
+            if op != "=":
+                raise FakeApiError(400, f"Operator {op} is not supported by fake server")
+            records = [r for r in records if str(r.get(field)) == str(value)]
+        records.sort(key=lambda r: r["id"])
+        return {controller: records, "current": len(records), "start": 0,
+                "limit": len(records), "total": len(records)}
+
+    def _api_show(self, controller, params):
+        return {CONTROLLERS[controller]: self.catalog.get(controller, params.get("id"))}
+
+    def _api_destroy(self, controller, params):
+        self.catalog.destroy(controller, params.get("id"))
+        return {"success": True, "message": "Destroyed"}
+
+    def _api_export_file(self, controller, params):
+        record = self.catalog.get(controller, params.get("id"))
+        return {"content": self.catalog.contents[controller].get(record["id"], "")}
+
+    def _api_export(self, controller, params):
+        record = self.catalog.get(controller, params.get("id"))
+        if controller == "config_templates":
+            return {"content": _config_template_export(record)}
+        return {"content": self.catalog.contents[controller].get(record["id"], "")}
+
+    def _api_create(self, controller, params):
+        return self._save(controller, None, params)
+
+    def _api_update(self, controller, params):
+        return self._save(controller, params.get("id"), params)
+
+    def _save(self, controller, id, params):
+        name = CONTROLLERS[controller]
+        content = None
+        values = dict(params)
+        if controller == "scripts":
+            content = values.pop("script_file", "")
+            values.update(_parse_script_file(content))
+            values.setdefault("name", values.pop("script_name", None))
+        elif controller == "script_modules":
+            content = values.pop("script_source", "")
+        if isinstance(values.get("read_only"), str):
+            # NetMRI parses boolean parameters
+            values["read_only"] = values["read_only"].lower() in ("true", "1", "yes", "on")
+        if id is None:
+            key = "short_name" if controller in ("policies", "policy_rules") else "name"
+            if values.get(key) and self.catalog.find_by(controller, key, values[key]):
+                raise FakeApiError(400, f"{CLASS_NAMES[controller]} {values[key]} already exists")
+            values.pop("id", None)
+            record = self.catalog.add(controller, values, content=content)
+        else:
+            record = self.catalog.update(controller, id, values, content=content)
+        if controller == "scripts":
+            return {name: record}
+        return {"success": True, "id": record["id"], name: record}
+
+    def _api_import(self, controller, params):
+        if controller != "config_lists":
+            raise FakeApiError(404, "Unknown method import")
+        content = params.get("file", "")
+        m = re.search(r'^#*\s*Name:\s+(.*)$', content, re.MULTILINE)
+        if m is None:
+            return {"success": False, "message": "Cannot find list name in the file"}
+        name = m.group(1).strip()
+        m = re.search(r'^#*\s*Description:\s+(.*)$', content, re.MULTILINE)
+        values = {"name": name, "description": m.group(1).strip() if m else ""}
+        record = self.catalog.find_by(controller, "name", name)
+        if record is None:
+            values["auth_user_id"] = None
+            record = self.catalog.add(controller, values, content=content)
+        else:
+            self.catalog.update(controller, record["id"], values, content=content)
+        return {"success": True, "id": record["id"], "message": "Imported"}
+
+    def _api_policy_rules(self, controller, params):
+        policy = self.catalog.get("policies", params.get("id"))
+        rules = []
+        for rule_id in self.catalog.policy_rules.get(policy["id"], []):
+            rule = dict(self.catalog.get("policy_rules", rule_id))
+            rule["policy_id"] = policy["id"]
+            rule["policy_rule_id"] = rule_id
+            rules.append(rule)
+        return {"policy_rules": rules}
+
+    def _api_add_policy_rules(self, controller, params):
+        policy = self.catalog.get("policies", params.get("id"))
+        rule = self.catalog.get("policy_rules", params.get("policy_rule_id"))
+        with self.catalog.lock:
+            rules = self.catalog.policy_rules.setdefault(policy["id"], [])
+            if rule["id"] not in rules:
+                rules.append(rule["id"])
+        return {"success": True, "message": "Added"}
+
+    def _api_remove_policy_rules(self, controller, params):
+        policy = self.catalog.get("policies", params.get("id"))
+        with self.catalog.lock:
+            rules = self.catalog.policy_rules.setdefault(policy["id"], [])
+            if int(params.get("policy_rule_id")) in rules:
+                rules.remove(int(params.get("policy_rule_id")))
+        return {"success": True, "message": "Removed"}
+
+    # Custom issues
+    def _webui(self, url, body):
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        form = {k: v[0] for k, v in parse_qs(body.decode("utf8")).items()}
+        if url.path == "/webui/grid_data/custom_issues_config_manage_job_manage_grid.json":
+            return self._issues_grid(query)
+        m = re.match(r"^/webui/issues_adhoc/(\d+)\.json$", url.path)
+        if m:
+            issue_id = int(m.group(1))
+            if issue_id not in self.catalog.issues:
+                raise FakeApiError(404, f"Custom issue {issue_id} not found")
+            return {"ad_hoc_issue": dict(self.catalog.issues[issue_id]),
+                    "details": self.catalog.issue_details[issue_id]}
+        if url.path in ("/webui/issues_adhoc/create", "/webui/issues_adhoc/update"):
+            issue_id = form.get("IssueAdHocID")
+            if issue_id and int(issue_id) not in self.catalog.issues:
+                raise FakeApiError(404, f"Custom issue {issue_id} not found")
+            row = self.catalog.add_issue(form, details=form.get("Details", ""))
+            return {"success": True, "id": row["IssueAdHocID"]}
+        if url.path == "/webui/issues_adhoc/delete":
+            issue_id = int(form.get("IssueAdHocID", 0))
+            with self.catalog.lock:
+                row = self.catalog.issues.get(issue_id)
+                if row is None or row["IssueTypeID"] != form.get("IssueTypeID"):
+                    raise FakeApiError(404, f"Custom issue {issue_id} not found")
+                del self.catalog.issues[issue_id]
+            return {"success": True}
+        raise FakeApiError(404, f"Unknown endpoint {url.path}")
+
+    def _issues_grid(self, query):
+        rows = sorted(self.catalog.issues.values(), key=lambda r: r["IssueAdHocID"])
+        if "query" in query and "fields" in query:
+            fields = json.loads(query["fields"])
+            value = query["query"].lower()
+            rows = [r for r in rows if any(value in str(r.get(f, "")).lower() for f in fields)]
+        total = len(rows)
+        start = int(query.get("start", 0))
+        if "limit" in query:
+            rows = rows[start:start + int(query["limit"])]
+        else:
+            rows = rows[start:]
+        return {"rows": [dict(r) for r in rows], "total": total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake NetMRI server for testing netmri-bootstrap")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, default in (("scripts", 100), ("script-modules", 20), ("config-lists", 20),
+                          ("config-list-rows", 100), ("config-templates", 20),
+                          ("policy-rules", 100), ("policies", 10), ("rules-per-policy", 10),
+                          ("custom-issues", 10)):
+        parser.add_argument(f"--{name}", type=int, default=default,
+                            help=f"default: {default}")
+    parser.add_argument("--read-only-fraction", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--fault", action="append", default=[], metavar="PATTERN=LATENCY[,JITTER[,ERROR_RATE]]",
+                        help="Per-endpoint fault, e.g. 'scripts/export_file=0.2,0.05,0.01'")
+    args = parser.parse_args()
+
+    catalog = generate_catalog(
+        scripts=args.scripts, script_modules=args.script_modules,
+        config_lists=args.config_lists, config_list_rows=args.config_list_rows,
+        config_templates=args.config_templates, policy_rules=args.policy_rules,
+        policies=args.policies, rules_per_policy=args.rules_per_policy,
+        custom_issues=args.custom_issues, read_only_fraction=args.read_only_fraction,
+        seed=args.seed)
+    server = FakeNetMRI(catalog, host=args.host, port=args.port, seed=args.seed)
+    server.set_fault(latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, error_status=args.error_status)
+    for fault in args.fault:
+        pattern, _, values = fault.partition('=')
+        values = [float(v) for v in values.split(',')]
+        server.set_fault(pattern, **dict(zip(("latency", "jitter", "error_rate"), values)),
+                         error_status=args.error_status)
+    print(f"Fake NetMRI with {catalog.size()} objects is listening on "
+          f"http://{server.host}:{server.port} (user {USERNAME}, password {PASSWORD})",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
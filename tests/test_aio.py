@@ -0,0 +1,57 @@
+import os
+import unittest
+from netmri_bootstrap import aio, config, profiling
+from netmri_bootstrap.objects import api, git
+from tests.base import FakeNetMRITestCase, BASE_PATH
+
+
+@unittest.skipUnless(aio.is_available(), "aiohttp is not installed")
+class TestAsyncTransfers(FakeNetMRITestCase):
+    """Downloads content of every class through the event loop"""
+    repo_path = f"{BASE_PATH}/aio_repo"
+    catalog_args = {"scripts": 6}
+
+    def setUp(self):
+        super(TestAsyncTransfers, self).setUp()
+        self.bs = self.init_repo()
+        self.objs = [api.ApiObject.from_blob(blob) for blob in self.bs.repo.get_blobs()]
+
+    def tearDown(self):
+        profiling.disable()
+        config._session_store = None
+        os.system(f"rm -rf {BASE_PATH}/sessions")
+        super(TestAsyncTransfers, self).tearDown()
+
+    def test_load_contents(self):
+        self.assertEqual({obj.__class__.__name__ for obj in self.objs}, set(config.get_config().class_paths))
+        for obj, error in aio.load_contents(self.objs, limit=8):
+            self.assertIsNone(error)
+            expected = api.ApiObject.from_blob(git.Blob.from_path(self.bs.repo, obj.path))
+            expected.load_content_from_api()
+            self.assertEqual("".join(obj.export_to_repo()), "".join(expected.export_to_repo()))
+
+    def test_shared_session_and_governor(self):
+        # Downloads reuse session saved by the synchronous client, take
+        # governor slots and are recorded as spans
+        config._config.session_cache = True
+        config._config.session_cache_dir = f"{BASE_PATH}/sessions"
+        config._client = config._session_store = None
+        config.get_api_client().api_request("scripts/index", {})
+        logins = self.server.stats["api/authenticate"]["requests"]
+        tracer = profiling.enable()
+        self.assertTrue(all(error is None for _, error in aio.load_contents(self.objs, limit=8)))
+        self.assertEqual(self.server.stats["api/authenticate"]["requests"], logins)
+        self.assertEqual(tracer.stats[("api", "scripts/export_file")][0],
+                         len(self.bs.repo.object_index["Script"]))
+        self.assertEqual(tracer.stats[("webui", "/webui/issues_adhoc/:id.json")][0],
+                         len(self.bs.repo.object_index["CustomIssue"]))
+        governor = config.get_api_client().governor
+        self.assertEqual(governor.in_flight, 0)
+        self.assertTrue(any(e["ph"] == "C" and e["name"] == f"governor {governor.host}"
+                            for e in tracer.events))
+
+    def test_fetch(self):
+        config._config.async_transfers = True
+        exports = self.server.stats["scripts/export_file"]["requests"]
+        fetched = self.bs.fetch_many(["scripts"])
+        self.assertEqual(len(fetched), self.server.stats["scripts/export_file"]["requests"] - exports)
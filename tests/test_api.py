@@ -1,6 +1,7 @@
 import os
 import unittest
 import json
+import lxml.etree as etree
 from httmock import with_httmock, urlmatch
 from netmri_bootstrap import config
 from netmri_bootstrap.objects import api
@@ -179,6 +180,44 @@ class SmokeTest(TestCaseBase):
         obj2 = api.Script.from_blob(git.Blob.from_note(self.repo, obj._blob.note))
         obj2 = self._test_push_to_api(obj2)
 
+    @with_httmock(authenticate_response, scripts_show, scripts_export_file, policy_rules_show)
+    def test_lazy_load_from_blob(self):
+        obj = self._test_object_import(api.PolicyRule, 1)
+        obj2 = api.PolicyRule.from_blob(git.Blob.from_note(self.repo, obj._blob.note))
+        # Neither note nor repr need content
+        self.assertEqual(obj2.get_note()["id"], 1)
+        self.assertIn("(id 1)", repr(obj2))
+        self.assertIs(obj2._loaded_content, api._NOT_LOADED)
+        self.assertEqual(obj2.short_name, "example_rule")
+        self.assertIsNot(obj2._loaded_content, api._NOT_LOADED)
+
+        obj = self._test_object_import(api.Script, 74)
+        obj2 = api.Script.from_blob(git.Blob.from_note(self.repo, obj._blob.note))
+        obj2.risk_level = "5"
+        # Metadata of scripts is read from the header of the blob
+        self.assertEqual(obj2.name, "test python")
+        self.assertIs(obj2._loaded_content, api._NOT_LOADED)
+        # Assigned values aren't replaced with ones from content
+        self.assertEqual(obj2.risk_level, "5")
+        self.assertTrue(obj2._content.startswith("# BEGIN-INTERNAL-SCRIPT-BLOCK"))
+
+    def test_canonical_xml(self):
+        content = ("<policy-rule b='2' a='1'><name>rule</name>\n  <rule-logic xmlns:x='urn:unused'>"
+                   "<If xmlns='urn:rules'><Then/>\n</If></rule-logic></policy-rule>")
+        canonical = api.XmlObject.canonicalize(etree.fromstring(content))
+        self.assertEqual(canonical, "<?xml version='1.0' encoding='UTF-8'?>\n"
+                                    '<policy-rule a="1" b="2">\n'
+                                    "  <name>rule</name>\n"
+                                    "  <rule-logic>\n"
+                                    '    <If xmlns="urn:rules">\n'
+                                    "      <Then/>\n"
+                                    "    </If>\n"
+                                    "  </rule-logic>\n"
+                                    "</policy-rule>\n")
+        self.assertEqual(api.XmlObject.canonicalize(etree.fromstring(canonical.encode("utf8"))), canonical)
+        self.assertEqual(api.PolicyRule.get_content_hash([content]),
+                         api.PolicyRule.get_content_hash([canonical]))
+
     @with_httmock(authenticate_response, script_modules_show, script_modules_export_file)
     def test_script_module_import(self):
         self._test_object_import(api.ScriptModule, 10)
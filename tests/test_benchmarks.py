@@ -0,0 +1,44 @@
+import os
+import unittest
+from netmri_bootstrap import config
+from benchmarks import suite, synthetic
+
+BASE_PATH = "/tmp/netmri_bootstrap"
+
+
+def setUpModule():
+    os.system(f"mkdir -p {BASE_PATH}")
+
+
+def tearDownModule():
+    os.system(f"rm -rf {BASE_PATH}")
+
+
+class TestBenchmarks(unittest.TestCase):
+    repo_path = f"{BASE_PATH}/bench_repo"
+
+    def tearDown(self):
+        config._config = None
+        config._client = None
+        os.system(f"rm -rf {self.repo_path}")
+
+    def test_run_suite(self):
+        paths_by_class = synthetic.build_repo(self.repo_path, files=30, commits=3,
+                                              changes_per_commit=5)
+        ctx = suite.Context(self.repo_path, paths_by_class, sample_size=3)
+        results = suite.run_suite(ctx, repeat=1)
+        self.assertEqual(set(results.keys()), set(suite.BENCHMARKS.keys()))
+        file_count = sum(len(paths) for paths in paths_by_class.values())
+        self.assertEqual(results["Repo.object_index (cold)"]["items"], file_count)
+        self.assertEqual(results["Repo.get_blobs"]["items"], file_count)
+
+    def test_compare(self):
+        baseline = {"results": {"a": {"median": 1.0}, "b": {"median": 1.0},
+                                "c": {"median": 1.0}}}
+        current = {"results": {"a": {"median": 1.05}, "b": {"median": 1.5},
+                               "d": {"median": 1.0}}}
+        rows = {row[0]: row for row in suite.compare(baseline, current, threshold=0.1)}
+        self.assertFalse(rows["a"][4])
+        self.assertTrue(rows["b"][4])
+        self.assertIsNone(rows["c"][3])
+        self.assertIsNone(rows["d"][3])
@@ -0,0 +1,108 @@
+import os
+import unittest
+from netmri_bootstrap.checkpoint import InitCheckpoint, PushJournal
+
+BASE_PATH = "/tmp/netmri_bootstrap_checkpoints"
+
+
+def setUpModule():
+    os.system(f"mkdir -p {BASE_PATH}")
+
+
+def tearDownModule():
+    os.system(f"rm -rf {BASE_PATH}")
+
+
+class FakeRepo():
+    """Just enough of git.Repo for checkpoints"""
+
+    def __init__(self, target_name=None):
+        self.target_name = target_name
+
+    def get_state_dir(self):
+        return BASE_PATH
+
+
+class FakeBlob():
+    def __init__(self, path, id):
+        self.path = path
+        self.id = id
+
+
+class TestInitCheckpoint(unittest.TestCase):
+    def tearDown(self):
+        for name in os.listdir(BASE_PATH):
+            os.remove(os.path.join(BASE_PATH, name))
+
+    def test_save_load(self):
+        checkpoint = InitCheckpoint(FakeRepo())
+        self.assertFalse(checkpoint.exists())
+        checkpoint.add("Script", 1)
+        checkpoint.add("Script", 2)
+        checkpoint.add("Policy", 1)
+        checkpoint.chunks = 2
+        checkpoint.save()
+
+        loaded = InitCheckpoint(FakeRepo())
+        loaded.load()
+        self.assertEqual(loaded.count(), 3)
+        self.assertEqual(loaded.chunks, 2)
+        self.assertTrue(loaded.is_done("Script", 2))
+        self.assertFalse(loaded.is_done("Policy", 2))
+        loaded.remove()
+        self.assertFalse(checkpoint.exists())
+
+    def test_targets(self):
+        # Every target has its own checkpoint
+        InitCheckpoint(FakeRepo("dr")).save()
+        self.assertTrue(InitCheckpoint(FakeRepo("dr")).exists())
+        self.assertFalse(InitCheckpoint(FakeRepo()).exists())
+        self.assertFalse(InitCheckpoint(FakeRepo("emea")).exists())
+
+
+class TestPushJournal(unittest.TestCase):
+    def tearDown(self):
+        PushJournal(FakeRepo()).remove()
+
+    def test_resume(self):
+        blobs = [FakeBlob(f"scripts/script{i}.py", f"blob{i}") for i in range(3)]
+        journal = PushJournal(FakeRepo())
+        self.assertEqual(journal.open("commit1"), 0)
+        journal.add("push", blobs[0], "ok")
+        journal.add("push", blobs[1], "error")
+        journal.add("delete", blobs[2], "ok")
+        journal.close()
+
+        # Failed object is pushed again
+        journal = PushJournal(FakeRepo())
+        self.assertEqual(journal.open("commit1"), 2)
+        self.assertTrue(journal.is_done("push", blobs[0]))
+        self.assertFalse(journal.is_done("push", blobs[1]))
+        self.assertFalse(journal.is_done("push", blobs[2]))
+        self.assertTrue(journal.is_done("delete", blobs[2]))
+        # Another blob of the same path is a new change
+        self.assertFalse(journal.is_done("push", FakeBlob(blobs[0].path, "blob9")))
+        journal.close()
+
+        # Journal of another commit is discarded
+        journal = PushJournal(FakeRepo())
+        self.assertEqual(journal.open("commit2"), 0)
+        journal.close()
+
+    def test_broken_line(self):
+        blob = FakeBlob("scripts/script.py", "blob")
+        journal = PushJournal(FakeRepo())
+        journal.open("commit1")
+        journal.add("push", blob, "ok")
+        journal.close()
+        # Killed while writing the next entry
+        with open(journal.path, "a") as fh:
+            fh.write('{"action": "push", "pa')
+
+        journal = PushJournal(FakeRepo())
+        self.assertEqual(journal.open("commit1"), 1)
+        journal.add("push", FakeBlob("scripts/other.py", "blob2"), "ok")
+        journal.close()
+        journal = PushJournal(FakeRepo())
+        self.assertEqual(journal.open("commit1"), 2)
+        journal.close()
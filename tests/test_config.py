@@ -35,3 +35,35 @@ class TestConfig(TestCase):
         self.assertEqual(client.password, 'unittest')
         self.assertEqual(client.protocol, "https")
         self.assertEqual(client.ssl_verify, True)
+
+    def test_targets(self):
+        conf = config.BootstrapperConfig(
+            host="localhost", username="admin", password="unittest",
+            scripts_root="/tmp/netmri/", bootstrap_branch="master",
+            skip_readonly_objects=True, class_paths={},
+            targets=[{"name": "emea", "host": "emea.example.com"},
+                     {"name": "dr", "host": "dr.example.com", "password": "dr", "proto": "http"}])
+        emea, dr = conf.get_targets()
+        self.assertEqual((emea.host, emea.password, emea.use_ssl), ("emea.example.com", "unittest", True))
+        self.assertEqual((dr.host, dr.password, dr.use_ssl), ("dr.example.com", "dr", False))
+        self.assertEqual(dr.notes_ref, "refs/notes/netmri-bootstrap-dr")
+        self.assertEqual(dr.sync_tag, "synced_to_netmri-dr")
+
+        old_config = config._config
+        config._config = conf
+        try:
+            self.assertEqual(config.get_target().name, "emea")
+            with config.use_target("dr"):
+                self.assertEqual(config.get_api_client().host, "dr.example.com")
+            self.assertEqual(config.get_api_client().host, "emea.example.com")
+            with self.assertRaises(ValueError):
+                with config.use_target("apac"):
+                    pass
+        finally:
+            config._config = old_config
+            config._target_clients = {}
+
+        with self.assertRaises(ValueError):
+            config.BootstrapperConfig(scripts_root="/tmp/netmri/", bootstrap_branch="master",
+                                      skip_readonly_objects=True, class_paths={},
+                                      targets=[{"name": "dr"}])
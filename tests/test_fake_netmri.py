@@ -0,0 +1,650 @@
+import os
+import mock
+import subprocess
+import unittest
+import threading
+from netmri_bootstrap import config, Bootstrapper
+from netmri_bootstrap.checkpoint import InitCheckpoint, PushJournal
+from netmri_bootstrap.objects import api, git
+from tests.base import FakeNetMRITestCase, BASE_PATH
+from tests.fake_netmri import FakeNetMRI, generate_catalog, USERNAME, PASSWORD
+
+
+def tearDownModule():
+    os.system(f"rm -rf {BASE_PATH}")
+
+
+class StopWatchingError(Exception):
+    """Ends Bootstrapper.watch() loop in tests"""
+
+
+class TestFakeNetMRI(FakeNetMRITestCase):
+    """Runs init, check and push against fake server"""
+    repo_path = f"{BASE_PATH}/fake_netmri_repo"
+    catalog_args = {"scripts": 12, "read_only_fraction": 0.2}
+
+    def _count_objects(self, repo):
+        return sum(len(subindex) for subindex in repo.object_index.values())
+
+    def test_init_check_push(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        read_only = sum(1 for records in catalog.records.values()
+                        for r in records.values() if r.get("read_only"))
+        self.assertEqual(self._count_objects(bs.repo), catalog.size() - read_only)
+        self.assertTrue(bs.check_netmri())
+
+        # Edit one script, add another one and push both
+        script_path = sorted(p for p in os.listdir(f"{self.repo_path}/scripts/category0")
+                             if p.endswith(".py"))[0]
+        with open(f"{self.repo_path}/scripts/category0/{script_path}", "a") as fh:
+            fh.write("print('edited')\n")
+        with open(f"{self.repo_path}/scripts/new_script.py", "w") as fh:
+            fh.write("# BEGIN-SCRIPT-BLOCK\n# Script: brand new\n"
+                     "# Script-Description: added by test\n# END-SCRIPT-BLOCK\n")
+        bs.repo.stage_file(f"scripts/category0/{script_path}")
+        bs.repo.stage_file("scripts/new_script.py")
+        bs.repo.commit(message="Edited by unittest")
+
+        bs = self.reopen()
+        bs.update_netmri()
+        self.assertIsNotNone(catalog.find_by("scripts", "name", "brand new"))
+        self.assertTrue(bs.check_netmri())
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+
+    def test_compact_records(self):
+        bs = self.init_repo()
+        records = api.Policy.index()
+        self.assertTrue(records)
+        # Records keep only the fields that are used, without __dict__
+        self.assertFalse(hasattr(records[0], "__dict__"))
+        self.assertEqual(set(api.Policy.record_type().__slots__),
+                         {"id", "updated_at", "read_only", "short_name", "name"})
+        full = api.Policy.index(full=True)
+        obj = api.Policy.from_api(full[0])
+        self.assertEqual(obj.description, self.server.catalog.records["policies"][obj.id]["description"])
+
+        bs.repo.load_notes()
+        note = next(iter(bs.repo.object_index["Policy"].values()))
+        self.assertIsInstance(note, git.NoteRecord)
+        self.assertFalse(hasattr(note, "__dict__"))
+        self.assertEqual(dict(note)["class"], "Policy")
+        self.assertEqual(git.Blob.from_note(bs.repo, note).note.content, note)
+
+    def test_streamed_config_lists(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        path = self.get_paths(bs.repo, "lists/")[0]
+        with open(f"{self.repo_path}/{path}", "a", newline="") as fh:
+            fh.write('"99","\u044e\u043d\u0438\u043a\u043e\u0434"\r\n')
+        bs.repo.stage_file(path)
+        bs.repo.commit(message="Edited by unittest")
+
+        obj = api.ApiObject.from_blob(git.Blob.from_path(bs.repo, path))
+        self.assertTrue(obj.push_to_api())
+        # The file has been uploaded straight from the blob
+        self.assertIs(obj._loaded_content, api._NOT_LOADED)
+        with open(f"{self.repo_path}/{path}", newline="") as fh:
+            content = fh.read()
+        self.assertEqual(catalog.contents["config_lists"][obj.id], content)
+
+        # Export is written to a temporary file, not kept in memory
+        fetched = api.ConfigList.from_api(obj.show())
+        fetched.load_content_from_api()
+        tmp_path = fetched._content_file[0]
+        self.assertIs(fetched._loaded_content, api._NOT_LOADED)
+        self.assertEqual("".join(fetched.export_to_repo()), content)
+        self.assertEqual(fetched._content, content)
+        self.assertFalse(os.path.exists(tmp_path))
+
+    def test_skip_unchanged_push(self):
+        config._config.skip_unchanged_pushes = True
+        bs = self.init_repo()
+        paths = self.get_paths(bs.repo, "scripts/", ".py")[:3]
+        note = git.Blob.from_path(bs.repo, paths[0]).note.content
+        self.assertIsNotNone(note["content_hash"])
+
+        # Only whitespace at the end of lines differs from the server
+        with open(f"{self.repo_path}/{paths[0]}") as fh:
+            content = fh.read()
+        with open(f"{self.repo_path}/{paths[0]}", "w") as fh:
+            fh.write(content.replace("\n", "  \r\n") + "\n\n")
+        bs.repo.stage_file(paths[0])
+        bs.repo.commit(message="Reformatted by unittest")
+        downloads = self.server.stats["scripts/export_file"]["requests"]
+        bs.update_netmri()
+        self.assertNotIn("scripts/update", self.server.stats)
+        # Note has the hash of content on the server, nothing is downloaded
+        self.assertEqual(self.server.stats["scripts/export_file"]["requests"], downloads)
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+
+        # Script changed on the server after init is downloaded to compare it
+        record_id = git.Blob.from_path(bs.repo, paths[1]).note.content["id"]
+        self.server.catalog.records["scripts"][record_id]["updated_at"] = "2030-01-01 00:00:00"
+        bs.force_push([paths[1]])
+        self.assertNotIn("scripts/update", self.server.stats)
+        self.assertEqual(self.server.stats["scripts/export_file"]["requests"], downloads + 1)
+        note = git.Blob.from_path(bs.repo, paths[1]).note.content
+        self.assertEqual(note["updated_at"], "2030-01-01 00:00:00")
+
+        self.edit_files(bs.repo, [paths[1]])
+        bs.update_netmri()
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 1)
+        self.assertTrue(bs.check_netmri())
+
+        # Notes written before content hashes were recorded: pushed without
+        # comparing it with the server
+        blob = git.Blob.from_path(bs.repo, paths[2])
+        blob.note = dict(blob.note.content, content_hash=None)
+        shows = self.server.stats["scripts/show"]["requests"]
+        bs.force_push([paths[2]])
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 2)
+        self.assertEqual(self.server.stats["scripts/show"]["requests"], shows)
+        self.assertEqual(self.server.stats["scripts/export_file"]["requests"], downloads + 1)
+
+        # Without the option only successful pushes hash the blob, for the note
+        config._config.skip_unchanged_pushes = False
+        self.server.set_fault("scripts/update", error_rate=1.0)
+        with mock.patch.object(api.ApiObject, "get_repo_content_hash", autospec=True,
+                               side_effect=api.ApiObject.get_repo_content_hash) as hashed:
+            bs.force_push([paths[0]])
+            self.assertEqual(hashed.call_count, 0)
+            self.server.set_fault("scripts/update")
+            bs.force_push([paths[0]])
+            self.assertEqual(hashed.call_count, 1)
+        self.assertIsNotNone(git.Blob.from_path(bs.repo, paths[0]).note.content["content_hash"])
+
+    def test_paged_init(self):
+        config._config.index_page_size = 5
+        config._config.pipeline_queue_size = 2
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        read_only = sum(1 for records in catalog.records.values()
+                        for r in records.values() if r.get("read_only"))
+        self.assertEqual(self._count_objects(bs.repo), catalog.size() - read_only)
+        # 12 scripts are listed in 3 pages
+        self.assertEqual(self.server.stats["scripts/index"]["requests"], 3)
+        self.assertTrue(bs.check_netmri())
+
+    def test_paged_custom_issues(self):
+        catalog = self.server.catalog
+        for i in range(3, 40):
+            catalog.add_issue({"IssueTypeID": f"CustomIssue{i}", "Title": f"custom issue {i}",
+                               "Correctness": "on", "Stability": "off"})
+        config._config.index_page_size = 5
+        bs = self.init_repo()
+        self.assertEqual(len(bs.repo.object_index["CustomIssue"]), 40)
+        # 8 full pages and an empty one
+        self.assertEqual(self.server.stats["webui/grid_data"]["requests"], 9)
+        self.assertTrue(bs.check_netmri())
+
+    def test_resumed_init(self):
+        config._config.init_chunk_size = 5
+        # Interrupt init when it gets to policy rules
+        self.server.set_fault("policy_rules/index", error_rate=1.0)
+        bs = Bootstrapper.init_empty_repo()
+        with self.assertRaises(Exception):
+            bs.export_from_netmri()
+        checkpoint = InitCheckpoint(bs.repo)
+        self.assertTrue(checkpoint.exists())
+        checkpoint.load()
+        self.assertGreater(checkpoint.chunks, 1)
+        self.assertEqual(checkpoint.count(), self._count_objects(bs.repo))
+        self.assertIsNone(bs.repo.get_last_synced_commit())
+
+        self.server.set_fault("policy_rules/index")
+        downloads = self.server.stats["scripts/export_file"]["requests"]
+        bs = self.reopen()
+        bs.export_from_netmri(resume=True)
+        # Scripts have been downloaded before the failure
+        self.assertEqual(self.server.stats["scripts/export_file"]["requests"], downloads)
+        self.assertFalse(checkpoint.exists())
+        self.assertTrue(bs.check_netmri())
+
+    def test_resumed_push(self):
+        bs = self.init_repo()
+        paths = self.get_paths(bs.repo, "scripts/", ".py")[:3]
+        self.edit_files(bs.repo, paths)
+        synced = bs.repo.get_last_synced_commit()
+
+        # Process dies after the second object is pushed
+        push_to_api = api.ApiObject.push_to_api
+        calls = []
+
+        def interrupted_push(obj):
+            calls.append(obj.path)
+            if len(calls) == 3:
+                raise KeyboardInterrupt()
+            return push_to_api(obj)
+        with mock.patch.object(api.ApiObject, "push_to_api", interrupted_push):
+            with self.assertRaises(KeyboardInterrupt):
+                self.reopen().update_netmri()
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 2)
+
+        bs = self.reopen()
+        self.assertEqual(bs.repo.get_last_synced_commit(), synced)
+        bs.update_netmri()
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 3)
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+        self.assertFalse(os.path.exists(PushJournal(bs.repo).path))
+        self.assertTrue(bs.check_netmri())
+
+    def test_concurrent_deletes(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        paths = self.get_paths(bs.repo, "policy/")
+        ids = {klass: {git.Blob.from_path(bs.repo, path).note.content["id"] for path in paths
+                       if (path.startswith("policy/rules/")) == (klass == "policy_rules")}
+               for klass in ("policies", "policy_rules")}
+        bs.repo.remove_files(paths)
+        bs.repo.commit(message="Removed by unittest")
+
+        destroy_on_server = api.ApiObject.destroy_on_server
+        deleted = []
+
+        def recorded_destroy(obj):
+            destroy_on_server(obj)
+            deleted.append(obj.__class__.__name__)
+        bs = self.reopen()
+        with mock.patch.object(api.ApiObject, "destroy_on_server", recorded_destroy):
+            bs.update_netmri()
+        # Policies are gone before the rules they refer to
+        expected = ["Policy"] * len(ids["policies"])
+        expected.extend(["PolicyRule"] * len(ids["policy_rules"]))
+        self.assertEqual(deleted, expected)
+        for klass, klass_ids in ids.items():
+            self.assertFalse(klass_ids & set(catalog.records[klass]))
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+        self.assertTrue(bs.check_netmri())
+
+    def test_delete_custom_issue(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        path = self.get_paths(bs.repo, "custom_issues/")[0]
+        issue_id = git.Blob.from_path(bs.repo, path).note.content["id"]
+        bs.repo.remove_files([path])
+        bs.repo.commit(message="Removed by unittest")
+
+        bs = self.reopen()
+        bs.update_netmri()
+        self.assertNotIn(issue_id, catalog.issues)
+        self.assertEqual(self.server.stats["webui/issues_adhoc"]["errors"], 0)
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+        self.assertTrue(bs.check_netmri())
+
+    def test_policy_rules_update(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        path = sorted(blob.path for blob in bs.repo.get_blobs()
+                      if blob.path.startswith("policy/") and not blob.path.startswith("policy/rules/"))[0]
+        policy_id = git.Blob.from_path(bs.repo, path).note.content["id"]
+        rule_names = sorted(os.path.splitext(p)[0] for p in os.listdir(f"{self.repo_path}/policy/rules"))
+        # Policy refers to every rule, so all of its rules but the first one are added
+        with open(f"{self.repo_path}/{path}") as fh:
+            content = fh.read()
+        references = "".join(f"<policy-rule-reference>{name}</policy-rule-reference>"
+                             for name in rule_names)
+        start = content.index("<policy-rules")
+        end = content.index("</policy-rules>")
+        content = content[:start] + '<policy-rules type="array">' + references + content[end:]
+        with open(f"{self.repo_path}/{path}", "w") as fh:
+            fh.write(content)
+        bs.repo.stage_file(path)
+        bs.repo.commit(message="Edited by unittest")
+
+        self.server.set_fault("policies/add_policy_rules", error_rate=1.0)
+        bs = self.reopen()
+        bs.update_netmri()
+        added = self.server.stats["policies/add_policy_rules"]["requests"]
+        self.assertGreater(added, 1)
+        # All changes are tried, failures end up in one error
+        note = git.Blob.from_path(bs.repo, path).note.content
+        self.assertIn(f"Cannot update {added} of ", note["error"])
+
+        self.server.set_fault("policies/add_policy_rules")
+        bs.force_push([path])
+        self.assertEqual(len(catalog.policy_rules[policy_id]), len(rule_names))
+        self.assertTrue(bs.check_netmri())
+
+    def test_watch(self):
+        bs = self.init_repo()
+        path = self.get_paths(bs.repo, "scripts/category0/", ".py")[0]
+        # Commits land in the branch from somewhere else between cycles
+        committer = git.Repo(self.repo_path, "master")
+
+        def edit_script():
+            self.edit_files(committer, [path])
+
+        def edit_readme():
+            with open(f"{self.repo_path}/README", "w") as fh:
+                fh.write("Not an object\n")
+            committer.stage_file("README")
+            committer.commit(message="Added readme")
+        cycles = [edit_script, edit_readme, lambda: None, lambda: None]
+
+        def sleep(interval):
+            if not cycles:
+                raise StopWatchingError()
+            cycles.pop(0)()
+
+        bs = self.reopen()
+        with mock.patch("netmri_bootstrap.time.sleep", sleep), \
+                mock.patch.object(bs, "update_netmri", wraps=bs.update_netmri) as update_netmri:
+            with self.assertRaises(StopWatchingError):
+                bs.watch()
+        # Commit with no objects is marked as synced and isn't pushed again
+        self.assertEqual(update_netmri.call_count, 2)
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 1)
+        self.assertEqual(bs.repo.get_last_synced_commit(), committer.get_head_commit())
+
+    def test_watch_server(self):
+        bs = self.init_repo()
+        record = sorted(self.server.catalog.records["scripts"].values(), key=lambda r: r["id"])[0]
+        cycles = [lambda: record.update(updated_at="2030-01-01 00:00:00"), lambda: None]
+
+        def sleep(interval):
+            if not cycles:
+                raise StopWatchingError()
+            cycles.pop(0)()
+        with mock.patch("netmri_bootstrap.time.sleep", sleep), \
+                mock.patch.object(bs, "check_netmri") as check_netmri:
+            with self.assertRaises(StopWatchingError):
+                bs.watch(check_server=True, server_interval=0)
+        # Watermarks of the first cycle are the baseline
+        self.assertEqual(check_netmri.call_count, 1)
+        self.assertNotIn("scripts/update", self.server.stats)
+
+    def test_push_received(self):
+        bs = self.init_repo()
+        old_sha = bs.repo.get_head_commit().hexsha
+        with open(f"{self.repo_path}/README", "w") as fh:
+            fh.write("Not an object\n")
+        bs.repo.stage_file("README")
+        bs.repo.commit(message="Added readme")
+        new_sha = bs.repo.get_head_commit().hexsha
+        bs.push_received(old_sha, new_sha)
+        # Nothing to push, but the hook will start from here next time
+        self.assertEqual(bs.repo.get_last_synced_commit().hexsha, new_sha)
+        self.assertNotIn("scripts/update", self.server.stats)
+
+        self.edit_files(bs.repo, self.get_paths(bs.repo, "scripts/category0/", ".py")[:1])
+        old_sha, new_sha = new_sha, bs.repo.get_head_commit().hexsha
+        with mock.patch("netmri_bootstrap.logger.warning") as warning:
+            bs.push_received(old_sha, new_sha)
+        warning.assert_not_called()
+        self.assertEqual(self.server.stats["scripts/update"]["requests"], 1)
+        self.assertEqual(bs.repo.get_last_synced_commit().hexsha, new_sha)
+        self.assertTrue(bs.check_netmri())
+
+    def test_install_hook(self):
+        bs = Bootstrapper.init_empty_repo()
+        received = f"{BASE_PATH}/hook_input"
+        bs.install_hook(f"sh -c 'echo \"$1 $(cat)\" > {received}' hook")
+        hook_path = f"{self.repo_path}/.git/hooks/post-receive"
+        self.assertTrue(os.access(hook_path, os.X_OK))
+        # Git runs the hook with commits on stdin
+        subprocess.run([hook_path], input=b"old new refs/heads/master\n", check=True,
+                       cwd=f"{self.repo_path}/.git", env=dict(os.environ, GIT_DIR="."))
+        with open(received) as fh:
+            self.assertEqual(fh.read(), "post_receive old new refs/heads/master\n")
+        os.remove(received)
+
+        # Our own hook is replaced, anything else is left alone
+        bs.install_hook("netmri-bootstrap.py")
+        with open(hook_path, "w") as fh:
+            fh.write("#!/bin/sh\necho custom hook\n")
+        with self.assertRaises(ValueError):
+            bs.install_hook("netmri-bootstrap.py")
+        with open(hook_path) as fh:
+            self.assertIn("custom hook", fh.read())
+
+    def test_bulk_sync_id(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        # Server has been rebuilt: all scripts got new ids, one script is gone
+        # and another one now has a duplicate
+        scripts = sorted(catalog.records["scripts"].values(), key=lambda r: r["id"])
+        catalog.records["scripts"] = {}
+        for record in scripts[1:]:
+            record.pop("id")
+            catalog.add("scripts", record)
+        duplicate = dict(scripts[-1])
+        duplicate.pop("id")
+        catalog.add("scripts", duplicate)
+
+        bs = self.reopen()
+        summary = bs.relink_many()
+        script_paths = [p for p in summary["changed"] if p.startswith("scripts/")]
+        read_only = sum(1 for r in scripts if r["read_only"])
+        self.assertEqual(len(script_paths), len(scripts) - read_only - 2)
+        self.assertEqual(len(summary["missing"]), 1)
+        self.assertEqual(len(summary["duplicates"]), 1)
+        self.assertNotIn("scripts/find", self.server.stats)
+        self.assertEqual(self.server.stats["scripts/index"]["requests"], 2)
+
+        repo = git.Repo(self.repo_path, "master")
+        for path in script_paths:
+            note = git.Blob.from_path(repo, path).note.content
+            record = catalog.get("scripts", note["id"])
+            self.assertIn(record["name"].replace(" ", "_"), path)
+
+    def test_sync_id_git_calls(self):
+        bs = self.init_repo()
+        paths = self.get_paths(bs.repo, "scripts/")
+        # Notes are on the old blobs of edited files and have to be moved
+        self.edit_files(bs.repo, paths, text="# edited\n")
+        catalog = self.server.catalog
+        scripts = sorted(catalog.records["scripts"].values(), key=lambda r: r["id"])
+        catalog.records["scripts"] = {}
+        for record in scripts:
+            record.pop("id")
+            catalog.add("scripts", record)
+
+        calls = []
+        execute = git._TracedGit.execute
+
+        def counted_execute(git_cmd, command, *args, **kwargs):
+            calls.append(command[1])
+            return execute(git_cmd, command, *args, **kwargs)
+        bs = self.reopen()
+        with mock.patch.object(git._TracedGit, "execute", counted_execute):
+            summary = bs.relink_many()
+        self.assertEqual(len([p for p in summary["changed"] if p.startswith("scripts/")]), len(paths))
+        # Number of git runs doesn't depend on number of objects
+        self.assertEqual(sorted(calls), ["cat-file", "cat-file", "notes", "notes", "update-ref"])
+
+        repo = git.Repo(self.repo_path, "master")
+        repo.load_notes()
+        for path in paths:
+            self.assertEqual(len(repo.get_noted_blobs(path)), 1)
+            note = git.Blob.from_path(repo, path).note.content
+            self.assertIn(catalog.get("scripts", note["id"])["name"].replace(" ", "_"), path)
+
+    def test_fetch_many(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        paths = self.get_paths(bs.repo, "scripts/")
+        # Somebody has edited two scripts in UI
+        edited = [p for p in paths if p.endswith(".py")][:2]
+        for path in edited:
+            record_id = git.Blob.from_path(bs.repo, path).note.content["id"]
+            catalog.contents["scripts"][record_id] += "print('edited in UI')\n"
+        head = bs.repo.get_head_commit()
+
+        bs = self.reopen()
+        fetched = bs.fetch_many(["scripts/*.py", f"{self.repo_path}/scripts/"])
+        self.assertEqual(sorted(fetched), paths)
+        self.assertEqual(self.server.stats["scripts/show"]["requests"], len(paths))
+        repo = git.Repo(self.repo_path, "master")
+        self.assertEqual(repo.get_head_commit().parents[0], head)
+        changed = sorted(d.a_path for d in repo.get_head_commit().diff(head))
+        self.assertEqual(changed, edited)
+        for path in edited:
+            self.assertIn("edited in UI", git.Blob.from_path(repo, path).get_content())
+            self.assertIsNotNone(git.Blob.from_path(repo, path).note.content["id"])
+
+        with self.assertRaises(ValueError):
+            bs.fetch_many(["scripts/no_such_*.py"])
+
+    def test_pull(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        paths = self.get_paths(bs.repo, "scripts/", ".py")
+        # One script is edited in UI, another one is deleted and a new one is added
+        edited_id = git.Blob.from_path(bs.repo, paths[0]).note.content["id"]
+        catalog.contents["scripts"][edited_id] += "print('edited in UI')\n"
+        # Dates have one second resolution
+        catalog.get("scripts", edited_id)["updated_at"] = "2099-01-01 00:00:00"
+        deleted_id = git.Blob.from_path(bs.repo, paths[1]).note.content["id"]
+        catalog.destroy("scripts", deleted_id)
+        added = dict(catalog.get("scripts", edited_id), name="added in UI", read_only=False)
+        for key in ("id", "created_at", "updated_at"):
+            added.pop(key)
+        catalog.add("scripts", added, content="print('new')\n")
+        self.assertFalse(bs.check_netmri())
+        downloads = self.server.stats["scripts/export_file"]["requests"]
+
+        bs = self.reopen()
+        summary = bs.pull()
+        self.assertEqual(summary["changed"], [paths[0]])
+        self.assertEqual(summary["deleted"], [paths[1]])
+        self.assertEqual(len(summary["added"]), 1)
+        self.assertEqual(self.server.stats["scripts/export_file"]["requests"], downloads + 2)
+        self.assertFalse(os.path.exists(f"{self.repo_path}/{paths[1]}"))
+
+        bs = self.reopen()
+        self.assertEqual(bs.repo.get_last_synced_commit(), bs.repo.get_head_commit())
+        self.assertIn("edited in UI", git.Blob.from_path(bs.repo, paths[0]).get_content())
+        self.assertTrue(bs.check_netmri())
+        self.assertEqual(bs.pull(), {"added": [], "changed": [], "deleted": [], "conflicts": []})
+
+    def test_pull_reformatted_xml(self):
+        bs = self.init_repo()
+        catalog = self.server.catalog
+        head = bs.repo.get_head_commit()
+        rule_note = next(iter(bs.repo.object_index["PolicyRule"].values()))
+        policy_note = next(note for note in bs.repo.object_index["Policy"].values()
+                           if len(catalog.policy_rules[note["id"]]) > 1)
+        # Server sends the same rule logic formatted differently and rules
+        # of the policy in a different order
+        rule = catalog.get("policy_rules", rule_note["id"])
+        rule["rule_logic"] = rule["rule_logic"].replace("<If>", "\n  <If>").replace(
+            "editor='basic-file' xmlns='http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml'",
+            "xmlns='http://www.infoblox.com/NetworkAutomation/1.0/ScriptXml'   editor='basic-file'")
+        catalog.policy_rules[policy_note["id"]].reverse()
+        for controller, note in (("policy_rules", rule_note), ("policies", policy_note)):
+            catalog.get(controller, note["id"])["updated_at"] = "2099-01-01 00:00:00"
+
+        # Only the main thread reads the notes index of the repo
+        find_note_by_id = git.Repo.find_note_by_id
+        threads = set()
+
+        def recorded_find(repo, klass, id):
+            threads.add(threading.current_thread())
+            return find_note_by_id(repo, klass, id)
+        with mock.patch.object(git.Repo, "find_note_by_id", recorded_find):
+            summary = self.reopen().pull()
+        self.assertLessEqual(threads, {threading.main_thread()})
+        self.assertEqual(sorted(summary["changed"]), sorted([rule_note["path"], policy_note["path"]]))
+        bs = self.reopen()
+        self.assertEqual(bs.repo.get_head_commit(), head)
+        self.assertEqual(bs.repo.find_note_by_id("PolicyRule", rule_note["id"])["updated_at"],
+                         "2099-01-01 00:00:00")
+        self.assertTrue(bs.check_netmri())
+
+    def test_xml_processes(self):
+        config._config.xml_processes = 2
+        bs = Bootstrapper.init_empty_repo()
+        with mock.patch.object(api, "render_xml_objects", wraps=api.render_xml_objects) as render:
+            bs.export_from_netmri()
+        self.assertTrue(render.called)
+        self.assertTrue(bs.check_netmri())
+        blobs = [blob for blob in bs.repo.get_blobs() if blob.path.startswith(("policy/", "custom_issues/"))]
+        self.assertTrue(blobs)
+        for blob in blobs:
+            # Same as content built in this process
+            expected = api.ApiObject.from_blob(blob)
+            expected.load_content_from_api()
+            self.assertEqual(blob.get_content(), expected.render_content())
+
+        head = bs.repo.get_head_commit()
+        self.assertEqual(len(bs.fetch_many(["policy"])), len([b for b in blobs if b.path.startswith("policy/")]))
+        self.assertEqual(bs.repo.get_head_commit(), head)
+
+        rule_note = next(iter(bs.repo.object_index["PolicyRule"].values()))
+        path = f"{self.repo_path}/{rule_note['path']}"
+        with open(path) as fh:
+            content = fh.read()
+        with open(path, "w") as fh:
+            fh.write(content.replace("<description>", "<description>Edited. "))
+        bs.repo.stage_file(rule_note["path"])
+        bs.repo.commit(message="Edited by unittest")
+        with mock.patch.object(api, "prepare_xml_blobs", wraps=api.prepare_xml_blobs) as prepare:
+            bs.update_netmri()
+        self.assertEqual(len(prepare.call_args[0][0]), 1)
+        record = self.server.catalog.get("policy_rules", rule_note["id"])
+        self.assertTrue(record["description"].startswith("Edited. "))
+        self.assertTrue(bs.check_netmri())
+
+    def test_injected_errors(self):
+        self.server.set_fault("scripts/export_file", error_rate=1.0, error_status=503)
+        bs = self.init_repo()
+        self.assertEqual(len(bs.repo.object_index.get("Script", {})), 0)
+        self.assertGreater(len(bs.repo.object_index.get("ScriptModule", {})), 0)
+        self.assertEqual(self.server.stats["scripts/export_file"]["errors"],
+                         self.server.stats["scripts/export_file"]["requests"])
+
+
+class TestTargets(unittest.TestCase):
+    """Pushes the same repo to two fake servers"""
+    repo_path = f"{BASE_PATH}/fake_netmri_targets_repo"
+
+    def setUp(self):
+        # Same seed gives both servers the same objects
+        self.servers = {name: FakeNetMRI(generate_catalog(scripts=6, read_only_fraction=0.2),
+                                         seed=0).start()
+                        for name in ("emea", "dr")}
+        config._config = config.BootstrapperConfig(
+            username=USERNAME, password=PASSWORD, proto="http", scripts_root=self.repo_path,
+            bootstrap_branch="master", skip_readonly_objects=True,
+            class_paths={"Script": "scripts", "ScriptModule": "script_modules"},
+            targets=[{"name": name, "host": server.host, "port": server.port}
+                     for name, server in self.servers.items()])
+        config._client = None
+        config._target_clients = {}
+
+    def tearDown(self):
+        for server in self.servers.values():
+            server.stop()
+        config._config = None
+        config._client = None
+        config._target_clients = {}
+        os.system(f"rm -rf {self.repo_path}")
+
+    def test_push_to_targets(self):
+        with config.use_target("emea"):
+            Bootstrapper.init_empty_repo().export_from_netmri()
+        with config.use_target("dr"):
+            Bootstrapper().relink_many()
+        self.assertTrue(Bootstrapper.check_targets())
+
+        repo = git.Repo(self.repo_path, "master")
+        path = sorted(blob.path for blob in repo.get_blobs()
+                      if blob.path.startswith("scripts/") and blob.path.endswith(".py"))[0]
+        with open(f"{self.repo_path}/{path}", "a") as fh:
+            fh.write("print('edited')\n")
+        repo.stage_file(path)
+        repo.commit(message="Edited by unittest")
+
+        Bootstrapper.push_to_targets()
+        head = repo.get_head_commit()
+        for name, server in self.servers.items():
+            target_repo = git.Repo(self.repo_path, "master", target=config.get_target(name))
+            self.assertEqual(target_repo.get_last_synced_commit(), head)
+            record_id = git.Blob.from_path(target_repo, path).note.content["id"]
+            self.assertIn("edited", server.catalog.contents["scripts"][record_id])
+        # emea has been synced by init, so only the edited script is pushed there.
+        # dr gets everything
+        self.assertEqual(self.servers["emea"].stats["scripts/update"]["requests"], 1)
+        self.assertGreater(self.servers["dr"].stats["scripts/update"]["requests"], 1)
+        self.assertTrue(Bootstrapper.check_targets())
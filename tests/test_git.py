@@ -1,5 +1,7 @@
 import os
+import mock
 import unittest
+import contextlib
 from netmri_bootstrap.objects import git
 
 BASE_PATH = "/tmp/netmri_bootstrap"
@@ -34,6 +36,18 @@ class TestCaseBase (unittest.TestCase):
         with open(path, "w") as f:
             f.write(content)
 
+    @contextlib.contextmanager
+    def _count_git_calls(self):
+        """Yields list of git commands run inside the block"""
+        calls = []
+        execute = git._TracedGit.execute
+
+        def counted_execute(git_cmd, command, *args, **kwargs):
+            calls.append(" ".join(str(arg) for arg in command[1:]))
+            return execute(git_cmd, command, *args, **kwargs)
+        with mock.patch.object(git._TracedGit, "execute", counted_execute):
+            yield calls
+
 
 class TestInitRepo(TestCaseBase):
     def setUp(self):
@@ -130,6 +144,18 @@ class TestBlob(TestCaseBase):
         self.assertEqual(blob.path, filename)
         self.assertEqual(blob.get_content(), "sample file")
 
+    def test_blob_lines(self):
+        filename = "file.txt"
+        content = "first line\r\nвторая строка\n\nno newline"
+        self._write_file(self._get_abspath(filename), content)
+        self.repo.stage_file(filename)
+        self.repo.commit()
+
+        blob = git.Blob.from_path(self.repo, filename)
+        # Small chunks split lines and multibyte characters
+        lines = list(blob.iter_lines(chunk_size=3))
+        self.assertEqual(lines, content.splitlines(keepends=True))
+
     def test_note(self):
         filename = "file.txt"
         self._write_file(self._get_abspath(filename), "sample file")
@@ -176,3 +202,110 @@ class TestBlob(TestCaseBase):
                                          git._Note.bootstrap_notes_ref, "list")
         # Make sure previous note has been deleted
         self.assertEqual(len(notes_list.splitlines()), 1)
+
+    def test_cached_notes(self):
+        filename = "file.txt"
+        self._write_file(self._get_abspath(filename), "sample file")
+        blob = self.repo.stage_file(filename)
+        self.repo.commit(f"Created {filename}")
+        the_note = {"blob": blob.id, "path": blob.path, "class": "Script",
+                    "id": 1, "error": None}
+        blob.note = the_note
+
+        self.repo.load_notes()
+        self.assertTrue(self.repo.notes_loaded)
+        self.assertEqual(self.repo.find_note_by_id("Script", 1), the_note)
+
+        self._write_file(self._get_abspath(filename), "sample file, updated")
+        new_blob = self.repo.stage_file(filename)
+        self.repo.commit(f"New version of {filename}")
+        self.assertEqual(new_blob.find_note_on_ancestors().content, the_note)
+        new_note = dict(the_note, blob=new_blob.id)
+        new_blob.note = new_note
+        # Cached notes are updated along with the repository
+        self.assertEqual(self.repo.find_note_by_id("Script", 1), new_note)
+        old_commit = self.repo.repo.head.commit.parents[0]
+        self.assertIsNone(git.Blob.from_path(self.repo, filename, commit=old_commit).note.content)
+
+        # Notes changed by another process are reloaded on refresh()
+        other_repo = git.Repo(self.repo_path)
+        git.Blob.from_path(other_repo, filename).note.clear()
+        self.assertEqual(self.repo.find_note_by_id("Script", 1), new_note)
+        self.repo.refresh()
+        self.assertIsNone(self.repo.find_note_by_id("Script", 1))
+
+    def test_notes_transaction(self):
+        blobs = []
+        for name in ["file1", "file2", "file3"]:
+            self._write_file(self._get_abspath(name), f"file {name}")
+            blobs.append(self.repo.stage_file(name))
+        self.repo.commit(message="Create some files")
+        blobs[2].note = {"blob": blobs[2].id, "path": "file3", "class": "Script",
+                         "id": 3, "error": None}
+
+        notes_ref = self.repo._get_notes_ref_id()
+        with self.repo.notes_transaction():
+            for i, blob in enumerate(blobs[:2], start=1):
+                blob.note = {"blob": blob.id, "path": blob.path, "class": "Script",
+                             "id": i, "error": None}
+            blobs[2].note.clear()
+            # Nothing is written until the transaction ends
+            self.assertEqual(self.repo._get_notes_ref_id(), notes_ref)
+            self.assertEqual(self.repo.find_note_by_id("Script", 1)["path"], "file1")
+        commit = self.repo.repo.commit(git._Note.bootstrap_notes_ref)
+        self.assertEqual(commit.parents[0].hexsha, notes_ref)
+
+        other_repo = git.Repo(self.repo_path)
+        self.assertEqual(git.Blob.from_path(other_repo, "file2").note.content["id"], 2)
+        self.assertIsNone(git.Blob.from_path(other_repo, "file3").note.content)
+        other_repo.load_notes()
+        self.assertEqual(set(other_repo.object_index["Script"].keys()), {1, 2})
+
+        # Notes of failed transaction are discarded
+        with self.assertRaises(RuntimeError):
+            with self.repo.notes_transaction():
+                blobs[0].note.clear()
+                raise RuntimeError("interrupted")
+        self.assertEqual(self.repo._get_notes_ref_id(), commit.hexsha)
+        self.assertEqual(self.repo.find_note_by_id("Script", 1)["path"], "file1")
+
+    def test_notes_transaction_git_calls(self):
+        # Blobs, trees and commits are written without running git
+        names = [f"file{i}" for i in range(26)]
+        for name in names:
+            self._write_file(self._get_abspath(name), f"file {name}")
+        with self._count_git_calls() as calls:
+            blobs = self.repo.stage_files(names)
+            self.repo.commit(message="Create some files")
+        # git only reads objects, in two processes that are kept running
+        self.assertEqual(sorted(calls), ["cat-file --batch", "cat-file --batch-check"])
+
+        with self.repo.notes_transaction():
+            blobs[0].note = {"blob": blobs[0].id, "path": blobs[0].path, "class": "Script",
+                             "id": 0, "error": None}
+        for start, end in ((1, 6), (6, 26)):
+            with self._count_git_calls() as calls:
+                with self.repo.notes_transaction():
+                    for i, blob in enumerate(blobs[start:end], start=start):
+                        blob.note = {"blob": blob.id, "path": blob.path, "class": "Script",
+                                     "id": i, "error": None}
+            # Notes are listed, then the notes ref is moved
+            self.assertEqual([call.split()[0] for call in calls], ["notes", "update-ref"])
+        other_repo = git.Repo(self.repo_path)
+        other_repo.load_notes()
+        self.assertEqual(len(other_repo.object_index["Script"]), 26)
+
+    def test_detect_changes_in_range(self):
+        for name in ["file1", "file2"]:
+            self._write_file(self._get_abspath(name), f"file {name}")
+            self.repo.stage_file(name)
+        first = self.repo.commit(message="Create some files")
+        self._write_file(self._get_abspath("file1"), "file file1, updated")
+        self.repo.stage_file("file1")
+        second = self.repo.commit(message="Edit file1")
+
+        (added, deleted, changed) = self.repo.detect_changes(old_state=first, new_state=second)
+        self.assertEqual(len(added), 0)
+        self.assertEqual(len(deleted), 0)
+        self.assertEqual([b.path for b in changed], ["file1"])
+        self.assertEqual(changed[0].get_content(), "file file1, updated")
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import threading
+import unittest
+from requests.exceptions import HTTPError, ConnectionError
+from netmri_bootstrap import profiling
+from netmri_bootstrap.concurrency import run_parallel
+from netmri_bootstrap.governor import RequestGovernor
+
+
+class FakeResponse():
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def http_error(status, headers=None):
+    return HTTPError(f"HTTP {status}", response=FakeResponse(status, headers))
+
+
+class TestGovernor(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+
+    def _request(self, governor, error=None):
+        with governor.slot():
+            if error is not None:
+                raise error
+
+    def test_additive_increase(self):
+        governor = RequestGovernor("netmri", max_window=8)
+        self.assertEqual(governor.window, 4)
+        for i in range(100):
+            self._request(governor)
+        self.assertEqual(governor.window, 8)
+        self.assertEqual(governor.in_flight, 0)
+
+    def test_multiplicative_decrease(self):
+        governor = RequestGovernor("netmri", max_window=8)
+        for error in (http_error(503), http_error(429), ConnectionError("refused")):
+            before = governor.window
+            with self.assertRaises(Exception):
+                self._request(governor, error)
+            self.assertEqual(governor.window, max(1, before / 2))
+        self.assertEqual(governor.throttle_events, 3)
+        # Client errors say nothing about server load
+        with self.assertRaises(HTTPError):
+            self._request(governor, http_error(404))
+        self.assertEqual(governor.throttle_events, 3)
+
+    def test_slow_response(self):
+        governor = RequestGovernor("netmri", max_window=8, latency_target=0.01)
+        with governor.slot():
+            time.sleep(0.02)
+        self.assertEqual(governor.window, 2)
+
+    def test_one_decrease_per_burst(self):
+        governor = RequestGovernor("netmri", max_window=8)
+        # Both requests are sent before the first failure is seen
+        first = governor.slot()
+        second = governor.slot()
+        first.__enter__()
+        second.__enter__()
+        for slot in (first, second):
+            # Exception isn't suppressed
+            self.assertFalse(slot.__exit__(HTTPError, http_error(503), None))
+        self.assertEqual(governor.window, 2)
+
+    def test_retry_after(self):
+        governor = RequestGovernor("netmri", max_window=8)
+        with self.assertRaises(HTTPError):
+            self._request(governor, http_error(429, {"Retry-After": "0.2"}))
+        start = time.monotonic()
+        self._request(governor)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_concurrency_cap(self):
+        tracer = profiling.enable()
+        governor = RequestGovernor("netmri", max_window=2)
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def request(i):
+            with governor.slot():
+                with lock:
+                    active.append(i)
+                    peak.append(len(active))
+                time.sleep(0.01)
+                with lock:
+                    active.remove(i)
+        results = run_parallel(request, range(20), max_workers=8)
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertLessEqual(max(peak), 2)
+        self.assertGreater(tracer.stats[("governor", "governor wait")][0], 0)
+        counters = [e for e in tracer.events if e["ph"] == "C" and e["name"] == "governor netmri"]
+        self.assertTrue(counters)
+        self.assertEqual(counters[-1]["args"]["in_flight"], 0)
+
+    def test_async_slot(self):
+        governor = RequestGovernor("netmri", max_window=2)
+        active = []
+        peak = []
+
+        async def request(i):
+            async with governor.async_slot():
+                active.append(i)
+                peak.append(len(active))
+                await asyncio.sleep(0.01)
+                active.remove(i)
+                if i == 0:
+                    raise http_error(503)
+
+        async def main():
+            return await asyncio.gather(*(request(i) for i in range(10)), return_exceptions=True)
+        results = asyncio.run(main())
+        self.assertIsInstance(results[0], HTTPError)
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(governor.in_flight, 0)
+        self.assertEqual(governor.throttle_events, 1)
@@ -0,0 +1,75 @@
+import io
+import os
+import json
+import contextlib
+import importlib.util
+from tests.base import FakeNetMRITestCase, BASE_PATH
+
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "..", "scripts", "netmri-bootstrap.py")
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("netmri_bootstrap_script", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestBatch(FakeNetMRITestCase):
+    """Runs batch subcommand against fake server"""
+    repo_path = f"{BASE_PATH}/batch_repo"
+    batch_path = f"{BASE_PATH}/batch.txt"
+    catalog_args = {"scripts": 6}
+    class_paths = {"Script": "scripts", "ScriptModule": "script_modules"}
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        bs = self.init_repo()
+        self.script = load_script()
+        self.paths = self.get_paths(bs.repo, "scripts/", ".py")
+
+    def tearDown(self):
+        super(TestBatch, self).tearDown()
+        os.system(f"rm -f {self.batch_path}")
+
+    def _run_batch(self, lines, **kwargs):
+        with open(self.batch_path, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ok = self.script.run_batch(self.script.build_parser(), self.batch_path, **kwargs)
+        return ok, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_batch(self):
+        ok, results = self._run_batch([
+            "# Comments and blank lines are skipped",
+            f"cat {self.paths[0]} {self.paths[1]}",
+            "",
+            f"sync_id {' '.join(self.paths)}",
+            f"fetch {self.paths[0]}",
+            "check --brief"])
+        self.assertTrue(ok)
+        self.assertEqual([r["line"] for r in results], [2, 4, 5, 6])
+        self.assertEqual([r["status"] for r in results], ["ok"] * 4)
+        self.assertIn("Script-Description", results[0]["output"])
+        self.assertEqual(results[3]["result"], 0)
+        # One API client for all subcommands
+        self.assertEqual(self.server.stats["scripts/index"]["requests"], 2)
+
+    def test_batch_stops_on_error(self):
+        ok, results = self._run_batch([
+            f"cat {self.paths[0]}",
+            "cat scripts/missing.py",
+            "check --no-such-option",
+            "check --brief"])
+        self.assertFalse(ok)
+        self.assertEqual([r["status"] for r in results], ["ok", "error"])
+        self.assertIn("missing.py", results[1]["error"])
+
+        ok, results = self._run_batch([
+            "cat scripts/missing.py",
+            "check --no-such-option",
+            "check --brief"], keep_going=True)
+        self.assertFalse(ok)
+        self.assertEqual([r["status"] for r in results], ["error", "error", "ok"])
+        self.assertIn("--no-such-option", results[1]["error"])
@@ -0,0 +1,62 @@
+import time
+import threading
+import unittest
+from netmri_bootstrap.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_stages(self):
+        pipeline = Pipeline("test", queue_size=4)
+        pipeline.add_stage("double", lambda x: x * 2, workers=3)
+        # Odd numbers are dropped
+        pipeline.add_stage("filter", lambda x: x if x % 4 == 0 else None, workers=2)
+        results = []
+        stats = pipeline.run(range(100), results.append)
+        self.assertEqual(sorted(results), [x * 2 for x in range(100) if x % 2 == 0])
+        self.assertEqual([s.name for s in stats], ["double", "filter", "sink"])
+        self.assertEqual(stats[0].items, 100)
+        self.assertEqual(stats[1].dropped, 50)
+        self.assertEqual(stats[2].items, 50)
+
+    def test_bounded_queues(self):
+        produced = []
+        pipeline = Pipeline("test", queue_size=2)
+
+        def source():
+            for i in range(50):
+                produced.append(i)
+                yield i
+
+        def slow(x):
+            time.sleep(0.005)
+            return x
+        consumed = []
+
+        def sink(x):
+            # Source can't get far ahead of the slow stage
+            self.assertLessEqual(len(produced) - len(consumed), 8)
+            consumed.append(x)
+        stats = pipeline.add_stage("slow", slow).run(source(), sink)
+        self.assertEqual(len(consumed), 50)
+        self.assertLessEqual(stats[0].max_depth, 2)
+
+    def test_stage_error(self):
+        def fail(x):
+            if x == 10:
+                raise ValueError("broken item")
+            return x
+        pipeline = Pipeline("test", queue_size=2).add_stage("fail", fail, workers=2)
+        with self.assertRaises(ValueError):
+            pipeline.run(range(1000), lambda x: None)
+        self.assertEqual([t for t in threading.enumerate() if t.name.startswith("test-")], [])
+
+    def test_source_error(self):
+        def source():
+            yield from range(20)
+            raise ConnectionError("index failed")
+        results = []
+        pipeline = Pipeline("test").add_stage("copy", lambda x: x, workers=2)
+        with self.assertRaises(ConnectionError):
+            pipeline.run(source(), results.append)
+        # Items produced before the error are finished
+        self.assertEqual(sorted(results), list(range(20)))
@@ -0,0 +1,48 @@
+import os
+import json
+import unittest
+from netmri_bootstrap import profiling
+
+BASE_PATH = "/tmp/netmri_bootstrap_profiling"
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+        os.system(f"rm -rf {BASE_PATH}")
+
+    def test_disabled(self):
+        self.assertFalse(profiling.is_enabled())
+        with profiling.span("something") as sp:
+            sp.set(status=200)
+        self.assertIsNone(profiling.get_tracer())
+
+    def test_nested_spans(self):
+        tracer = profiling.enable()
+
+        @profiling.traced(category="unittest")
+        def inner():
+            profiling.current_span().set(status=200)
+
+        with profiling.span("outer", category="unittest"):
+            inner()
+            inner()
+        profiling.counter("window", size=4)
+
+        stats = tracer.stats
+        self.assertEqual(stats[("unittest", "outer")][0], 1)
+        inner_stats = stats[("unittest", "TestProfiling.test_nested_spans.<locals>.inner")]
+        self.assertEqual(inner_stats[0], 2)
+        # Self time of outer span excludes time spent in inner()
+        outer_total, outer_self = stats[("unittest", "outer")][1:3]
+        self.assertAlmostEqual(outer_total - outer_self, inner_stats[1])
+
+        os.makedirs(BASE_PATH, exist_ok=True)
+        trace_path = os.path.join(BASE_PATH, "trace.json")
+        tracer.save(trace_path)
+        with open(trace_path) as fh:
+            events = json.load(fh)["traceEvents"]
+        self.assertEqual(len(events), 4)
+        self.assertEqual(events[0]["args"], {"status": 200})
+        self.assertEqual(events[3]["ph"], "C")
+        self.assertIn("outer", tracer.summary())
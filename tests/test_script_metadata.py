@@ -106,3 +106,36 @@ Script-Description: The description
 # END-INTERNAL-SCRIPT-BLOCK
 """
         self.assertEqual(obj.build_metadata_block(), expected)
+
+    def test_parse_header_only(self):
+        header = ("###################################\n"
+                  "# Name:        test list\n"
+                  "# Description: first line\n"
+                  "second line\n"
+                  "###################################\n")
+        body = "\nkey,value\n# Name: not a header\n"
+        consumed = []
+
+        def lines():
+            for line in (header + body).splitlines(keepends=True):
+                consumed.append(line)
+                yield line
+        res = api.ConfigList.metadata_parser.parse(lines())
+        self.assertEqual(res.fields, [("Name", "test list"), ("Description", "first line")])
+        self.assertEqual((res.block_start, res.body_offset), (0, len(header)))
+        # Nothing after the block has been read
+        self.assertEqual("".join(consumed), header)
+
+        obj = api.ConfigList(id=None, path="config_lists/test list.csv")
+        obj._content = header + body
+        obj.set_metadata_from_content()
+        self.assertEqual(obj.name, "test list")
+        self.assertEqual(obj._strip_metadata_block(), body)
+
+    def test_parse_header_without_block(self):
+        obj = api.ScriptModule(id=None)
+        obj.path = "script_modules/test.py"
+        obj._content = "import os\n# Export of Script Module: not a header\n"
+        obj.set_metadata_from_content()
+        self.assertEqual(obj.name, "test.py")
+        self.assertEqual(obj._strip_metadata_block(), obj._content)
@@ -0,0 +1,105 @@
+import os
+import stat
+import unittest
+from httmock import HTTMock, urlmatch
+from netmri_bootstrap.client import NetMRIClient
+from netmri_bootstrap.session import SessionStore
+
+BASE_PATH = "/tmp/netmri_bootstrap_sessions"
+SCRIPTS_INDEX = r'{"scripts": [], "total": 0}'
+
+
+def setUpModule():
+    os.system(f"mkdir -p {BASE_PATH}")
+
+
+def tearDownModule():
+    os.system(f"rm -rf {BASE_PATH}")
+
+
+class FakeServer():
+    """Issues session cookie on authentication and accepts only known ones"""
+
+    def __init__(self):
+        self.auth_count = 0
+        self.valid_sessions = set()
+
+    def authenticate(self, url, request):
+        self.auth_count += 1
+        session_id = f"session{self.auth_count}"
+        self.valid_sessions.add(session_id)
+        return {'status_code': 200, 'content': r"{}",
+                'headers': {'content-type': 'application/json',
+                            'set-cookie': f"netmri_session={session_id}; Path=/"}}
+
+    def scripts_index(self, url, request):
+        cookie = request.headers.get("Cookie", "")
+        session_id = cookie.replace("netmri_session=", "")
+        if session_id not in self.valid_sessions:
+            return {'status_code': 401, 'content': r'{"message": "Unauthorized"}',
+                    'headers': {'content-type': 'application/json'}}
+        return {'status_code': 200, 'content': SCRIPTS_INDEX,
+                'headers': {'content-type': 'application/json'}}
+
+    def mocks(self):
+        return [urlmatch(path=r"^/api/authenticate$")(self.authenticate),
+                urlmatch(path=r"^/api/3.1/scripts/index")(self.scripts_index)]
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = f"{BASE_PATH}/cache"
+        self.store = SessionStore(self.cache_dir, ttl=60)
+
+    def tearDown(self):
+        os.system(f"rm -rf {self.cache_dir}")
+
+    def _get_client(self):
+        return NetMRIClient("localhost", "admin", "unittest", api_version="3.1",
+                            session_store=self.store)
+
+    def test_session_reused(self):
+        server = FakeServer()
+        with HTTMock(*server.mocks()):
+            self._get_client().api_request("scripts/index", {})
+            self.assertEqual(server.auth_count, 1)
+            # Next run doesn't have to authenticate
+            self._get_client().api_request("scripts/index", {})
+            self.assertEqual(server.auth_count, 1)
+
+    def test_session_file_permissions(self):
+        server = FakeServer()
+        with HTTMock(*server.mocks()):
+            self._get_client().api_request("scripts/index", {})
+        files = os.listdir(self.cache_dir)
+        self.assertEqual(len(files), 1)
+        mode = os.stat(os.path.join(self.cache_dir, files[0])).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_rejected_session_refreshed(self):
+        server = FakeServer()
+        with HTTMock(*server.mocks()):
+            self._get_client().api_request("scripts/index", {})
+            # Server has forgotten the session (e. g. it was restarted)
+            server.valid_sessions.clear()
+            res = self._get_client().api_request("scripts/index", {})
+            self.assertEqual(res, {"scripts": [], "total": 0})
+            self.assertEqual(server.auth_count, 2)
+            self.assertEqual(self.store.load("https://localhost", "admin")[0]["value"],
+                             "session2")
+
+    def test_expired_session(self):
+        class FakeCookie():
+            name = "netmri_session"
+            value = "session1"
+            domain = "localhost"
+            path = "/"
+            secure = False
+        self.store.save("https://localhost", "admin", [FakeCookie()])
+        self.assertIsNotNone(self.store.load("https://localhost", "admin"))
+        # Sessions are scoped per user
+        self.assertIsNone(self.store.load("https://localhost", "other"))
+        self.store.ttl = -1
+        self.store.save("https://localhost", "admin", [FakeCookie()])
+        self.assertIsNone(self.store.load("https://localhost", "admin"))
+        self.assertEqual(os.listdir(self.cache_dir), [])
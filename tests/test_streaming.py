@@ -0,0 +1,57 @@
+import json
+import unittest
+import email.parser
+import email.policy
+from netmri_bootstrap import streaming
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJsonString(unittest.TestCase):
+    content = 'DeviceID,"Text"\n1,\\ back\tslash\n2,юникод \U0001F600\n' * 20
+
+    def _decode(self, data, size, key="content"):
+        return "".join(streaming.iter_json_string(split(data, size), key))
+
+    def test_streamed(self):
+        for ensure_ascii in (True, False):
+            data = json.dumps({"content": self.content, "id": 1}, ensure_ascii=ensure_ascii)
+            # Small chunks split escapes, surrogate pairs and UTF-8 sequences
+            for size in (1, 3, 7, 4096):
+                self.assertEqual(self._decode(data.encode("utf8"), size), self.content)
+
+    def test_incremental(self):
+        data = json.dumps({"content": self.content}).encode("utf8")
+        pieces = streaming.iter_json_string(split(data, 100))
+        self.assertLess(len(next(pieces)), len(self.content))
+
+    def test_fallback(self):
+        data = json.dumps({"id": 1, "content": self.content}).encode("utf8")
+        self.assertEqual(self._decode(data, 5), self.content)
+        with self.assertRaises(ValueError):
+            self._decode(b'{"content": "unterminated', 5)
+
+    def test_text(self):
+        data = self.content.encode("utf8")
+        self.assertEqual("".join(streaming.iter_text(split(data, 3))), self.content)
+
+
+class TestMultipartBody(unittest.TestCase):
+    def test_body(self):
+        content = "Name: list\nюникод\n" * 100
+        body = streaming.MultipartBody()
+        body.add_field("overwrite_ind", "1", filename="overwrite_ind")
+        body.add_stream("file", lambda: split(content.encode("utf8"), 7),
+                        len(content.encode("utf8")), filename="file")
+        data = b"".join(body)
+        self.assertEqual(len(body), len(data))
+        # Body can be sent again
+        self.assertEqual(b"".join(body), data)
+
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {body.content_type}\r\n\r\n".encode() + data)
+        parts = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                 for part in message.iter_parts()}
+        self.assertEqual(parts, {"overwrite_ind": b"1", "file": content.encode("utf8")})
@@ -0,0 +1,41 @@
+import json
+import unittest
+from urllib.parse import parse_qs
+from httmock import HTTMock, urlmatch
+from netmri_bootstrap.webui_broker import IssueAdhocBroker
+
+
+def issue_row(i):
+    return {"IssueAdHocID": i, "IssueTypeID": f"CustomIssue{i}", "Title": f"custom issue {i}",
+            "Correctness": "on", "Stability": "off"}
+
+
+class TestIssueAdhocBroker(unittest.TestCase):
+    def setUp(self):
+        self.broker = IssueAdhocBroker(host="netmri", login="admin", password="admin",
+                                       page_size=5)
+        self.queries = []
+
+    @urlmatch(path=r"/webui/grid_data/.*")
+    def unpaged_grid(self, url, request):
+        """Grid that ignores start and limit and doesn't report total"""
+        self.queries.append(parse_qs(url.query))
+        return {"status_code": 200, "headers": {"content-type": "application/json"},
+                "content": json.dumps({"rows": [issue_row(i) for i in range(12)]})}
+
+    def test_unpaged_grid(self):
+        with HTTMock(self.unpaged_grid):
+            rows = list(self.broker.iter_rows())
+        self.assertEqual([row.id for row in rows], list(range(12)))
+        # Second page has only rows already seen
+        self.assertEqual([query["start"] for query in self.queries], [["0"], ["12"]])
+
+    def test_find(self):
+        with HTTMock(self.unpaged_grid):
+            found = self.broker.find("IssueTypeID", "CustomIssue1")
+        self.assertEqual([row.id for row in found], [1])
+        query = self.queries[0]
+        self.assertEqual(json.loads(query["fields"][0]), ["IssueTypeID"])
+        self.assertEqual(query["query"], ["CustomIssue1"])
+        with self.assertRaises(ValueError):
+            self.broker.find("Details", "anything")